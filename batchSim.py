@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
-import collections
-import time
+import os
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib
 
 try:
@@ -20,10 +20,15 @@ from lib.packet import *
 from lib.mac import *
 from lib.discrete_event import *
 from lib.node import *
-
-# TODO - There should really be two separate concepts here, a STATE and a CONFIG
-# today, the config also maintains state
-conf = Config()
+from lib.analytic import estimateFromPositions
+from lib.shared import SharedTopologies, runShared
+from lib.simulation import Simulation
+from lib.topology import TopologyCache, topologyFromPositions
+from lib.stats import AdaptiveRepetitions
+from lib.telemetry import TelemetryWriter, simulationProgress
+
+# Default parameters, used for node placement and the progress interval
+conf = Config().freeze()
 VERBOSE = False
 SHOW_GRAPH = False
 SAVE = True
@@ -40,9 +45,47 @@ routerTypes = [conf.ROUTER_TYPE.MANAGED_FLOOD]
 # How many times should each combination run
 repetitions = 3
 
+# Set to True to let the number of repetitions adapt per combination: runs are added
+# until the confidence interval width of each metric in ciTargets drops below its target
+# (in percentage points), with at least minRepetitions and at most maxRepetitions runs.
+ADAPTIVE_REPETITIONS = False
+minRepetitions = 3
+maxRepetitions = 30
+ciTargets = {"Reachability": 2.0, "CollisionRate": 2.0}
+ciConfidence = 0.95
+
 # How many nodes should be simulated in each test
 numberOfNodes = [3, 5, 10, 15, 30]
 
+# Set to True to first estimate each combination analytically from the link graph of its
+# first topology, which takes well under a second. The estimate is printed and saved in the
+# report next to the simulated metrics. Combinations with an estimated reachability below
+# ANALYTIC_MIN_REACHABILITY (%) are not simulated; None simulates all of them.
+ANALYTIC_SCREENING = False
+ANALYTIC_MIN_REACHABILITY = None
+
+# Write progress telemetry as JSON lines to this file, or to a local
+# UDP socket given as "udp://127.0.0.1:<port>". None disables telemetry.
+TELEMETRY = None
+
+# Directory in which generated topologies are stored, keyed by the placement parameters, the
+# number of nodes and the repetition, so later campaigns load them instead of placing nodes again.
+# None disables the cache.
+TOPOLOGY_CACHE = os.path.join("out", "topologies")
+
+# Directory in which the link tables (distance, path loss, offsets, RSSI) of each topology are
+# stored as memory-mapped files, so all router types and later campaigns on the same topology
+# read them instead of computing them again. These take about 50 bytes per pair of nodes for
+# each seed, so set this for large static scenarios. None computes them in memory for every run.
+LINK_CACHE = None
+
+# Number of worker processes that simulate the repetitions of a combination in parallel, or None
+# to simulate them one by one in this process. Workers share the positions, distances and path loss
+# of each topology through shared memory, instead of each holding a copy. Progress is then only
+# printed per finished run, but every worker writes its progress to TELEMETRY, and SHOW_GRAPH is
+# ignored. With ADAPTIVE_REPETITIONS, up to WORKERS-1 more runs than needed may be done.
+WORKERS = None
+
 
 #######################################
 ####### SET BATCH PARAMS ABOVE ########
@@ -55,67 +98,6 @@ else:
     def verboseprint(*args, **kwargs): 
         pass
 
-###########################################################
-# Progress-logging process
-###########################################################
-def simulationProgress(env, currentRep, repetitions, endTime):
-    """
-    Keep track of the ratio of real time per sim-second over
-    a fixed sliding window, so if the simulation slows down near the end,
-    the time-left estimate adapts quickly.
-    """
-    startWallTime = time.time()
-    lastWallTime = startWallTime
-    lastEnvTime = env.now
-    
-    # We'll store the last N ratio measurements
-    N = 10
-    ratios = collections.deque(maxlen=N)
-    
-    while True:
-        fraction = env.now / endTime
-        fraction = min(fraction, 1.0)
-        
-        # Current real time
-        currentWallTime = time.time()
-        realTimeDelta = currentWallTime - lastWallTime
-        simTimeDelta = env.now - lastEnvTime
-        
-        # Compute new ratio if sim actually advanced
-        if simTimeDelta > 0:
-            instant_ratio = realTimeDelta / simTimeDelta
-            ratios.append(instant_ratio)
-        
-        # If we have at least one ratio, compute a 'recent average'
-        if len(ratios) > 0:
-            avgRatio = sum(ratios) / len(ratios)
-        else:
-            avgRatio = 0.0
-        
-        # time_left_est = avg_ratio * (endTime - env.now)
-        simTimeRemaining = endTime - env.now
-        timeLeftEst = simTimeRemaining * avgRatio
-        
-        # Format mm:ss
-        minutes = int(timeLeftEst // 60)
-        seconds = int(timeLeftEst % 60)
-        
-        print(
-            f"\rSimulation {currentRep+1}/{repetitions} progress: "
-            f"{fraction*100:.1f}% | ~{minutes}m{seconds}s left...",
-            end="", flush=True
-        )
-        
-        # If done or overshoot
-        if fraction >= 1.0:
-            break
-        
-        # Update references
-        lastWallTime = currentWallTime
-        lastEnvTime = env.now
-        
-        yield env.timeout(10 * conf.ONE_SECOND_INTERVAL)
-
 # We will collect the metrics in dictionaries keyed by router type.
 # For example: collisions_dict[ routerType ] = [list of mean collisions, one per nrNodes]
 collisions_dict = {}
@@ -134,6 +116,8 @@ asymmetricLinkRate_dict = {}
 symmetricLinkRate_dict = {}
 noLinkRate_dict = {}
 
+telemetry = TelemetryWriter(TELEMETRY) if TELEMETRY is not None else None
+
 # Initialize dictionaries for each router type
 for rt in routerTypes:
     collisions_dict[rt] = []
@@ -156,40 +140,66 @@ for rt in routerTypes:
 ##############################################################################
 # Pre generate node positions so we have apples to apples between router types
 ##############################################################################
-class TempNode:
-    """A lightweight node-like object with .x and .y attributes."""
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-
-positions_cache = {}  # (nrNodes, rep) -> list of (x, y)
-
-for nrNodes in numberOfNodes:
-    for rep in range(repetitions):
-        random.seed(rep)
-        found = False
-        temp_nodes = []
-        
-        # We attempt to place 'nrNodes' one by one using findRandomPosition,
-        # but pass in a list of TempNode objects so it can do n.x, n.y
-        while not found:
-            temp_nodes = []
-            for _ in range(nrNodes):
-                xnew, ynew = findRandomPosition(conf, temp_nodes)
-                if xnew is None:
-                    # means we failed to place a node
-                    break
-                # Wrap coordinates in a TempNode
-                temp_nodes.append(TempNode(xnew, ynew))
-            
-            if len(temp_nodes) == nrNodes:
-                found = True
-            else:
-                pass
+positions_cache = {}  # (nrNodes, rep) -> nrNodes x 2 array of (x, y)
+topologyCache = TopologyCache(TOPOLOGY_CACHE)
+
+def getPositions(nrNodes, rep):
+    """
+    Returns the positions for (nrNodes, rep), generating them on first use.
+    Placement is seeded by rep only, so every router type gets the same topology.
+    """
+    if (nrNodes, rep) not in positions_cache:
+        positions_cache[(nrNodes, rep)] = topologyCache.get(conf, nrNodes, rep)
+    return positions_cache[(nrNodes, rep)]
 
-        # Convert the final TempNodes to (x, y) tuples
-        coords = [(tn.x, tn.y) for tn in temp_nodes]
-        positions_cache[(nrNodes, rep)] = coords
+if not ADAPTIVE_REPETITIONS:
+    # The number of runs is known up front, so place all nodes before simulating
+    for nrNodes in numberOfNodes:
+        for rep in range(repetitions):
+            getPositions(nrNodes, rep)
+
+def repetitionConf(routerType, rt_i, nrNodes, rep):
+    # For the highest degree of separation between runs, config
+    # should be instantiated every repetition for this router type and node number
+    routerTypeConf = Config()
+    routerTypeConf.SELECTED_ROUTER_TYPE = routerType
+    routerTypeConf.NR_NODES = nrNodes
+    routerTypeConf.updateRouterDependencies()
+
+    effectiveSeed = rt_i * 10000 + rep
+    routerTypeConf.SEED = effectiveSeed
+    return routerTypeConf.freeze()
+
+def simulateRepetition(routerType, rt_i, nrNodes, rep, maxRuns):
+    """ Simulates one repetition in this process, with progress logging and optionally the graph. """
+    routerTypeConf = repetitionConf(routerType, rt_i, nrNodes, rep)
+
+    # Retrieve the pre-generated positions for this (nrNodes, rep)
+    coords = getPositions(nrNodes, rep)
+    simulation = Simulation(routerTypeConf, topologyFromPositions(routerTypeConf, coords), verboseprint, linkCache=LINK_CACHE)
+    simulation.setup()
+    env = simulation.env
+    state = simulation.state
+
+    # Start the progress-logging process
+    cell = {"router": str(routerType), "nrNodes": nrNodes, "rep": rep}
+    env.process(simulationProgress(env, rep, maxRuns, routerTypeConf.SIMTIME, 10 * routerTypeConf.ONE_SECOND_INTERVAL, telemetry, cell,
+                                   state.packetsSent, state.delays, state.messageSeq))
+
+    if SHOW_GRAPH:
+        graph = Graph(routerTypeConf)
+        graph.addNodes(simulation.nodes)
+        if routerTypeConf.MOVEMENT_ENABLED:
+            env.process(GraphRenderer(graph, simulation.nodes).run(env, routerTypeConf.ONE_MIN_INTERVAL))
+
+    # Start simulation
+    return simulation.run()
+
+if WORKERS is not None:
+    executor = ProcessPoolExecutor(max_workers=WORKERS)
+    sharedTopologies = SharedTopologies()
+else:
+    executor = None
 
 ###########################################################
 # Main simulation loops
@@ -217,106 +227,77 @@ for rt_i, routerType in enumerate(routerTypes):
     # Inner loop for each nrNodes
     for p, nrNodes in enumerate(numberOfNodes):
 
-        nodeReach = [0 for _ in range(repetitions)]
-        nodeUsefulness = [0 for _ in range(repetitions)]
-        collisionRate = [0 for _ in range(repetitions)]
-        meanDelay = [0 for _ in range(repetitions)]
-        meanTxAirUtilization = [0 for _ in range(repetitions)]
-        asymmetricLinkRate = [0 for _ in range(repetitions)]
-        symmetricLinkRate = [0 for _ in range(repetitions)]
-        noLinkRate = [0 for _ in range(repetitions)]
+        nodeReach = []
+        nodeUsefulness = []
+        collisionRate = []
+        meanDelay = []
+        meanTxAirUtilization = []
+        asymmetricLinkRate = []
+        symmetricLinkRate = []
+        noLinkRate = []
+        runMetrics = {
+            "CollisionRate": collisionRate,
+            "Reachability": nodeReach,
+            "Usefulness": nodeUsefulness,
+            "meanDelay": meanDelay,
+            "meanTxAirUtil": meanTxAirUtilization
+        }
+
+        if ADAPTIVE_REPETITIONS:
+            repetitionController = AdaptiveRepetitions(ciTargets, minRepetitions, maxRepetitions, ciConfidence)
+        else:
+            repetitionController = AdaptiveRepetitions({}, repetitions, repetitions)
 
         print(f"\n[Router: {routerTypeLabel}] Start of {p+1} out of {len(numberOfNodes)} - {nrNodes} nodes")
 
-        for rep in range(repetitions):
-            # For the highest degree of separation between runs, config
-            # should be instantiated every repetition for this router type and node number
-            routerTypeConf = Config()
-            routerTypeConf.SELECTED_ROUTER_TYPE = routerType
-            routerTypeConf.NR_NODES = nrNodes
-            routerTypeConf.updateRouterDependencies()
-
-            effectiveSeed = rt_i * 10000 + rep
-            routerTypeConf.SEED = effectiveSeed
-            random.seed(effectiveSeed)
-            env = simpy.Environment()
-            bc_pipe = BroadcastPipe(env)
-
-            # Start the progress-logging process
-            env.process(simulationProgress(env, rep, repetitions, routerTypeConf.SIMTIME))
-
-            # Retrieve the pre-generated positions for this (nrNodes, rep)
-            coords = positions_cache[(nrNodes, rep)]
-
-            nodes = []
-            messages = []
-            packets = []
-            delays = []
-            packetsAtN = [[] for _ in range(routerTypeConf.NR_NODES)]
-            messageSeq = {"val": 0}
-
-            if SHOW_GRAPH:
-                graph = Graph(routerTypeConf)
-            for nodeId in range(routerTypeConf.NR_NODES):
-                x, y = coords[nodeId]
-
-                # We create a nodeConfig dict so that MeshNode will use that
-                nodeConfig = {
-                    'x': x,
-                    'y': y,
-                    'z': routerTypeConf.HM,
-                    'isRouter': False,
-                    'isRepeater': False,
-                    'isClientMute': False,
-                    'hopLimit': routerTypeConf.hopLimit,
-                    'antennaGain': routerTypeConf.GL
-                }
-
-                node = MeshNode(
-                    routerTypeConf, nodes, env, bc_pipe, nodeId, routerTypeConf.PERIOD,
-                    messages, packetsAtN, packets, delays, nodeConfig,
-                    messageSeq, verboseprint
-                )
-                nodes.append(node)
-                if SHOW_GRAPH:
-                    graph.addNode(node)
-
-            if routerTypeConf.MOVEMENT_ENABLED and SHOW_GRAPH:
-                env.process(runGraphUpdates(env, graph, nodes))
-
-            totalPairs, symmetricLinks, asymmetricLinks, noLinks = setupAsymmetricLinks(routerTypeConf, nodes)
-
-            # Start simulation
-            env.run(until=routerTypeConf.SIMTIME)
-
-            # Calculate stats
-            nrCollisions = sum([1 for pkt in packets for n in nodes if pkt.collidedAtN[n.nodeid]])
-            nrSensed = sum([1 for pkt in packets for n in nodes if pkt.sensedByN[n.nodeid]])
-            nrReceived = sum([1 for pkt in packets for n in nodes if pkt.receivedAtN[n.nodeid]])
-            nrUseful = sum([n.usefulPackets for n in nodes])
-
-            if nrSensed != 0:
-                collisionRate[rep] = float(nrCollisions) / nrSensed * 100
+        if ANALYTIC_SCREENING:
+            estimateConf = Config()
+            estimateConf.SELECTED_ROUTER_TYPE = routerType
+            estimateConf.NR_NODES = nrNodes
+            estimateConf.updateRouterDependencies()
+            estimateConf.SEED = rt_i * 10000
+            estimateConf = estimateConf.freeze()
+            estimate = estimateFromPositions(estimateConf, getPositions(nrNodes, 0))
+            print('Estimated reachability:', round(estimate["Reachability"], 2), '| collision rate:', round(estimate["CollisionRate"], 2), '| mean hops:', round(estimate["meanHops"], 2))
+            if ANALYTIC_MIN_REACHABILITY is not None and estimate["Reachability"] < ANALYTIC_MIN_REACHABILITY:
+                print('Skipped, estimated reachability is below', ANALYTIC_MIN_REACHABILITY)
+                for metricList in [collisions, collisionsStds, reachability, reachabilityStds, usefulness, usefulnessStds, meanDelays, delayStds,
+                                   meanTxAirUtils, txAirUtilsStds, asymmetricLinkRateAll, symmetricLinkRateAll, noLinkRateAll]:
+                    metricList.append(np.NaN)
+                continue
+
+        rep = 0
+        while repetitionController.needsMore(runMetrics):
+            if executor is None:
+                runs = [simulateRepetition(routerType, rt_i, nrNodes, rep, repetitionController.maxRuns)]
             else:
-                collisionRate[rep] = np.NaN
-
-            if messageSeq["val"] != 0:
-                nodeReach[rep] = nrUseful / (messageSeq["val"] * (routerTypeConf.NR_NODES - 1)) * 100
-            else:
-                nodeReach[rep] = np.NaN
-
-            if nrReceived != 0:
-                nodeUsefulness[rep] = nrUseful / nrReceived * 100
-            else:
-                nodeUsefulness[rep] = np.NaN
-
-            meanDelay[rep] = np.nanmean(delays)
-            meanTxAirUtilization[rep] = sum([n.txAirUtilization for n in nodes]) / routerTypeConf.NR_NODES
-
-            if routerTypeConf.MODEL_ASYMMETRIC_LINKS:
-                asymmetricLinkRate[rep] = round(asymmetricLinks / totalPairs * 100, 2)
-                symmetricLinkRate[rep] = round(symmetricLinks / totalPairs * 100, 2)
-                noLinkRate[rep] = round(noLinks / totalPairs * 100, 2)
+                tasks = []
+                for r in range(rep, min(rep + WORKERS, repetitionController.maxRuns)):
+                    runConf = repetitionConf(routerType, rt_i, nrNodes, r)
+                    cell = {"router": str(routerType), "nrNodes": nrNodes, "rep": r}
+                    tasks.append((runConf, sharedTopologies.handle(runConf, getPositions(nrNodes, r)), TELEMETRY, cell, repetitionController.maxRuns))
+                runs = executor.map(runShared, tasks)
+
+            for results in runs:
+                routerTypeConf = results.conf
+                if executor is not None:
+                    print(f"Simulation {rep+1}/{repetitionController.maxRuns} done")
+                collisionRate.append(results.collisionRate)
+                nodeReach.append(results.reachability)
+                nodeUsefulness.append(results.usefulness)
+                meanDelay.append(results.meanDelay)
+                meanTxAirUtilization.append(results.meanTxAirUtil)
+
+                if routerTypeConf.MODEL_ASYMMETRIC_LINKS:
+                    asymmetricLinkRate.append(round(results.asymmetricLinks / results.totalPairs * 100, 2))
+                    symmetricLinkRate.append(round(results.symmetricLinks / results.totalPairs * 100, 2))
+                    noLinkRate.append(round(results.noLinks / results.totalPairs * 100, 2))
+                else:
+                    asymmetricLinkRate.append(0)
+                    symmetricLinkRate.append(0)
+                    noLinkRate.append(0)
+
+                rep += 1
 
         # After finishing all repetitions for this nrNodes, compute means/stdevs
         collisions.append(np.nanmean(collisionRate))
@@ -342,10 +323,10 @@ for rt_i, routerType in enumerate(routerTypes):
                 "Usefulness": nodeUsefulness,
                 "meanDelay": meanDelay,
                 "meanTxAirUtil": meanTxAirUtilization,
-                "nrCollisions": nrCollisions,
-                "nrSensed": nrSensed,
-                "nrReceived": nrReceived,
-                "usefulPackets": nrUseful,
+                "nrCollisions": results.nrCollisions,
+                "nrSensed": results.nrSensed,
+                "nrReceived": results.nrReceived,
+                "usefulPackets": results.nrUseful,
                 "MODEM": routerTypeConf.NR_NODES,
                 "MODEL": routerTypeConf.MODEL,
                 "NR_NODES": routerTypeConf.NR_NODES,
@@ -357,13 +338,20 @@ for rt_i, routerType in enumerate(routerTypes):
                 "SIMTIME": routerTypeConf.SIMTIME,
                 "PERIOD": routerTypeConf.PERIOD,
                 "PACKETLENGTH": routerTypeConf.PACKETLENGTH,
-                "nrMessages": messageSeq["val"],
+                "nrMessages": results.nrMessages,
+                "nrRuns": rep,
+                "estReachability": estimate["Reachability"] if ANALYTIC_SCREENING else np.NaN,
+                "estCollisionRate": estimate["CollisionRate"] if ANALYTIC_SCREENING else np.NaN,
                 "SELECTED_ROUTER_TYPE": routerTypeLabel
             }
             subdir = "hopLimit3"
             simReport(routerTypeConf, data, subdir, nrNodes)
 
         # Print summary
+        print('Number of runs:', rep)
+        if ADAPTIVE_REPETITIONS:
+            for metric, width in repetitionController.widths(runMetrics).items():
+                print(f'{metric} confidence interval width:', round(width, 2))
         print('Collision rate average:', round(np.nanmean(collisionRate), 2))
         print('Reachability average:', round(np.nanmean(nodeReach), 2))
         print('Usefulness average:', round(np.nanmean(nodeUsefulness), 2))
@@ -390,6 +378,12 @@ for rt_i, routerType in enumerate(routerTypes):
     symmetricLinkRate_dict[routerType] = symmetricLinkRateAll
     noLinkRate_dict[routerType] = noLinkRateAll
 
+if telemetry is not None:
+    telemetry.close()
+if executor is not None:
+    executor.shutdown()
+    sharedTopologies.close()
+
 ###########################################################
 # Plotting
 ###########################################################
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+""" Capacity search for the discrete-event simulator.
+    Finds the value of a Config parameter at which a metric crosses a threshold, e.g. the number
+    of nodes at which reachability drops below 80%, using far fewer runs than a full grid in batchSim.py.
+
+    Usage: python3 capacitySearch.py <param> <low> <high> [--metric METRIC] [--threshold THRESHOLD]
+                                     [--set NAME=VALUE ...] [--workers N]
+    Example: python3 capacitySearch.py NR_NODES 5 100 --metric Reachability --threshold 80
+"""
+import argparse
+import ast
+import os
+import sys
+
+from lib.config import Config
+from lib.search import CapacitySearch
+
+
+def parseValue(string):
+    try:
+        return ast.literal_eval(string)
+    except (ValueError, SyntaxError):
+        return string
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='capacitySearch')
+    parser.add_argument('param', type=str, help='Config parameter to search over, e.g. NR_NODES or PERIOD')
+    parser.add_argument('low', type=parseValue)
+    parser.add_argument('high', type=parseValue)
+    parser.add_argument('--metric', type=str, default='Reachability', choices=['CollisionRate', 'Reachability', 'Usefulness', 'meanDelay', 'meanTxAirUtil'])
+    parser.add_argument('--threshold', type=float, default=80.0)
+    parser.add_argument('--tolerance', type=float, default=None, help='stop when the bracket is this narrow')
+    parser.add_argument('--points', type=int, default=3, help='number of points to probe in parallel per round')
+    parser.add_argument('--min-reps', type=int, default=3)
+    parser.add_argument('--max-reps', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--set', type=str, action='append', default=[], metavar='NAME=VALUE', help='override another Config parameter')
+    parser.add_argument('--cache', type=str, default=os.path.join("out", "search", "probes.jsonl"))
+    args = parser.parse_args()
+
+    conf = Config()
+    if not hasattr(conf, args.param):
+        print("Unknown Config parameter:", args.param)
+        sys.exit(1)
+    overrides = {}
+    for override in args.set:
+        name, value = override.split("=", 1)
+        overrides[name] = parseValue(value)
+    integer = args.param == "NR_NODES" or isinstance(getattr(conf, args.param), int)
+
+    search = CapacitySearch(args.param, args.low, args.high, args.metric, args.threshold, overrides, integer, args.tolerance,
+        args.points, args.min_reps, args.max_reps, workers=args.workers, cachePath=args.cache)
+    result = search.run()
+    if result is None:
+        print(f"{args.metric} does not cross {args.threshold} between {args.param} = {args.low} and {args.high}.")
+        sys.exit(1)
+    for value, mean in result["means"].items():
+        print(f"{args.param} = {value}: {args.metric} = {round(mean, 2)} ({result['runs'][value]} runs)")
+    print(f"{args.metric} crosses {args.threshold} at {args.param} = {round(result['knee'], 2)} (between {result['low']} and {result['high']})")
+    print(f"Simulations run: {result['nrSimulated']}, reused from cache: {result['nrCached']}")
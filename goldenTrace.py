@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+""" Golden-trace harness for the discrete-event simulator.
+    Records a canonical event trace (generations, transmissions, receptions, collisions and drops)
+    of a seeded scenario, and compares two traces to find the first divergent event.
+    Use it to check that a performance change to the node, PHY or MAC code does not change results.
+
+    Usage: python3 goldenTrace.py record [nrNodes] [--seed SEED] [--out FILE] [--hash-only]
+           python3 goldenTrace.py compare <traceA> <traceB>
+"""
+import argparse
+import os
+import sys
+
+from lib.config import Config
+from lib.simulation import Simulation
+from lib.trace import EventTrace, compareTraces
+
+
+def record(nrNodes, seed, out, hashOnly):
+    conf = Config()
+    conf.NR_NODES = nrNodes
+    conf.SEED = seed
+    conf.updateRouterDependencies()
+    conf = conf.freeze()
+
+    trace = EventTrace(None if hashOnly else out)
+    Simulation(conf, trace=trace).run()
+
+    digest = trace.close()
+    if hashOnly:
+        with open(out, 'w') as file:
+            file.write("# digest {} events {}\n".format(digest, trace.count))
+    print("Recorded", trace.count, "events of", nrNodes, "nodes with seed", seed, "to", out)
+    print("Digest:", digest)
+
+
+def compare(pathA, pathB):
+    divergence = compareTraces(pathA, pathB)
+    if divergence is None:
+        print("Traces are identical.")
+        return 0
+    index, a, b = divergence
+    if index is None:
+        print("Trace digests differ.")
+    else:
+        print("Traces diverge at event", index)
+    print("  "+pathA+":", a)
+    print("  "+pathB+":", b)
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='goldenTrace')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    recordParser = subparsers.add_parser('record', help='record the event trace of a seeded scenario')
+    recordParser.add_argument('nrNodes', type=int, nargs='?', default=10)
+    recordParser.add_argument('--seed', type=int, default=Config().SEED)
+    recordParser.add_argument('--out', type=str, default=os.path.join("out", "trace.txt"))
+    recordParser.add_argument('--hash-only', action='store_true', help='only store the rolling hash of the trace')
+    compareParser = subparsers.add_parser('compare', help='report the first divergent event of two traces')
+    compareParser.add_argument('traceA', type=str)
+    compareParser.add_argument('traceB', type=str)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        if args.nrNodes < 2:
+            print("Need at least two nodes.")
+            sys.exit(1)
+        if os.path.dirname(args.out) and not os.path.isdir(os.path.dirname(args.out)):
+            os.makedirs(os.path.dirname(args.out))
+        record(args.nrNodes, args.seed, args.out, args.hash_only)
+    else:
+        sys.exit(compare(args.traceA, args.traceB))
@@ -25,6 +25,9 @@ if sim.script:  # Use '--s' as argument if you want to specify what you want to
         """ Ping node 1 from node 0. """
         # sim.sendPing(fromNode, toNode)
 
+        """ Send 2 random messages per second for 60 s and report their delivery and latency. """
+        # LoadGenerator(sim).run(rateSchedule([n.nodeid for n in sim.nodes], 2, 60))
+
         """ Admin Message (setOwner) from node 0 to node 1.
             First you need to add a shared admin channel. """
         # for n in sim.nodes:
@@ -0,0 +1,91 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+from lib.common import TempNode
+from lib.links import linkOffsets, linkRssi, pathLossTables
+from . import phy
+
+
+def rssiMatrix(conf, nodes, offsets):
+    """ RSSI of a packet from transmitter i at receiver j, as used by MeshPacket. """
+    ids = np.array([n.nodeid for n in nodes])
+    _, rssi = linkRssi(conf, nodes, pathLossTables(conf, nodes)["pathLoss"], offsets[np.ix_(ids, ids)])
+    np.fill_diagonal(rssi, -np.inf)
+    return rssi
+
+
+def estimateNetwork(conf, nodes, offsets=None, iterations=5):
+    """
+    Sub-second estimate of the performance of a static network, without running the discrete-event simulator.
+    nodes can be any objects with nodeid, x, y, z and antennaGain. The link graph contains an edge i -> j if j
+    can sense packets from i, and hop distances follow from a breadth-first search on this graph.
+    Collisions are approximated with pure ALOHA among hidden terminals: since nodes listen before talking,
+    a packet from t only collides at r with packets of nodes that r senses but t does not. It survives with
+    probability exp(-2G), where G is the offered load (in Erlang) of those nodes.
+    A flood is then propagated ring by ring: a node that received a message with hops left rebroadcasts it once.
+    Since the load depends on how far floods get, this is iterated a few times.
+    Only broadcasts are modeled, so ACKs, retransmissions and the rebroadcast cancellation of managed
+    flooding are ignored, and neither are losses due to a node being busy transmitting. The load is
+    therefore an upper bound, and the reachability is optimistic, so it is safe to skip parameter
+    regions in which even this estimate is poor.
+    """
+    if offsets is None:
+        offsets = linkOffsets(conf)
+    nrNodes = len(nodes)
+    rssi = rssiMatrix(conf, nodes, offsets)
+    canHear = rssi >= conf.SENSMODEM[conf.MODEM]  # canHear[i, j]: j senses packets from i
+    hidden = ~canHear.T  # hidden[t, u]: t cannot sense u
+    np.fill_diagonal(hidden, False)
+
+    hops = shortest_path(csr_matrix(canHear), unweighted=True, directed=True)
+    packetAirtime = phy.airtime(conf, conf.SFMODEM[conf.MODEM], conf.CRMODEM[conf.MODEM], conf.PACKETLENGTH, conf.BWMODEM[conf.MODEM])
+
+    # Start from collision-free floods: a node at h <= hopLimit hops from the origin rebroadcasts
+    transmissions = (hops <= conf.hopLimit).astype(float)  # transmissions[i, k]: expected nr. of times k sends a message of i
+    for _ in range(iterations):
+        txLoad = transmissions.sum(axis=0) / conf.PERIOD * packetAirtime  # fraction of time each node transmits
+        interference = (hidden * txLoad) @ canHear
+        success = canHear * np.exp(-2 * interference)  # success[t, r]: probability r decodes a packet from t
+        logMiss = np.log1p(-np.minimum(success, 1 - 1e-12))
+
+        reach = np.eye(nrNodes)  # reach[i, j]: probability j has the message of origin i
+        frontier = np.eye(nrNodes)  # probability j newly got the message in the previous ring
+        newTransmissions = np.eye(nrNodes)
+        for ring in range(1, conf.hopLimit + 2):
+            # Probability that at least one sender of the ring gets through, approximating
+            # 1 - f*s by (1 - s)**f, which is exact when it is certain whether a node sends
+            newly = (1 - reach) * (1 - np.exp(frontier @ logMiss))
+            reach += newly
+            frontier = newly
+            if ring <= conf.hopLimit:
+                newTransmissions += newly
+        # Damped update, since load and reach pull in opposite directions
+        transmissions = (transmissions + newTransmissions) / 2
+
+    txLoad = transmissions.sum(axis=0) / conf.PERIOD * packetAirtime
+    reached = (hops <= conf.hopLimit + 1) & ~np.eye(nrNodes, dtype=bool)
+    pairs = nrNodes * (nrNodes - 1)
+    sensedRate = canHear * txLoad[:, np.newaxis]  # how often each link carries a packet
+    return {
+        "Reachability": (reach.sum() - nrNodes) / pairs * 100 if pairs > 0 else np.nan,
+        "ReachabilityNoCollisions": reached.sum() / pairs * 100 if pairs > 0 else np.nan,
+        "CollisionRate": np.sum(sensedRate * (1 - success)) / sensedRate.sum() * 100 if sensedRate.sum() > 0 else np.nan,
+        "meanHops": np.mean(hops[reached]) if reached.any() else np.nan,
+        "meanTxAirUtil": np.mean(txLoad) * conf.SIMTIME,
+        "channelUtilization": canHear.T.astype(float) @ txLoad * 100,
+        "hops": hops,
+        "canHear": canHear,
+    }
+
+
+def estimateFromPositions(conf, coords):
+    """ estimateNetwork for nodes at the given (x, y) positions with the default height and antenna gain. """
+    nodes = []
+    for nodeId, (x, y) in enumerate(coords):
+        node = TempNode(x, y)
+        node.nodeid = nodeId
+        node.z = conf.HM
+        node.antennaGain = conf.GL
+        nodes.append(node)
+    return estimateNetwork(conf, nodes)
@@ -0,0 +1,224 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+import google.protobuf.json_format as proto
+import numpy as np
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from meshtastic import mesh_pb2, portnums_pb2
+
+from lib.config import PLACEMENT_PARAMS
+
+# Parameters stored in a capture to plot its scenario again
+CAPTURE_PARAMS = PLACEMENT_PARAMS + ["RANDOM", "hopLimit"]
+
+FRAME_HEADER = struct.Struct('<I')  # every record is prefixed with its length in bytes
+WRITE_QUEUE_SIZE = 10000  # records waiting for the writer thread, after which writing blocks
+WRITE_BUFFER_SIZE = 1 << 16  # bytes
+
+
+def _captureMessages():
+    """
+    Builds the protobuf messages of a capture at runtime, so no generated code is needed:
+
+    message CaptureNode { uint32 node_id; uint32 hw_id; double x; double y; double z; bool is_router; bool is_repeater;
+                          bool is_client_mute; uint32 hop_limit; double antenna_gain; bool neighbor_info; }
+    message CaptureTransmission { uint32 transmitter; int64 message_id; MeshPacket packet;
+                                  repeated uint32 receivers; repeated float rssi; repeated float snr; }
+    message CaptureRecord { double time; oneof record { string config; CaptureNode node; CaptureTransmission transmission; } }
+    """
+    F = descriptor_pb2.FieldDescriptorProto
+    file = descriptor_pb2.FileDescriptorProto(name="meshtasticator/capture.proto", package="meshtasticator", syntax="proto3")
+    file.dependency.append(mesh_pb2.DESCRIPTOR.name)
+
+    def addMessage(name, fields):
+        message = file.message_type.add(name=name)
+        for number, (fieldName, fieldType, extra) in enumerate(fields, start=1):
+            message.field.add(name=fieldName, number=number, type=fieldType, label=F.LABEL_REPEATED if extra == "repeated" else F.LABEL_OPTIONAL,
+                              type_name=extra if fieldType == F.TYPE_MESSAGE else None)
+        return message
+
+    addMessage("CaptureNode", [("node_id", F.TYPE_UINT32, None), ("hw_id", F.TYPE_UINT32, None), ("x", F.TYPE_DOUBLE, None),
+                               ("y", F.TYPE_DOUBLE, None), ("z", F.TYPE_DOUBLE, None), ("is_router", F.TYPE_BOOL, None),
+                               ("is_repeater", F.TYPE_BOOL, None), ("is_client_mute", F.TYPE_BOOL, None), ("hop_limit", F.TYPE_UINT32, None),
+                               ("antenna_gain", F.TYPE_DOUBLE, None), ("neighbor_info", F.TYPE_BOOL, None)])
+    addMessage("CaptureTransmission", [("transmitter", F.TYPE_UINT32, None), ("message_id", F.TYPE_INT64, None),
+                                       ("packet", F.TYPE_MESSAGE, "."+mesh_pb2.MeshPacket.DESCRIPTOR.full_name),
+                                       ("receivers", F.TYPE_UINT32, "repeated"), ("rssi", F.TYPE_FLOAT, "repeated"), ("snr", F.TYPE_FLOAT, "repeated")])
+    record = addMessage("CaptureRecord", [("time", F.TYPE_DOUBLE, None), ("config", F.TYPE_STRING, None),
+                                          ("node", F.TYPE_MESSAGE, ".meshtasticator.CaptureNode"),
+                                          ("transmission", F.TYPE_MESSAGE, ".meshtasticator.CaptureTransmission")])
+    record.oneof_decl.add(name="record")
+    for field in record.field[1:]:
+        field.oneof_index = 0
+
+    pool = descriptor_pool.Default()
+    try:
+        pool.FindFileByName(file.name)
+    except KeyError:
+        pool.Add(file)
+    return [message_factory.GetMessageClass(pool.FindMessageTypeByName("meshtasticator."+name))
+            for name in ("CaptureNode", "CaptureTransmission", "CaptureRecord")]
+
+
+CaptureNode, CaptureTransmission, CaptureRecord = _captureMessages()
+
+
+def configJson(conf):
+    """ The parameters needed to plot the scenario again, as JSON. """
+    return json.dumps({name: getattr(conf, name).tolist() if isinstance(getattr(conf, name), np.ndarray) else getattr(conf, name)
+                       for name in CAPTURE_PARAMS})
+
+
+def applyConfigJson(conf, text):
+    """ Sets the parameters stored by configJson on conf (a Config). """
+    for name, value in json.loads(text).items():
+        setattr(conf, name, np.array(value) if isinstance(getattr(conf, name, None), np.ndarray) else value)
+    return conf
+
+
+class CaptureWriter():
+    """
+    Appends the nodes and radio traffic of an interactive session to a capture file: length-prefixed
+    CaptureRecord protobufs, each with a timestamp. Records are serialized and written by a background
+    thread through a buffer, so capturing neither delays forwarding nor keeps the session in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'ab', buffering=WRITE_BUFFER_SIZE)
+        self.queue = queue.Queue(WRITE_QUEUE_SIZE)
+        self.count = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            data = record.SerializeToString()
+            self.file.write(FRAME_HEADER.pack(len(data)))
+            self.file.write(data)
+            self.count += 1
+        self.file.close()
+
+    def addConfig(self, conf):
+        self.queue.put(CaptureRecord(time=time.time(), config=configJson(conf)))
+
+    def addNode(self, node):
+        self.queue.put(CaptureRecord(time=time.time(), node=CaptureNode(node_id=node.nodeid, hw_id=node.hwId, x=node.x, y=node.y, z=node.z,
+            is_router=bool(node.isRouter), is_repeater=bool(node.isRepeater), is_client_mute=bool(node.isClientMute),
+            hop_limit=node.hopLimit, antenna_gain=node.antennaGain, neighbor_info=bool(node.neighborInfo))))
+
+    def addTransmission(self, transmitter, messageId, meshPacket, receivers, rssis, snrs):
+        transmission = CaptureTransmission(transmitter=transmitter.nodeid, message_id=messageId if messageId is not None else -1,
+                                           receivers=[rx.nodeid for rx in receivers], rssi=rssis, snr=snrs)
+        transmission.packet.CopyFrom(meshPacket)
+        self.queue.put(CaptureRecord(time=time.time(), transmission=transmission))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def readCapture(path):
+    """ Yields the CaptureRecords of a capture file one by one. A record cut off at the end (e.g. after a crash) is skipped. """
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            (length,) = FRAME_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield CaptureRecord.FromString(data)
+
+
+def packetDict(meshPacket):
+    """ A captured MeshPacket as the dictionary that the meshtastic library publishes, including the decoded simulator payload. """
+    packet = proto.MessageToDict(meshPacket)
+    packet["raw"] = meshPacket
+    packet.setdefault("from", 0)
+    packet.setdefault("to", 0)
+    if "decoded" in packet:
+        packet["decoded"]["payload"] = meshPacket.decoded.payload
+        if meshPacket.decoded.portnum == portnums_pb2.PortNum.SIMULATOR_APP:
+            compressed = mesh_pb2.Compressed.FromString(meshPacket.decoded.payload)
+            packet["decoded"]["simulator"] = proto.MessageToDict(compressed)
+            packet["decoded"]["simulator"]["raw"] = compressed
+    return packet
+
+
+class CaptureStatistics():
+    """
+    Statistics of a capture, with the definitions of the discrete-event simulator where they apply:
+    a received packet is useful when its node receives the message for the first time, and the
+    reachability is the percentage of the other nodes that received each message. ACKs and replies
+    share the message ID of their request, but are not counted as useful receptions of it.
+    Only counters and the (message, node) pairs reached are kept, so captures of any length can be read.
+    """
+    def __init__(self):
+        self.nodeIdsByHwId = {}
+        self.origins = {}  # message ID -> node ID of the node that sent it first
+        self.nrTransmissions = 0
+        self.nrReceived = 0
+        self.nrUseful = 0
+        self.reached = set()  # (message ID, node ID) of useful receptions
+        self.txPerNode = {}
+        self.rssiSum = 0.0
+        self.snrSum = 0.0
+        self.start = None
+        self.end = None
+
+    def addNode(self, node):
+        self.nodeIdsByHwId[node.hw_id] = node.node_id
+
+    def addTransmission(self, timestamp, transmission):
+        self.start = timestamp if self.start is None else self.start
+        self.end = timestamp
+        self.nrTransmissions += 1
+        self.txPerNode[transmission.transmitter] = self.txPerNode.get(transmission.transmitter, 0) + 1
+        if transmission.message_id < 0:
+            return
+        if transmission.message_id not in self.origins:
+            self.origins[transmission.message_id] = self.nodeIdsByHwId.get(getattr(transmission.packet, "from"))
+        origin = self.origins[transmission.message_id]
+        isResponse = transmission.packet.decoded.request_id != 0
+        for rx, rssi, snr in zip(transmission.receivers, transmission.rssi, transmission.snr):
+            self.nrReceived += 1
+            self.rssiSum += rssi
+            self.snrSum += snr
+            if not isResponse and rx != origin and (transmission.message_id, rx) not in self.reached:
+                self.reached.add((transmission.message_id, rx))
+                self.nrUseful += 1
+
+    def reachability(self):
+        """ Average percentage of the other nodes that received each message, or None without messages. """
+        nrNodes = len(self.nodeIdsByHwId)
+        if len(self.origins) == 0 or nrNodes < 2:
+            return None
+        return self.nrUseful / (len(self.origins) * (nrNodes - 1)) * 100
+
+    def report(self):
+        nrNodes = len(self.nodeIdsByHwId)
+        nrMessages = len(self.origins)
+        print("Number of nodes:", nrNodes)
+        print("Number of messages:", nrMessages)
+        print("Number of transmissions:", self.nrTransmissions)
+        print("Number of packets received:", self.nrReceived)
+        if self.end is not None:
+            print("Duration (s):", round(self.end - self.start, 1))
+        if self.reachability() is not None:
+            print("Average percentage of nodes reached:", round(self.reachability(), 2))
+        if self.nrReceived > 0:
+            print("Percentage of received packets containing new message:", round(self.nrUseful / self.nrReceived * 100, 2))
+            print("Average RSSI (dBm):", round(self.rssiSum / self.nrReceived, 2))
+            print("Average SNR (dB):", round(self.snrSum / self.nrReceived, 2))
+        for nodeId in sorted(self.txPerNode):
+            print("Node", nodeId, "transmitted", self.txPerNode[nodeId], "packets")
@@ -1,10 +1,12 @@
 import os
 import random
+import time
 
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import yaml
+from matplotlib.collections import EllipseCollection, PolyCollection
 from matplotlib.widgets import Button, Slider, RadioButtons, TextBox
 from . import phy
 
@@ -14,6 +16,9 @@ except ImportError:
 	print('Tkinter is needed. Install python3-tk with your package manager.')
 	exit(1)
 
+SCHEDULE_LABEL_LIMIT = 200  # packets in a time schedule up to which packets and messages are labeled
+GRAPH_LABEL_LIMIT = 100  # nodes up to which placed nodes are labeled with their ID
+
 
 def getParams(conf, args):
 	if len(args) > 3:
@@ -27,8 +32,8 @@ def getParams(conf, args):
 					string = args[2]
 				else:
 					string = 'nodeConfig.yaml'
-				with open(os.path.join("out", string), 'r') as file: 
-					config = yaml.load(file, Loader=yaml.FullLoader)
+				from lib.topology import loadNodeConfig
+				config = loadNodeConfig(conf, os.path.join("out", string))
 			else:
 				conf.NR_NODES = int(args[1])
 				config = [None for _ in range(conf.NR_NODES)]
@@ -49,7 +54,7 @@ def getParams(conf, args):
 		else: 
 			config = genScenario(conf)
 		if config[0] is not None:
-			conf.NR_NODES = len(config.keys())
+			conf.NR_NODES = len(config)
 		if conf.NR_NODES < 2:
 			print("Need at least two nodes.")
 			exit(1)
@@ -73,6 +78,7 @@ def genScenario(conf):
 	nodeTxts = []
 	gains = []
 	neighborInfo = []
+	maxRange = phy.maxRange(conf.freeze())
 
 	fig = plt.figure()
 	ax = fig.add_subplot(111)
@@ -121,7 +127,7 @@ def genScenario(conf):
 		ax.set_title(title)
 		for i,(nx,ny) in enumerate(zip(nodeX, nodeY)):
 			ax.annotate(str(i), (nx-5, ny+5))
-			circle = plt.Circle((nx, ny), radius=phy.MAXRANGE, color=plt.cm.Set1(i), alpha=0.1)
+			circle = plt.Circle((nx, ny), radius=maxRange, color=plt.cm.Set1(i), alpha=0.1)
 			ax.add_patch(circle)
 		if len(nodeTxts) > 0:
 			# Remove last 'Configure node x' text
@@ -202,22 +208,25 @@ def findRandomPosition(conf, nodes):
 	tries = 0
 	x = 0
 	y = 0
+	nodesX = np.array([n.x for n in nodes], dtype=np.float64)
+	nodesY = np.array([n.y for n in nodes], dtype=np.float64)
 	while not (foundMin and foundMax):
 		a = random.random()
 		b = random.random()
 		posx = a*conf.XSIZE+conf.OX-conf.XSIZE/2
 		posy = b*conf.YSIZE+conf.OY-conf.YSIZE/2
 		if len(nodes) > 0:
-			for n in nodes:
-				dist = calcDist(n.x, posx, n.y, posy)
-				if dist < conf.MINDIST:
-					foundMin = False
-					break
-				pathLoss = phy.estimatePathLoss(conf, dist, conf.FREQ)
-				rssi = conf.PTX + 2*conf.GL - pathLoss
-				# At least one node should be able to reach it
-				if rssi >= conf.SENSMODEM[conf.MODEM]:
-					foundMax = True
+			dist = calcDistArray(nodesX, posx, nodesY, posy)
+			# Only the nodes before the first one that is too close are checked
+			tooClose = np.flatnonzero(dist < conf.MINDIST)
+			if len(tooClose) > 0:
+				foundMin = False
+				dist = dist[:tooClose[0]]
+			pathLoss = phy.estimatePathLossArray(conf, dist, conf.FREQ)
+			rssi = conf.PTX + 2*conf.GL - pathLoss
+			# At least one node should be able to reach it
+			if np.any(rssi >= conf.SENSMODEM[conf.MODEM]):
+				foundMax = True
 			if foundMin and foundMax:
 				x = posx
 				y = posy
@@ -232,80 +241,145 @@ def findRandomPosition(conf, nodes):
 			break
 	return max(-conf.XSIZE/2, x),max(-conf.YSIZE/2, y)
 
-def runGraphUpdates(env, graph, nodes, interval):
-    while True:
-        # Wait 'interval' sim-mseconds
-        yield env.timeout(interval)
-        # Now update the positions in the graph
-        graph.updatePositions(nodes)
+class TempNode:
+	"""A lightweight node-like object with .x and .y attributes."""
+	def __init__(self, x, y):
+		self.x = x
+		self.y = y
+
+def findRandomPositions(conf, nrNodes):
+	"""
+	Places nrNodes one by one using findRandomPosition, restarting the
+	placement until all of them fit. Returns a list of (x, y) tuples.
+	"""
+	found = False
+	temp_nodes = []
+	while not found:
+		temp_nodes = []
+		for _ in range(nrNodes):
+			xnew, ynew = findRandomPosition(conf, temp_nodes)
+			if xnew is None:
+				# means we failed to place a node
+				break
+			temp_nodes.append(TempNode(xnew, ynew))
+		if len(temp_nodes) == nrNodes:
+			found = True
+	return [(tn.x, tn.y) for tn in temp_nodes]
+
+class GraphRenderer():
+	"""
+	Shows the nodes of a Graph moving during a simulation without slowing it down. Their positions are
+	sampled every interval of simulated time, but drawn at most conf.GRAPH_FRAME_RATE times per wall-clock
+	second, all at once and without waiting for the GUI. With conf.GRAPH_ANIMATION, the positions are
+	recorded instead and save() exports them as an animation after the simulation.
+	"""
+	def __init__(self, graph, nodes):
+		self.graph = graph
+		self.nodes = nodes
+		self.frameInterval = 1 / graph.conf.GRAPH_FRAME_RATE
+		self.lastFrame = None
+		self.recording = graph.conf.GRAPH_ANIMATION is not None
+		self.times = []
+		self.snapshots = []
+
+	def run(self, env, interval):
+		while True:
+			yield env.timeout(interval)
+			if self.recording:
+				self.times.append(env.now)
+				self.snapshots.append(self.graph.positionsOf(self.nodes))
+			elif self.lastFrame is None or time.monotonic() - self.lastFrame >= self.frameInterval or env.now + interval >= self.graph.conf.SIMTIME:
+				self.graph.updatePositions(self.nodes)
+				self.lastFrame = time.monotonic()
+
+	def save(self):
+		""" Exports the recorded positions to out/graphics, as a GIF or with ffmpeg depending on the extension of conf.GRAPH_ANIMATION. """
+		if not self.recording or not self.snapshots:
+			return
+		from matplotlib import animation
+		path = os.path.join("out", "graphics", self.graph.conf.GRAPH_ANIMATION)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+
+		def drawFrame(i):
+			self.graph.setPositions(self.snapshots[i])
+			self.graph.fig.suptitle('Time: {:.0f} min'.format(self.times[i] / self.graph.conf.ONE_MIN_INTERVAL))
+			return self.graph.markers, self.graph.circles
+
+		frames = animation.FuncAnimation(self.graph.fig, drawFrame, frames=len(self.snapshots), repeat=False)
+		frames.save(path, fps=self.graph.conf.GRAPH_FRAME_RATE, writer='pillow' if path.endswith('.gif') else None)
+		print("Saved animation of", len(self.snapshots), "frames to", path)
 
 def calcDist(x0, x1, y0, y1, z0=0, z1=0): 
 	return np.sqrt(((abs(x0-x1))**2)+((abs(y0-y1))**2)+((abs(z0-z1)**2)))
 
 
-scheduleIdx = 0
+def calcDistArray(x0, x1, y0, y1, z0=0, z1=0):
+	""" calcDist for arrays of coordinates, which are broadcast against each other, with identical results. """
+	return np.sqrt(phy.mathEach(phy.square, abs(x0-x1))+phy.mathEach(phy.square, abs(y0-y1))+phy.mathEach(phy.square, abs(z0-z1)))
+
+
 def plotSchedule(conf, packets, messages):
+	def scheduleBars(bars, **kwargs):
+		""" One collection of horizontal bars (node ID, start time, duration), like plt.barh draws them. """
+		bars = np.array(bars, dtype=float).reshape(-1, 3)
+		y, left, width = bars[:, 0], bars[:, 1], bars[:, 2]
+		verts = np.stack([np.stack([left, y-0.4], axis=1), np.stack([left, y+0.4], axis=1),
+			np.stack([left+width, y+0.4], axis=1), np.stack([left+width, y-0.4], axis=1)], axis=1)
+		plt.gca().add_collection(PolyCollection(verts, **kwargs))
+
 	def drawSchedule(i):
 		t = timeSequences[i]
 		plt.suptitle('Time schedule {}/{}\nDouble click to continue.'.format(i+1, len(timeSequences)))
-		for p in packets:  # collisions
-			if p.seq in [m.seq for m in t]: 
-				for rxId, bool in enumerate(p.collidedAtN):
-					if bool:
-						plt.barh(rxId, p.timeOnAir, left=p.startTime, color='red', edgecolor='r')
-		for p in packets:  # transmissions
-			if p.seq in [m.seq for m in t]:  
-				if p.isAck: 
-					color = 'orange'
-				else: 
-					color = 'blue'
-				plt.barh(p.txNodeId, p.timeOnAir, left=p.startTime, color=color, edgecolor='k')
-				plt.text(p.startTime+p.timeOnAir/2, p.txNodeId, str(p.seq), horizontalalignment='center', verticalalignment='center', fontsize=12)
-		for p in packets:  # receptions
-			if p.seq in [m.seq for m in t]:  
-				for rxId, bool in enumerate(p.receivedAtN):
-					if bool:
-						plt.barh(rxId, p.timeOnAir, left=p.startTime, color='green', edgecolor='green')
-		maxTime = 0
-		for m in t:  # message generations
-			plt.arrow(m.genTime, m.origTxNodeId-0.4, 0, 0.5, head_width=0.02*(m.endTime-m.genTime), head_length=0.3, fc='k', ec='k')
-			plt.text(m.genTime, m.origTxNodeId+0.51, str(m.seq), horizontalalignment='center', verticalalignment='center', fontsize=12)
+		sequencePackets = [p for m in t for p in packetsBySeq.get(m.seq, [])]
+		collisions = [(rxId, p.startTime, p.timeOnAir) for p in sequencePackets for rxId in np.flatnonzero(p.collidedAtN)]
+		receptions = [(rxId, p.startTime, p.timeOnAir) for p in sequencePackets for rxId in np.flatnonzero(p.receivedAtN)]
+		scheduleBars(collisions, facecolor='red', edgecolor='r')
+		scheduleBars([(p.txNodeId, p.startTime, p.timeOnAir) for p in sequencePackets], facecolor=['orange' if p.isAck else 'blue' for p in sequencePackets], edgecolor='k')
+		scheduleBars(receptions, facecolor='green', edgecolor='green')
 		maxTime = max([m.endTime for m in t])
 		minTime = min([m.genTime for m in t])
+		if len(sequencePackets) <= SCHEDULE_LABEL_LIMIT:
+			for p in sequencePackets:
+				plt.text(p.startTime+p.timeOnAir/2, p.txNodeId, str(p.seq), horizontalalignment='center', verticalalignment='center', fontsize=12)
+			for m in t:  # message generations
+				plt.arrow(m.genTime, m.origTxNodeId-0.4, 0, 0.5, head_width=0.02*(m.endTime-m.genTime), head_length=0.3, fc='k', ec='k')
+				plt.text(m.genTime, m.origTxNodeId+0.51, str(m.seq), horizontalalignment='center', verticalalignment='center', fontsize=12)
+		else:
+			plt.plot([m.genTime for m in t], [m.origTxNodeId for m in t], linestyle='', marker='^', color='k')
 
 		plt.xlabel('Time (ms)')
 		plt.ylabel('Node ID')
 		plt.yticks([0]+list(range(conf.NR_NODES)), label=[str(n) for n in [0]+list(range(conf.NR_NODES))])
+		plt.gca().autoscale_view()
 		plt.xlim(minTime-0.03*(maxTime-minTime), maxTime)
 		plt.show()
 
-	# combine all messages with overlapping packets in one time sequence 
-	overlapping = [[m] for m in messages]
+	# combine all messages with overlapping packets in one time sequence: sort them by generation
+	# time and sweep, starting a new sequence when a message starts after all before it have ended
+	packetsBySeq = {}
+	for p in packets:
+		packetsBySeq.setdefault(p.seq, []).append(p)
 	for m in messages:
-		m.endTime = max([p.endTime for p in packets if p.seq == m.seq])
-	for m1 in messages:
-		for m2 in messages:
-			if m1 != m2:
-				if m2.genTime <= m1.endTime and m2.endTime > m1.genTime:
-					overlapping[m1.seq-1].append(m2)
+		m.endTime = max([p.endTime for p in packetsBySeq.get(m.seq, [])], default=0)
 	timeSequences = []
-	multiples = [[] for _ in overlapping]
-	for ind, o1 in enumerate(overlapping):
-		for o2 in overlapping: 
-			if set(o1).issubset(set(o2)):
-				multiples[ind].append(set(o2))
-		maxSet = max(multiples[ind], key=len)
-		if maxSet not in timeSequences:
-			timeSequences.append(maxSet)
-	# do not plot time sequences with messages that were only generated but not sent 
-	timeSequences = [t for t in timeSequences if max([m.endTime for m in t]) != 0]
+	sequenceEnd = None
+	# do not plot messages that were only generated but not sent
+	for m in sorted((m for m in messages if m.endTime != 0), key=lambda m: m.genTime):
+		if sequenceEnd is None or m.genTime > sequenceEnd:
+			timeSequences.append([])
+			sequenceEnd = m.endTime
+		timeSequences[-1].append(m)
+		sequenceEnd = max(sequenceEnd, m.endTime)
+	if not timeSequences:
+		return
 
 	# plot each time sequence
 	fig = plt.figure()
 	move_figure(fig, 900, 200)
+	scheduleIdx = 0
 	def onclick(event):
+		nonlocal scheduleIdx
 		if event.dblclick:
-			global scheduleIdx
 			plt.cla()
 			scheduleIdx += 1
 			if scheduleIdx < len(timeSequences):
@@ -334,60 +408,58 @@ class Graph():
 		self.ax.set_ylabel('y (m)')
 		move_figure(self.fig, 200, 200)
 
-		# --- new: keep track of plot elements ---
-		self.node_circles = {}
-		self.node_markers = {}
-		# If you want labels (text annotations) also updated:
+		# All node markers and range circles are drawn as one collection each, in the order of nodeIds
+		self.nodeIds = []
+		self.nodeIndex = {}
+		self.positions = np.empty((0, 2))
+		self.markers = self.ax.scatter([], [], s=2.5**2, color="grey", zorder=2)
+		radius = float(np.ravel(phy.maxRange(conf))[0])
+		self.circles = EllipseCollection(2*radius, 2*radius, 0, units='xy', offsets=self.positions,
+			offset_transform=self.ax.transData, alpha=0.1)
+		self.ax.add_collection(self.circles)
+		self.circleColors = []
 		self.node_labels = {}
 
-	def updatePositions(self, nodes):
+	def positionsOf(self, nodes):
+		positions = self.positions.copy()
 		for node in nodes:
-			node_id = node.nodeid
+			positions[self.nodeIndex[node.nodeid]] = (node.x, node.y)
+		return positions
 
-			# 1) Update the marker
-			marker = self.node_markers[node_id]
-			marker.set_xdata(node.x)
-			marker.set_ydata(node.y)
+	def setPositions(self, positions):
+		self.positions = positions
+		self.markers.set_offsets(positions)
+		self.circles.set_offsets(positions)
+		for nodeId, label in self.node_labels.items():
+			x, y = positions[self.nodeIndex[nodeId]]
+			label.set_position((x - 5, y + 5))
 
-			# 2) Update the circle center
-			circle = self.node_circles[node_id]
-			circle.center = (node.x, node.y)
-
-			# 3) (Optional) Update the text label, if you have one
-			if node_id in self.node_labels:
-				self.node_labels[node_id].set_position((node.x - 5, node.y + 5))
-
-		# 4) Redraw the canvas
+	def updatePositions(self, nodes):
+		self.setPositions(self.positionsOf(nodes))
+		# Let the GUI redraw, without sleeping like plt.pause()
 		self.fig.canvas.draw_idle()
-		# A short pause to let the UI update
-		plt.pause(0.01)
-    
+		self.fig.canvas.flush_events()
+
 	def addNode(self, node):
-		# place the node
-		if not self.conf.RANDOM:
-			txt = self.ax.annotate(str(node.nodeid), (node.x-5, node.y+5))
-			self.node_labels[node.nodeid] = txt
-
-		# Plot the node marker
-		(marker,) = self.ax.plot(
-			node.x, node.y,
-			marker="o", markersize=2.5, color="grey"
-		)
-		self.node_markers[node.nodeid] = marker
-
-		# Plot the coverage circle
-		circle = plt.Circle(
-			(node.x, node.y),
-			radius=phy.MAXRANGE,
-			color=plt.cm.Set1(node.nodeid),
-			alpha=0.1
-		)
-		self.ax.add_patch(circle)
-		self.node_circles[node.nodeid] = circle
+		self.addNodes([node])
+
+	def addNodes(self, nodes):
+		""" Draws nodes all at once. Nodes that were placed by hand are labeled with their ID, unless there are more than GRAPH_LABEL_LIMIT. """
+		if not self.conf.RANDOM and len(self.nodeIds) + len(nodes) <= GRAPH_LABEL_LIMIT:
+			for node in nodes:
+				txt = self.ax.annotate(str(node.nodeid), (node.x-5, node.y+5))
+				self.node_labels[node.nodeid] = txt
+
+		for node in nodes:
+			self.nodeIndex[node.nodeid] = len(self.nodeIds)
+			self.nodeIds.append(node.nodeid)
+			self.circleColors.append(plt.cm.Set1(node.nodeid))
+		self.circles.set_facecolor(self.circleColors)
+		self.setPositions(np.vstack((self.positions, np.array([(node.x, node.y) for node in nodes]).reshape(-1, 2))))
 
 		self.fig.canvas.draw_idle()
 		plt.pause(0.1)
-    
+
 	def save(self):
 		if not os.path.isdir(os.path.join("out", "graphics")):
 			if not os.path.isdir("out"):
@@ -396,43 +468,31 @@ class Graph():
 
 		plt.savefig(os.path.join("out", "graphics", "placement_"+str(self.conf.NR_NODES)))
 
-def setupAsymmetricLinks(conf, nodes):
-	asymLinkRng = random.Random(conf.SEED)
-	totalPairs = 0
-	symmetricLinks = 0
-	asymmetricLinks = 0
-	noLinks = 0
-	for i in range(conf.NR_NODES):
-		for b in range(conf.NR_NODES):
-			if i != b:
-				if conf.MODEL_ASYMMETRIC_LINKS:
-					conf.LINK_OFFSET[(i,b)] = asymLinkRng.gauss(conf.MODEL_ASYMMETRIC_LINKS_MEAN, conf.MODEL_ASYMMETRIC_LINKS_STDDEV)
-				else:
-					conf.LINK_OFFSET[(i,b)] = 0
-
-	for a in range(conf.NR_NODES):
-		for b in range(conf.NR_NODES):
-			if a != b:
-				# Calculate constant RSSI in both directions
-				nodeA = nodes[a]
-				nodeB = nodes[b]
-				distAB = calcDist(nodeA.x, nodeB.x, nodeA.y, nodeB.y, nodeA.z, nodeB.z)
-				pathLossAB = phy.estimatePathLoss(conf, distAB, conf.FREQ, nodeA.z, nodeB.z)
-				
-				offsetAB = conf.LINK_OFFSET[(a, b)]
-				offsetBA = conf.LINK_OFFSET[(b, a)]
-				
-				rssiAB = conf.PTX + nodeA.antennaGain + nodeB.antennaGain - pathLossAB - offsetAB
-				rssiBA = conf.PTX + nodeB.antennaGain + nodeA.antennaGain - pathLossAB - offsetBA
-
-				canAhearB = (rssiAB >= conf.SENSMODEM[conf.MODEM])
-				canBhearA = (rssiBA >= conf.SENSMODEM[conf.MODEM])
-
-				totalPairs += 1
-				if canAhearB and canBhearA:
-					symmetricLinks += 1
-				elif canAhearB or canBhearA:
-					asymmetricLinks += 1
-				else:
-					noLinks += 1
-	return totalPairs, symmetricLinks, asymmetricLinks, noLinks
\ No newline at end of file
+def setupAsymmetricLinks(conf, state, linkCache=None, sharedTables=None):
+	"""
+	Draws the asymmetric offset of each link and computes the link tables of the nodes in state
+	(see LinkTables), stored in a memory-mapped cache in directory linkCache if given, or based on
+	the given distance and path loss sharedTables.
+	Returns the number of node pairs and how many of them have a symmetric, asymmetric or no link.
+	"""
+	from lib.links import LinkTables
+	from lib.terrain import TerrainLinks, getTerrain
+	state.links = LinkTables(conf, state.nodes, linkCache, sharedTables)
+	terrain = getTerrain(conf)
+	if terrain is not None and state.links.movingNodes:
+		state.terrainLinks = TerrainLinks(conf, terrain, state.nodes, state.links.movingNodes)
+	gains = np.array([n.antennaGain for n in state.nodes], dtype=np.float64)
+	pathLoss = state.links.pathLoss
+	offset = state.links.offset
+	# Constant RSSI in both directions
+	rssiAB = (conf.PTX + gains[:, np.newaxis]) + gains[np.newaxis, :] - pathLoss - offset
+	rssiBA = (conf.PTX + gains[np.newaxis, :]) + gains[:, np.newaxis] - pathLoss - offset.T
+	canAhearB = rssiAB >= conf.SENSMODEM[conf.MODEM]
+	canBhearA = rssiBA >= conf.SENSMODEM[conf.MODEM]
+	pairs = ~np.eye(len(state.nodes), dtype=bool)
+
+	totalPairs = int(np.sum(pairs))
+	symmetricLinks = int(np.sum(pairs & canAhearB & canBhearA))
+	asymmetricLinks = int(np.sum(pairs & (canAhearB != canBhearA)))
+	noLinks = int(np.sum(pairs & ~canAhearB & ~canBhearA))
+	return totalPairs, symmetricLinks, asymmetricLinks, noLinks
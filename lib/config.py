@@ -1,7 +1,17 @@
+import hashlib
+import json
 from enum import Enum
+from functools import cached_property
+from types import MappingProxyType
+
 import numpy as np
 
 class Config:
+    """
+    Parameters of a simulation. Change the defaults below to model your scenario.
+    Before running, a Config is frozen into a RunSpec, while everything that changes
+    during a run lives in a separate RunState.
+    """
 
     class ROUTER_TYPE(Enum):
         MANAGED_FLOOD = 'MANAGED_FLOOD'
@@ -18,6 +28,13 @@ class Config:
         self.GL = 0  # antenna gain of each node in dBi
         self.HM = 1.0  # height of each node in m
 
+        # Optional terrain: an elevation raster in m (2D .npy array, or GeoTIFF if tifffile is installed),
+        # north-up with its north-west corner at TERRAIN_ORIGIN and TERRAIN_RESOLUTION m per pixel
+        # (a GeoTIFF's own pixel size takes precedence). Adds knife-edge diffraction loss to the pathloss model.
+        self.TERRAIN_FILE = None
+        self.TERRAIN_ORIGIN = (self.OX - self.XSIZE/2, self.OY + self.YSIZE/2)
+        self.TERRAIN_RESOLUTION = 30
+
         ### Meshtastic specific ###
         self.hopLimit = 3  # default 3
         self.router = False  # set role of each node as router (True) or normal client (False)
@@ -94,18 +111,21 @@ class Config:
 
         # Set this to True to enable the asymmetric link model
         # Adds a random offset to the link quality of each link
+        # The offset of each link is stored in the link tables of a RunState
         self.MODEL_ASYMMETRIC_LINKS = True
         self.MODEL_ASYMMETRIC_LINKS_MEAN = 0
         self.MODEL_ASYMMETRIC_LINKS_STDDEV = 3
-        # Stores the offset for each link
-        # Populated when the simulator first starts
-        self.LINK_OFFSET = {}
 
         #################################################
         ####### MOVING NODE SIMULATION VARIABLES ########
         #################################################
 
         self.MOVEMENT_ENABLED = True
+        # Wall-clock frames per second at which the moving nodes are drawn (or recorded animations are played)
+        self.GRAPH_FRAME_RATE = 10
+        # If set, loraMesh.py records the positions every simulated minute instead of drawing them and
+        # saves them as an animation with this file name in out/graphics, e.g. "movement.gif" or "movement.mp4"
+        self.GRAPH_ANIMATION = None
         # The average number of meters a human walks in a minute
         self.WALKING_METERS_PER_MIN = 96
         # The average number of meters a human bikes in a minute
@@ -129,4 +149,142 @@ class Config:
         # Example: Overwrite hop limit in the case of X new awesome routing algorithm
         #if self.SELECTED_ROUTER_TYPE == self.ROUTER_TYPE.AWESOME_ROUTER:
             # Change config values if necessary for your router here
-        return
\ No newline at end of file
+        return
+
+    def freeze(self):
+        """ Returns an immutable, hashable snapshot of the current parameters. """
+        return RunSpec(vars(self))
+
+
+# Parameters that affect where findRandomPosition places nodes: the area, the minimum
+# distance, and everything that determines whether a new node can reach an existing one
+PLACEMENT_PARAMS = ["XSIZE", "YSIZE", "OX", "OY", "MINDIST", "MODEM", "MODEL", "FREQ", "PTX", "GL", "HM",
+                    "SENSMODEM", "GAMMA", "D0", "LPLD0"]
+
+# Attributes that RunSpec caches in its instance dict, which are not parameters
+_CACHED_ATTRIBUTES = ('hash', '_hashValue')
+
+
+def _freezeValue(value):
+    if isinstance(value, np.ndarray):
+        value = value.copy()
+        value.setflags(write=False)
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freezeValue(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freezeValue(v) for v in value)
+    return value
+
+
+def _thawValue(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, MappingProxyType):
+        return {k: _thawValue(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thawValue(v) for v in value]
+    return value
+
+
+def _canonicalValue(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (dict, MappingProxyType)):
+        return {str(k): _canonicalValue(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalValue(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def contentHash(conf, names=None, **extra):
+    """
+    Stable SHA-256 hash of the given parameters of a Config or RunSpec (all of them if names is None),
+    together with any extra values, e.g. a seed. Equal values give equal hashes across processes and sessions.
+    """
+    if names is None:
+        names = [name for name in vars(conf) if name not in _CACHED_ATTRIBUTES]
+    items = {name: _canonicalValue(getattr(conf, name)) for name in names}
+    items.update({name: _canonicalValue(value) for name, value in extra.items()})
+    return hashlib.sha256(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class RunSpec:
+    """
+    Immutable set of parameters of one simulation run, created with Config.freeze().
+    Attributes are read like those of a Config, but cannot be changed. Two specs with the same
+    parameters have the same content hash, which is stable across processes and sessions, so
+    it can be used as a key for caches of results and link matrices.
+    Pickling only ships the parameter values.
+    """
+    ROUTER_TYPE = Config.ROUTER_TYPE
+
+    def __init__(self, params):
+        for name, value in params.items():
+            object.__setattr__(self, name, _freezeValue(value))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RunSpec is immutable, use replace() to change '{}'".format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError("RunSpec is immutable")
+
+    def params(self):
+        """ Returns the parameters as a dict of mutable copies. """
+        return {name: _thawValue(value) for name, value in vars(self).items() if name not in _CACHED_ATTRIBUTES}
+
+    def replace(self, **changes):
+        """
+        Returns a new RunSpec with some parameters changed. Just like when setting them on a Config,
+        values that Config derives from others (e.g. FREQ from MODEM) are not recomputed.
+        """
+        params = self.params()
+        for name in changes:
+            if name not in params:
+                raise AttributeError("Unknown parameter '{}'".format(name))
+        params.update(changes)
+        return RunSpec(params)
+
+    @cached_property
+    def hash(self):
+        """ Stable SHA-256 content hash of all parameters. """
+        return contentHash(self)
+
+    @cached_property
+    def _hashValue(self):
+        return int(self.hash[:16], 16)
+
+    def __hash__(self):
+        return self._hashValue
+
+    def __eq__(self, other):
+        return isinstance(other, RunSpec) and self.hash == other.hash
+
+    def __reduce__(self):
+        return (RunSpec, (self.params(),))
+
+    def __repr__(self):
+        return "RunSpec({})".format(self.hash[:12])
+
+
+class RunState:
+    """
+    Everything that belongs to one simulation run: the link tables (including the asymmetric
+    offset of each link), the nodes, the messages and packets sent, and the delays of received packets.
+    Create a new RunState for every run, while the RunSpec can be shared.
+    """
+    def __init__(self, spec, trace=None):
+        self.links = None  # LinkTables, populated by setupAsymmetricLinks
+        self.terrainLinks = None  # TerrainLinks of the moving nodes, if a terrain is configured
+        self.nodes = []
+        self.messages = []
+        self.packets = []
+        self.delays = []
+        self.packetsAtN = [[] for _ in range(spec.NR_NODES)]
+        self.messageSeq = {"val": 0}
+        self.packetsSent = {"val": 0}  # packets that started transmitting, without those aborted because of an ACK
+        self.trace = trace  # optional EventTrace
\ No newline at end of file
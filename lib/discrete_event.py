@@ -15,6 +15,18 @@ def simReport(conf, data, subdir, param):
 	df_new.to_csv(os.path.join("out", "report", subdir, fname), index=False)
 
 
+class CountingEnvironment(simpy.Environment):
+	""" Environment that counts the number of processed events, e.g. to report events per second. """
+	def __init__(self, initial_time=0):
+		super().__init__(initial_time)
+		self.eventCount = 0
+
+
+	def step(self):
+		self.eventCount += 1
+		super().step()
+
+
 class BroadcastPipe(object):
 	def __init__(self, env, capacity=simpy.core.Infinity):
 		self.env = env
@@ -1,31 +1,87 @@
 import argparse
 import cmd
+import multiprocessing
+import queue
 import socket
+import struct
 import sys
 import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import google.protobuf.json_format as proto
 from matplotlib import patches
 from meshtastic import tcp_interface, BROADCAST_NUM, mesh_pb2, admin_pb2, telemetry_pb2, portnums_pb2, channel_pb2
 from pubsub import pub
 
+from lib.capture import CaptureWriter
 from lib.config import Config
+from lib.loadgen import LOAD_KINDS, LoadGenerator, rateSchedule, readTrace
+from lib.mock import runMock
+from lib.terrain import getTerrain
+from lib.timeseries import TimeSeries
+from lib.topology import loadNodeConfig
 from .common import *
 
 # TODO: Fix mixed indentation!
 #       Some parts of the file use tabs, some parts user 2 spaces, and some parts use 4 spaces.
 
-conf = Config()
 HW_ID_OFFSET = 16
 TCP_PORT_OFFSET = 4403
 TCP_PORT_CLIENT = 4402
 MAX_TO_FROM_RADIO_SIZE = 512
+MESSAGE_HISTORY = 10000  # number of packets kept to correlate packets and to plot routes
+NODE_TIMEOUT = 60  # s to wait for a node to accept connections and send its configuration
+SEND_TIMEOUT = 3  # s to wait for a node to confirm admin messages (older firmware does not confirm them)
+REBOOT_TIMEOUT = 10  # s to wait for a node to drop the connection when it reboots to apply its configuration
+POLL_INTERVAL = 0.1  # s
+COLLISION_STAGGER = 2  # s between nodes starting to transmit when emulating collisions
+BOOT_WORKERS = 16  # number of nodes started, connected or configured at the same time
+OUTBOUND_QUEUE_SIZE = 1000  # packets waiting to be forwarded to a node, after which they are dropped
+MOCK_EXIT_TIMEOUT = 5  # s to wait for the mock nodes to exit before stopping them
+DISPATCH_WORKERS = 8  # threads that handle the packets received from the nodes
+DISPATCH_QUEUE_SIZE = 1000  # packets waiting per handling thread, after which reading from the nodes waits
+
+
+def waitFor(condition, timeout, interval=POLL_INTERVAL):
+  """ Polls condition until it returns True or timeout s have passed. Returns whether it became True. """
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() >= deadline:
+      return False
+    time.sleep(interval)
+  return True
+
+
+def portIsOpen(port, hostname="localhost"):
+  try:
+    with socket.create_connection((hostname, port), timeout=1):
+      return True
+  except OSError:
+    return False
+
+
+def allocatePorts(count, start=TCP_PORT_OFFSET):
+  """ The first count TCP ports from start that are free on this host, skipping the port for the client. """
+  ports = []
+  port = start
+  while len(ports) < count:
+    if port != TCP_PORT_CLIENT:
+      try:
+        with socket.socket() as s:
+          s.bind(('', port))
+        ports.append(port)
+      except OSError:
+        pass
+    port += 1
+  return ports
+
 DEVICE_SIM_DOCKER_IMAGE = "meshtastic/device-simulator"
 MESHTASTICD_PATH_DOCKER = "./meshtasticd"
 
 class interactiveNode(): 
-  def __init__(self, nodes, nodeId, hwId, TCPPort, nodeConfig):
+  def __init__(self, conf, nodes, nodeId, hwId, TCPPort, nodeConfig):
     self.nodeid = nodeId
     if nodeConfig is not None: 
       self.x = nodeConfig['x']
@@ -47,11 +103,10 @@ class interactiveNode():
       self.antennaGain = conf.GL
       self.neighborInfo = False
     self.iface = None
+    self.socket = None
     self.hwId = hwId
     self.TCPPort = TCPPort 
-    self.timestamps = []
-    self.channelUtilization = []
-    self.airUtilTx = []
+    self.metrics = TimeSeries(("channelUtilization", "airUtilTx"))
     self.numPacketsTx = 0
     self.numPacketsRx = 0
     self.numPacketsRxBad = 0
@@ -62,6 +117,7 @@ class interactiveNode():
 
   def addInterface(self, iface):
     self.iface = iface
+    self.socket = getattr(iface, "socket", None)  # the connection a reboot drops, after which the interface reconnects
 
   
   def setConfig(self):
@@ -128,7 +184,185 @@ class interactiveNode():
     ch.role = channel_pb2.Channel.Role.SECONDARY
     self.iface.localNode.channels[ch.index] = ch
     self.iface.localNode.writeChannel(ch.index)
-    time.sleep(1)
+    self.waitUntilSent()
+
+
+  def waitUntilSent(self, timeout=SEND_TIMEOUT):
+    """
+    Waits until the interface has no packets left that the node did not confirm. The queue keeps False for packets
+    that were confirmed only after they were sent, so only other entries are pending.
+    """
+    return waitFor(lambda: not any(self.iface.queue.values()), timeout)
+
+
+def encodeVarint(value):
+  """ Protobuf varint of an integer; negative int32 values take 10 bytes, like the protobuf library encodes them. """
+  value &= 0xFFFFFFFFFFFFFFFF
+  encoded = bytearray()
+  while value > 0x7F:
+    encoded.append((value & 0x7F) | 0x80)
+    value >>= 7
+  encoded.append(value)
+  return bytes(encoded)
+
+
+RX_SNR_TAG = bytes([mesh_pb2.MeshPacket.RX_SNR_FIELD_NUMBER << 3 | 5])  # fixed32
+RX_RSSI_TAG = bytes([mesh_pb2.MeshPacket.RX_RSSI_FIELD_NUMBER << 3 | 0])  # varint
+TO_RADIO_PACKET_TAG = bytes([mesh_pb2.ToRadio.PACKET_FIELD_NUMBER << 3 | 2])  # length-delimited
+
+
+class encodedToRadio():
+  """
+  A ToRadio with a MeshPacket, already serialized, that the meshtastic interface queues, sends and
+  resends like a ToRadio protobuf. The MeshPacket is serialized once for all receivers and only the
+  encoded rx_snr and rx_rssi fields are appended per receiver, which parses to the same message.
+  """
+  def __init__(self, meshPacket, meshPacketBytes, rssi, snr):
+    self.packet = meshPacket  # the interface only reads its ID
+    data = meshPacketBytes
+    if snr != 0:
+      data += RX_SNR_TAG + struct.pack('<f', snr)
+    if rssi != 0:
+      data += RX_RSSI_TAG + encodeVarint(rssi)
+    self.data = TO_RADIO_PACKET_TAG + encodeVarint(len(data)) + data
+
+
+  def HasField(self, name):
+    return name == "packet"
+
+
+  def SerializeToString(self):
+    return self.data
+
+
+  def __str__(self):
+    return "encoded ToRadio with packet {:08x}".format(self.packet.id)
+
+
+class interactiveWriter():
+  """
+  Outbound queue of a node, with a thread that forwards the packets to it, so a slow node does not delay
+  the others. Counts the packets queued, sent and dropped because the queue was full, and the queue
+  length and the time packets waited in it, to measure backpressure.
+  """
+  def __init__(self, node, maxsize=OUTBOUND_QUEUE_SIZE):
+    self.node = node
+    self.queue = queue.Queue(maxsize)
+    self.queued = 0
+    self.sent = 0
+    self.dropped = 0
+    self.maxLength = 0
+    self.totalWait = 0.0
+    self.maxWait = 0.0
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+
+  def put(self, toRadio):
+    try:
+      self.queue.put_nowait((time.monotonic(), toRadio))
+    except queue.Full:
+      self.dropped += 1
+      return
+    self.queued += 1
+    self.maxLength = max(self.maxLength, self.queue.qsize())
+
+
+  def run(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        break
+      queuedAt, toRadio = item
+      wait = time.monotonic() - queuedAt
+      try:
+        self.node.iface._sendToRadio(toRadio)
+      except Exception as ex:
+        print("Could not forward packet to node", self.node.nodeid, ex)
+        continue
+      self.sent += 1
+      self.totalWait += wait
+      self.maxWait = max(self.maxWait, wait)
+
+
+  def close(self):
+    # Packets still queued are forwarded first
+    self.queue.put(None)
+    self.thread.join(timeout=NODE_TIMEOUT)
+
+
+class interactiveDispatcher():
+  """
+  Handles the packets that the nodes send to the simulator on a pool of worker threads instead of in the
+  threads that read from the nodes, so slow handling does not delay reading. All packets of a node are
+  handled by the same worker, in the order they were read. When the queue of a worker is full, reading
+  waits. Counts per worker the packets dispatched, handled and failed, the queue length and the time
+  packets waited in it, to find slow handlers.
+  """
+  def __init__(self, workers=DISPATCH_WORKERS, maxsize=DISPATCH_QUEUE_SIZE):
+    self.queues = [queue.Queue(maxsize) for _ in range(workers)]
+    self.listeners = []  # pubsub only keeps weak references to its listeners
+    self.lock = threading.Lock()  # guards the counters, which the readers and workers update concurrently
+    self.dispatched = [0] * workers
+    self.handled = [0] * workers
+    self.failed = [0] * workers
+    self.maxLength = [0] * workers
+    self.totalWait = [0.0] * workers
+    self.maxWait = [0.0] * workers
+    self.threads = [threading.Thread(target=self.run, args=(w,), daemon=True) for w in range(workers)]
+    for t in self.threads:
+      t.start()
+
+
+  def subscribe(self, callback, topic):
+    """ Subscribes to topic such that callback(interface, packet) is called by the worker of the interface's node. """
+    def listener(interface, packet):
+      self.dispatch(interface.portNumber, callback, interface, packet)
+    self.listeners.append(listener)
+    pub.subscribe(listener, topic)
+
+
+  def dispatch(self, key, callback, *args):
+    worker = hash(key) % len(self.queues)
+    self.queues[worker].put((time.monotonic(), callback, args))
+    with self.lock:
+      self.dispatched[worker] += 1
+      self.maxLength[worker] = max(self.maxLength[worker], self.queues[worker].qsize())
+
+
+  def run(self, worker):
+    while True:
+      item = self.queues[worker].get()
+      if item is None:
+        break
+      queuedAt, callback, args = item
+      wait = time.monotonic() - queuedAt
+      try:
+        callback(*args)
+      except Exception as ex:
+        print("Could not handle packet with", callback.__name__, ex)
+        with self.lock:
+          self.failed[worker] += 1
+        continue
+      with self.lock:
+        self.handled[worker] += 1
+        self.totalWait[worker] += wait
+        self.maxWait[worker] = max(self.maxWait[worker], wait)
+
+
+  def stats(self):
+    """ Per worker (dispatched, handled, failed, queue length, max queue length, total wait, max wait), consistent at one moment. """
+    with self.lock:
+      return [(self.dispatched[w], self.handled[w], self.failed[w], self.queues[w].qsize(), self.maxLength[w], self.totalWait[w], self.maxWait[w])
+              for w in range(len(self.queues))]
+
+
+  def close(self):
+    # Packets still queued are handled first
+    for q in self.queues:
+      q.put(None)
+    for t in self.threads:
+      t.join(timeout=NODE_TIMEOUT)
 
 
 class interactivePacket():
@@ -146,13 +380,14 @@ class interactivePacket():
 
 
 class interactiveGraph(Graph):
-  def __init__(self):
-    super().__init__()
+  def __init__(self, conf):
+    super().__init__(conf)
+    self.packets = deque(maxlen=MESSAGE_HISTORY)
     self.routes = False
 
 
-  def initRoutes(self, sim):
-    if not sim.docker:
+  def initRoutes(self, sim=None):
+    if sim is not None and not sim.docker:
       sim.closeNodes()
     if not self.routes: 
       self.routes = True
@@ -161,7 +396,7 @@ class interactiveGraph(Graph):
       self.txts = []
       self.annots = []
       self.firstTime = True
-      self.defaultHopLimit = conf.hopLimit
+      self.defaultHopLimit = self.conf.hopLimit
       self.fig.subplots_adjust(bottom=0.2)
       axbox = self.fig.add_axes([0.5, 0.04, 0.1, 0.06])
       self.text_box = TextBox(axbox, "Message ID: ", initial="0")
@@ -174,7 +409,7 @@ class interactiveGraph(Graph):
       self.fig.canvas.draw_idle()
       self.fig.canvas.get_tk_widget().focus_set()
       plt.show()
-    elif sim.docker:
+    elif sim is not None and sim.docker:
       sim.closeNodes()
 
 
@@ -305,24 +540,30 @@ class interactiveGraph(Graph):
     messageId = int(val)
     self.plotRoute(messageId)
 
-  def plotMetrics(self, nodes):
-    if any(len(n.timestamps) > 1 for n in nodes):
+  def plotMetric(self, nodes, field, window):
+    """ Plots a device metric of each node over the last window seconds (or all that is kept if None), with the range of older rolled-up samples shaded. """
+    for n in nodes:
+      if len(n.metrics) > 0:
+        initTime = n.metrics.firstTime()
+        start = None if window is None else n.metrics.lastTime - window
+        color = plt.cm.Set1(n.nodeid)
+        times, minimum, maximum, mean = n.metrics.rollupWindow(field, start)
+        if len(times) > 0:
+          plt.fill_between(times-initTime, minimum, maximum, step="post", color=color, alpha=0.2)
+          plt.step(times-initTime, mean, where="post", color=color)
+        times, values = n.metrics.window(field, start)
+        plt.plot(times-initTime, values, label=str(n.nodeid), marker=".", color=color)
+    plt.xlabel('Time (s)')
+    plt.legend(title='Node ID')
+
+  def plotMetrics(self, nodes, window=None):
+    if any(len(n.metrics) > 1 for n in nodes):
       plt.figure()
-      for n in nodes:
-        if len(n.timestamps) > 0:
-          initTime = n.timestamps[0]
-          plt.plot([t-initTime for t in n.timestamps], n.channelUtilization, label=str(n.nodeid), marker=".")
+      self.plotMetric(nodes, "channelUtilization", window)
       plt.ylabel('Channel utilization (%)')
-      plt.xlabel('Time (s)')
-      plt.legend(title='Node ID')
       plt.figure()
-      for n in nodes:
-        if len(n.timestamps) > 0:
-          initTime = n.timestamps[0]
-          plt.plot([t-initTime for t in n.timestamps], n.airUtilTx, label=str(n.nodeid), marker=".")
+      self.plotMetric(nodes, "airUtilTx", window)
       plt.ylabel('Hourly Tx air utilization (%)')
-      plt.xlabel('Time (s)')
-      plt.legend(title='Node ID')
 
     if any(n.numPacketsRxBad > 0 for n in nodes): # Only really interesting if there are bad packets (meaning collisions)
       stats = ['Tx', 'Rx', 'Rx bad', 'Rx dupe', 'Tx relay', 'Tx relay canceled']
@@ -344,9 +585,14 @@ class interactiveGraph(Graph):
 
 class interactiveSim(): 
   def __init__(self):
-    self.messages = []
+    self.messages = deque(maxlen=MESSAGE_HISTORY)
+    self.messageIds = OrderedDict()  # packet ID -> message ID, for the last MESSAGE_HISTORY packet IDs
     self.messageId = -1
+    self.messageLock = threading.Lock()  # guards messageId, messageIds and messages, which the dispatcher threads update
     self.nodes = []
+    self.nodesByPort = {}
+    self.nodesByHwId = {}
+    self.receiverCache = {}  # transmitter node ID -> (receivers, RSSIs, SNRs)
     foundNodes = False
     foundPath = False
     self.eraseFlash = False
@@ -356,22 +602,40 @@ class interactiveSim():
     self.nodeThread = None
     self.clientThread = None
     self.wantExit = False
+    self.capture = None
+    self.mockProcess = None
+    self.dispatcher = None
 
     config, pathToProgram = self.parseInteractiveArgs(foundNodes)
 
-    if not self.docker and not sys.platform.startswith('linux'):
+    if not self.docker and not self.mock and not sys.platform.startswith('linux'):
       print("Docker is required for non-Linux OS.")
       self.docker = True
 
-    self.graph = interactiveGraph()
-    for n in range(conf.NR_NODES):
-      node = interactiveNode(self.nodes, n, self.nodeIdToHwId(n), n+TCP_PORT_OFFSET, config[n])
+    self.graph = interactiveGraph(self.conf)
+    ports = allocatePorts(self.conf.NR_NODES)
+    for n in range(self.conf.NR_NODES):
+      node = interactiveNode(self.conf, self.nodes, n, self.nodeIdToHwId(n), ports[n], config[n])
       self.nodes.append(node)
-      self.graph.addNode(node)
+      self.nodesByPort[node.TCPPort] = node
+      self.nodesByHwId[node.hwId] = node
+    self.graph.addNodes(self.nodes)
+    if self.capturePath is not None:
+      self.capture = CaptureWriter(self.capturePath)
+      self.capture.addConfig(self.conf)
+      for n in self.nodes:
+        self.capture.addNode(n)
 
     print("Booting nodes...")
-
-    if self.docker:
+    self.bootTimes = OrderedDict()
+    bootStart = time.monotonic()
+
+    if self.mock:
+      mockNodes = [(n.nodeid, n.hwId, n.TCPPort, n.hopLimit) for n in self.nodes]
+      self.mockProcess = multiprocessing.Process(target=runMock, args=(self.conf, mockNodes, self.mockPeriod, self.conf.SEED), daemon=True)
+      self.mockProcess.start()
+      print("Started", len(self.nodes), "mock nodes.")
+    elif self.docker:
       try:
         import docker
       except ImportError: 
@@ -386,19 +650,15 @@ class interactiveSim():
       if sys.platform == "darwin":
         self.container = dockerClient.containers.run(DEVICE_SIM_DOCKER_IMAGE, startNode + "-d /home/node"+str(n0.nodeid)+" -h "+str(n0.hwId)+" -p "+str(n0.TCPPort), \
           ports=dict(zip((str(n.TCPPort)+'/tcp' for n in self.nodes), (n.TCPPort for n in self.nodes))), name="Meshtastic", detach=True, auto_remove=True, user="root")
-        for n in self.nodes[1:]:
-          if self.emulateCollisions:
-            time.sleep(2) # Wait a bit to avoid immediate collisions when starting multiple nodes 
-          self.container.exec_run(startNode + "-d /home/node"+str(n.nodeid)+" -h "+str(n.hwId)+" -p "+str(n.TCPPort), detach=True, user="root") 
+        self.forEachNode(lambda n: self.container.exec_run(startNode + "-d /home/node"+str(n.nodeid)+" -h "+str(n.hwId)+" -p "+str(n.TCPPort), detach=True, user="root"), \
+          self.nodes[1:], staggerFirst=True)
         print("Docker container with name "+str(self.container.name)+" is started.")
       else: 
         self.container = dockerClient.containers.run(DEVICE_SIM_DOCKER_IMAGE, \
           "sh -c '" + startNode + "-d /home/node"+str(n0.nodeid)+" -h "+str(n0.hwId)+" -p "+str(n0.TCPPort)+" > /home/out_"+str(n0.nodeid)+".log'", \
           ports=dict(zip((str(n.TCPPort)+'/tcp' for n in self.nodes), (n.TCPPort for n in self.nodes))), name="Meshtastic", detach=True, auto_remove=True, user="root", volumes={"Meshtasticator": {'bind': '/home/', 'mode': 'rw'}})
-        for n in self.nodes[1:]:
-          if self.emulateCollisions:
-            time.sleep(2) # Wait a bit to avoid immediate collisions when starting multiple nodes 
-          self.container.exec_run("sh -c '" + startNode + "-d /home/node"+str(n.nodeid)+" -h "+str(n.hwId)+" -p "+str(n.TCPPort)+" > /home/out_"+str(n.nodeid)+".log'", detach=True, user="root") 
+        self.forEachNode(lambda n: self.container.exec_run("sh -c '" + startNode + "-d /home/node"+str(n.nodeid)+" -h "+str(n.hwId)+" -p "+str(n.TCPPort)+" > /home/out_"+str(n.nodeid)+".log'", detach=True, user="root"), \
+          self.nodes[1:], staggerFirst=True)
         print("Docker container with name "+str(self.container.name)+" is started.")
         print("You can check the device logs using 'docker exec -it "+str(self.container.name) +" cat /home/out_x.log', where x is the node number.")
     else: 
@@ -423,7 +683,7 @@ class interactiveSim():
         cmdString = newTerminal+pathToProgram+startNode
         os.system(cmdString)  
         if self.emulateCollisions and n.nodeid != len(self.nodes)-1:
-            time.sleep(2) # Wait a bit to avoid immediate collisions when starting multiple nodes 
+            time.sleep(COLLISION_STAGGER) # Wait a bit to avoid immediate collisions when starting multiple nodes 
 
     if self.forwardToClient:
       print("Please connect with the client to TCP port", TCP_PORT_CLIENT, "...")
@@ -432,6 +692,8 @@ class interactiveSim():
       self.forwardSocket.listen()
       (clientSocket, _) = self.forwardSocket.accept()
       self.clientSocket = clientSocket
+      if not waitFor(lambda: portIsOpen(self.nodes[0].TCPPort), NODE_TIMEOUT):
+        print("Node 0 did not open TCP port", self.nodes[0].TCPPort)
       iface0 = tcp_interface.TCPInterface(hostname="localhost", portNumber=self.nodes[0].TCPPort, connectNow=False)
       self.nodes[0].addInterface(iface0)
       iface0.myConnect()  # setup socket
@@ -439,26 +701,38 @@ class interactiveSim():
       self.clientThread = threading.Thread(target=self.clientReader, args=(), daemon=True)
       self.nodeThread.start()
       self.clientThread.start()
-    else:
-      time.sleep(4)  # Allow instances to start up their TCP service 
+    self.bootTimes["started"] = time.monotonic() - bootStart
 
     try:
-      for n in self.nodes[int(self.forwardToClient):]:
-        iface = tcp_interface.TCPInterface(hostname="localhost", portNumber=n.TCPPort)
-        n.addInterface(iface)
+      self.forEachNode(self.connectNode, self.nodes[int(self.forwardToClient):], stagger=False)
       if self.forwardToClient:
         self.clientConnected = True
         iface0.localNode.nodeNum = self.nodes[0].hwId
         iface0.connect() # real connection now
+      self.bootTimes["connected"] = time.monotonic() - bootStart
+      if self.emulateCollisions:
+        rebooting = []
+        for n in self.nodes:
+          requiresReboot = n.setConfig()
+          if requiresReboot:
+            rebooting.append(n)
+          if requiresReboot and n.nodeid != len(self.nodes)-1:
+            time.sleep(COLLISION_STAGGER) # Wait a bit to avoid immediate collisions when starting multiple nodes
+      else:
+        rebooting = [n for n, requiresReboot in zip(self.nodes, self.forEachNode(lambda n: n.setConfig(), self.nodes)) if requiresReboot]
+      self.bootTimes["configured"] = time.monotonic() - bootStart
+      self.reconnectNodes(rebooting)
+      self.bootTimes["reconnected"] = time.monotonic() - bootStart
+      print("Booted {} nodes in {:.1f} s ({}).".format(len(self.nodes), self.bootTimes["reconnected"],
+        ", ".join("{} after {:.1f} s".format(phase, t) for phase, t in self.bootTimes.items())))
       for n in self.nodes:
-        requiresReboot = n.setConfig()
-        if requiresReboot and self.emulateCollisions and n.nodeid != len(self.nodes)-1:
-          time.sleep(2) # Wait a bit to avoid immediate collisions when starting multiple nodes
-      self.reconnectNodes()
-      pub.subscribe(self.onReceive, "meshtastic.receive.simulator")
-      pub.subscribe(self.onReceiveMetrics, "meshtastic.receive.telemetry")
+        n.writer = interactiveWriter(n)
+      self.forwardingStart = time.monotonic()
+      self.dispatcher = interactiveDispatcher()
+      self.dispatcher.subscribe(self.onReceive, "meshtastic.receive.simulator")
+      self.dispatcher.subscribe(self.onReceiveMetrics, "meshtastic.receive.telemetry")
       if self.forwardToClient:
-        pub.subscribe(self.onReceiveAll, "meshtastic.receive")
+        self.dispatcher.subscribe(self.onReceiveAll, "meshtastic.receive")
     except(Exception) as ex:
       print(f"Error: Could not connect to native program: {ex}")
       self.closeNodes()
@@ -467,26 +741,34 @@ class interactiveSim():
 
   def parseInteractiveArgs(self, foundNodes):
     parser = argparse.ArgumentParser(prog='interactiveSim')
-    parser.add_argument('nrNodes', type=int, nargs='?', choices=range(0, 11), default=0)
+    parser.add_argument('nrNodes', type=int, nargs='?', default=0)
     parser.add_argument('-s', '--script', action='store_true')
     parser.add_argument('-d', '--docker', action='store_true')
-    parser.add_argument('--from-file', action='store_true')
+    parser.add_argument('--from-file', type=str, nargs='?', const='nodeConfig.yaml', default=None, help='scenario in out/, a YAML file or a .npy topology')
     parser.add_argument('-f', '--forward', action='store_true')
     parser.add_argument('-p', '--program', type=str, default=os.getcwd() + "/")
     parser.add_argument('-c', '--collisions', action='store_true')
+    parser.add_argument('--mock', action='store_true', help='run lightweight mock nodes instead of the firmware')
+    parser.add_argument('--mock-period', type=float, default=0, help='mean period in s with which each mock node broadcasts a message by itself')
+    parser.add_argument('--capture', type=str, nargs='?', const=os.path.join("out", "capture.bin"), default=None, help='append the radio traffic to this capture file')
     args = parser.parse_args()
+    if args.nrNodes < 0:
+      parser.error("nrNodes must not be negative")
     # print(args)
 
     self.script = args.script
     self.docker = args.docker
+    self.mock = args.mock
+    self.mockPeriod = args.mock_period
     self.forwardToClient = args.forward
     self.emulateCollisions = args.collisions
     self.removeConfig = not args.from_file
+    self.capturePath = args.capture
+    conf = Config()
     if args.from_file:
       foundNodes = True
-      with open(os.path.join("out", "nodeConfig.yaml"), 'r') as file:
-        config = yaml.load(file, Loader=yaml.FullLoader)
-      conf.NR_NODES = len(config.keys())
+      config = loadNodeConfig(conf, os.path.join("out", args.from_file))
+      conf.NR_NODES = len(config)
     elif args.nrNodes > 0:  # nrNodes was specified
       conf.NR_NODES = args.nrNodes
       foundNodes = True
@@ -495,29 +777,61 @@ class interactiveSim():
       print("nrNodes was not specified, generating scenario...")
       config = genScenario(conf)
       conf.NR_NODES = len(config.keys())
+    self.conf = conf.freeze()
     pathToProgram = args.program
     return config, pathToProgram
 
 
-  def reconnectNodes(self):
-    time.sleep(3)
+  def forEachNode(self, func, nodes, stagger=True, staggerFirst=False):
+    """
+    Calls func for each of the nodes in a pool of BOOT_WORKERS threads and returns the results. When emulating
+    collisions (and stagger is True), the nodes are handled one by one, COLLISION_STAGGER s apart instead.
+    """
+    if self.emulateCollisions and stagger:
+      results = []
+      for i, n in enumerate(nodes):
+        if i > 0 or staggerFirst:
+          time.sleep(COLLISION_STAGGER) # Wait a bit to avoid immediate collisions when starting multiple nodes
+        results.append(func(n))
+      return results
+    with ThreadPoolExecutor(max_workers=BOOT_WORKERS) as pool:
+      return list(pool.map(func, nodes))
+
+
+  def connectNode(self, node):
+    """ Connects to node once its TCP port is open. This returns when the node has sent its configuration. """
+    deadline = time.monotonic() + NODE_TIMEOUT
+    while not node.iface:
+      if not waitFor(lambda: portIsOpen(node.TCPPort), deadline - time.monotonic()):
+        raise TimeoutError("node {} did not open TCP port {} within {} s".format(node.nodeid, node.TCPPort, NODE_TIMEOUT))
+      try:
+        iface = tcp_interface.TCPInterface(hostname="localhost", portNumber=node.TCPPort)
+        node.addInterface(iface)
+      except OSError:
+        print("Trying to reconnect to node...")
+        time.sleep(POLL_INTERVAL)
+
+
+  def reconnectNodes(self, rebooting=()):
+    """
+    Reconnects to the nodes after their configuration was sent: once each node confirmed its admin messages, and the
+    nodes in rebooting dropped the connection to reboot. A reboot is detected from the existing interface only, by it
+    losing the connection or replacing its socket; the port is probed only in connectNode, after the old connection is
+    closed. The nodes are reconnected in parallel, staggered only when emulating collisions.
+    """
+    for n in self.nodes[int(self.forwardToClient):]:
+      n.waitUntilSent()
+    for n in rebooting:
+      rebooted = lambda: not n.iface.isConnected.is_set() or n.iface.socket is not n.socket
+      if n.iface is not None and not waitFor(rebooted, REBOOT_TIMEOUT):
+        print("Node", n.nodeid, "did not reboot within", REBOOT_TIMEOUT, "s.")
     for n in self.nodes[int(self.forwardToClient):]:
       try:
         n.iface.close()
         n.iface = None
       except OSError:
         pass
-    time.sleep(5)
-    for n in self.nodes:
-      while not n.iface:
-        try:
-          iface = tcp_interface.TCPInterface(hostname="localhost", portNumber=n.TCPPort)
-          n.addInterface(iface)
-        except OSError:
-          print("Trying to reconnect to node...")
-          time.sleep(1)
-      if self.emulateCollisions and n.nodeid != len(self.nodes)-1:
-        time.sleep(2) # Wait a bit to avoid immediate collisions when starting multiple nodes
+    self.forEachNode(self.connectNode, [n for n in self.nodes if not n.iface])
 
 
   def forwardPacket(self, receivers, packet, rssis, snrs): 
@@ -549,16 +863,12 @@ class interactiveSim():
       meshPacket.decoded.want_response = packet["decoded"]["wantResponse"]
     if "channel" in packet:
       meshPacket.channel = int(packet["channel"])
+    serialized = meshPacket.SerializeToString()
     for i, rx in enumerate(receivers):
-      meshPacket.rx_rssi = int(rssis[i]) 
-      meshPacket.rx_snr = snrs[i]  
-      toRadio = mesh_pb2.ToRadio()
-      toRadio.packet.CopyFrom(meshPacket)
-      rx.iface._sendToRadio(toRadio)
+      rx.writer.put(encodedToRadio(meshPacket, serialized, int(rssis[i]), snrs[i]))
 
   def copyPacket(self, packet):
     # print(packet)
-    time.sleep(0.01)
     try:
       if 'simulator' in packet or packet["decoded"]["portnum"] == "SIMULATOR_APP":
         return None
@@ -605,16 +915,16 @@ class interactiveSim():
 
 
   def sendBroadcast(self, text, fromNode):
-    self.getNodeIfaceById(fromNode).sendText(text)
+    return self.getNodeIfaceById(fromNode).sendText(text)
 
 
   def sendDM(self, text, fromNode, toNode):
-    self.getNodeIfaceById(fromNode).sendText(text, destinationId=self.nodeIdToHwId(toNode), wantAck=True)
+    return self.getNodeIfaceById(fromNode).sendText(text, destinationId=self.nodeIdToHwId(toNode), wantAck=True)
 
 
   def sendPing(self, fromNode, toNode):
     payload = str.encode("test string")
-    self.getNodeIfaceById(fromNode).sendData(payload, destinationId=self.nodeIdToHwId(toNode), portNum=portnums_pb2.PortNum.REPLY_APP,
+    return self.getNodeIfaceById(fromNode).sendData(payload, destinationId=self.nodeIdToHwId(toNode), portNum=portnums_pb2.PortNum.REPLY_APP,
       wantAck=True, wantResponse=True)
 
 
@@ -634,10 +944,19 @@ class interactiveSim():
 
 
   def getNodeIfaceById(self, id):
-    for n in self.nodes:
-      if n.hwId == self.nodeIdToHwId(id):
-        return n.iface
-    return None
+    node = self.nodesByHwId.get(self.nodeIdToHwId(id))
+    return node.iface if node is not None else None
+
+
+  def removeNode(self, id):
+    node = self.nodesByHwId.pop(self.nodeIdToHwId(id))
+    del self.nodesByPort[node.TCPPort]
+    if getattr(node, "writer", None) is not None:
+      node.writer.close()
+    node.iface.localNode.exitSimulator()
+    node.iface.close()
+    self.nodes.remove(node)
+    self.receiverCache = {}
 
   
   def nodeIdToDest(self, id):
@@ -654,37 +973,43 @@ class interactiveSim():
 
 
   def onReceive(self, interface, packet): 
-    if "requestId" in packet["decoded"]:
-      # Packet with requestId is coupled to original message
-      existingMsgId = next((m.localId for m in self.messages if m.packet["id"] == packet["decoded"]["requestId"]), None)
-      if existingMsgId == None:
-          print('Could not find requestId!\n')
-      mId = existingMsgId
-    else:
-      existingMsgId = next((m.localId for m in self.messages if m.packet["id"] == packet["id"]), None)
-      if existingMsgId != None:
-          mId = existingMsgId
-      else: 
-          self.messageId += 1
-          mId = self.messageId
-    rP = interactivePacket(packet, mId)
-    self.messages.append(rP)
+    with self.messageLock:
+      if "requestId" in packet["decoded"]:
+        # Packet with requestId is coupled to original message
+        existingMsgId = self.messageIds.get(packet["decoded"]["requestId"])
+        if existingMsgId == None:
+            print('Could not find requestId!\n')
+        mId = existingMsgId
+      else:
+        existingMsgId = self.messageIds.get(packet["id"])
+        if existingMsgId != None:
+            mId = existingMsgId
+        else: 
+            self.messageId += 1
+            mId = self.messageId
+      rP = interactivePacket(packet, mId)
+      self.messages.append(rP)
+      if packet["id"] not in self.messageIds:
+        self.messageIds[packet["id"]] = mId
+        if len(self.messageIds) > MESSAGE_HISTORY:
+          self.messageIds.popitem(last=False)
 
     if self.script:
       print("Node", interface.myInfo.my_node_num-HW_ID_OFFSET, "sent", packet["decoded"]["simulator"]["portnum"], "with id", mId, "over the air!")
 
-    transmitter = next((n for n in self.nodes if n.TCPPort == interface.portNumber), None)
+    transmitter = self.nodesByPort.get(interface.portNumber)
     if transmitter is not None:
-      receivers = [n for n in self.nodes if n.nodeid != transmitter.nodeid]
-      rxs, rssis, snrs = self.calcReceivers(transmitter, receivers)
+      rxs, rssis, snrs = self.receiversOf(transmitter)
       rP.setTxRxs(transmitter, rxs)
       rP.setRSSISNR(rssis, snrs)
       self.forwardPacket(rxs, packet, rssis, snrs)
       self.graph.packets.append(rP)
+      if self.capture is not None:
+        self.capture.addTransmission(transmitter, mId, packet["raw"], rxs, rssis, snrs)
 
 
   def onReceiveMetrics(self, interface, packet):
-    fromNode = next((n for n in self.nodes if n.hwId == packet["from"]), None)
+    fromNode = self.nodesByHwId.get(packet["from"])
     if fromNode is not None:
       data = packet["decoded"]["payload"]
       if getattr(data, "SerializeToString", None):
@@ -699,14 +1024,12 @@ class interactiveSim():
         if 'time' in telemetryDict:
           timestamp = int(telemetryDict['time'])
           # Check whether it is not a duplicate
-          if len(fromNode.timestamps) == 0 or timestamp > fromNode.timestamps[-1]:
-            fromNode.timestamps.append(timestamp)
+          if fromNode.metrics.lastTime is None or timestamp > fromNode.metrics.lastTime:
             if 'channelUtilization' in deviceMetrics:
               channelUtilization = float(deviceMetrics['channelUtilization'])
-            fromNode.channelUtilization.append(channelUtilization)
             if 'airUtilTx' in deviceMetrics:
               airUtilTx = float(deviceMetrics['airUtilTx'])
-            fromNode.airUtilTx.append(airUtilTx)
+            fromNode.metrics.append(timestamp, (channelUtilization, airUtilTx))
       elif 'localStats' in telemetryDict:
         localStats = telemetryDict['localStats']
         if 'numPacketsTx' in localStats:
@@ -724,7 +1047,7 @@ class interactiveSim():
 
 
   def onReceiveAll(self, interface, packet):
-    if interface.portNumber == 4403:
+    if interface.portNumber == self.nodes[0].TCPPort:
       fromRadio = self.copyPacket(packet)
       if fromRadio is not None:
         # print("Forward", packet["decoded"])
@@ -736,36 +1059,75 @@ class interactiveSim():
 
 
   def nodeReader(self):
+    # Reads block until there is data, so these loops do not poll
     while not self.wantExit and self.nodes[0].iface != None:
       if self.clientConnected:
         break
       else:
         bytes = self.nodes[0].iface._readBytes(MAX_TO_FROM_RADIO_SIZE)
+        if bytes is None:  # interface closed
+          break
         if len(bytes) > 0:
           # print(bytes)
           self.clientSocket.send(bytes)
 
 
   def clientReader(self):
-    while not self.wantExit:
-      if self.nodes[0].iface != None:
+    while not self.wantExit and self.nodes[0].iface != None:
+      try:
         bytes = self.clientSocket.recv(MAX_TO_FROM_RADIO_SIZE)
-        if len(bytes) > 0:
-          self.nodes[0].iface._writeBytes(bytes)
-      else:
-        time.sleep(0.1)
+      except OSError:
+        break
+      if len(bytes) == 0:  # client disconnected
+        break
+      self.nodes[0].iface._writeBytes(bytes)
+
+
+  def forwardingStats(self):
+    """
+    Prints per node how many forwarded packets were queued, sent and dropped, and how long they waited,
+    and per worker how many received packets were handled and how long they waited.
+    """
+    elapsed = time.monotonic() - self.forwardingStart
+    print("Node  Queued    Sent  Dropped  Max queue  Mean wait (ms)  Max wait (ms)")
+    for n in self.nodes:
+      w = n.writer
+      meanWait = w.totalWait / w.sent * 1000 if w.sent > 0 else 0
+      print("{:>4}  {:>6}  {:>6}  {:>7}  {:>9}  {:>14.1f}  {:>13.1f}".format(n.nodeid, w.queued, w.sent, w.dropped, w.maxLength, meanWait, w.maxWait*1000))
+    sent = sum(n.writer.sent for n in self.nodes)
+    print("Forwarded {} packets in {:.0f} s ({:.2f} packets/s).".format(sent, elapsed, sent / elapsed if elapsed > 0 else 0))
+    print("Worker  Dispatched  Handled  Failed  Queue  Max queue  Mean wait (ms)  Max wait (ms)")
+    for w, (dispatched, handled, failed, length, maxLength, totalWait, maxWait) in enumerate(self.dispatcher.stats()):
+      meanWait = totalWait / handled * 1000 if handled > 0 else 0
+      print("{:>6}  {:>10}  {:>7}  {:>6}  {:>5}  {:>9}  {:>14.1f}  {:>13.1f}".format(w, dispatched, handled, failed, length, maxLength, meanWait, maxWait*1000))
+
+
+  def receiversOf(self, transmitter):
+    """ Receivers of packets from transmitter with their RSSI and SNR. Nodes do not move, so this is computed once per transmitter. """
+    if transmitter.nodeid not in self.receiverCache:
+      receivers = [n for n in self.nodes if n.nodeid != transmitter.nodeid]
+      self.receiverCache[transmitter.nodeid] = self.calcReceivers(transmitter, receivers)
+    return self.receiverCache[transmitter.nodeid]
 
 
   def calcReceivers(self, tx, receivers): 
     rxs = []
     rssis = []
     snrs = []
-    for rx in receivers:
-      dist_3d = calcDist(tx.x, rx.x, tx.y, rx.y, tx.z, rx.z) 
-      pathLoss = phy.estimatePathLoss(conf, dist_3d, conf.FREQ, tx.z, rx.z)
-      RSSI = conf.PTX + tx.antennaGain + rx.antennaGain - pathLoss
-      SNR = RSSI-conf.NOISE_LEVEL
-      if RSSI >= conf.SENSMODEM[conf.MODEM]:
+    if len(receivers) == 0:
+      return rxs, rssis, snrs
+    rxX = np.array([rx.x for rx in receivers], dtype=np.float64)
+    rxY = np.array([rx.y for rx in receivers], dtype=np.float64)
+    rxZ = np.array([rx.z for rx in receivers], dtype=np.float64)
+    dist_3d = calcDistArray(tx.x, rxX, tx.y, rxY, tx.z, rxZ)
+    pathLoss = phy.estimatePathLossArray(self.conf, dist_3d, self.conf.FREQ, tx.z, rxZ)
+    terrain = getTerrain(self.conf)
+    if terrain is not None:
+      pathLoss = pathLoss + terrain.diffractionLoss(self.conf.FREQ, tx.x, tx.y, tx.z, rxX, rxY, rxZ)
+    for i, rx in enumerate(receivers):
+      RSSI = self.conf.PTX + tx.antennaGain + rx.antennaGain - float(pathLoss[i])
+      SNR = RSSI-self.conf.NOISE_LEVEL
+      if RSSI >= self.conf.SENSMODEM[self.conf.MODEM]:
         rxs.append(rx)
         rssis.append(RSSI)
         snrs.append(SNR)
@@ -775,13 +1137,27 @@ class interactiveSim():
   def closeNodes(self):
     print("\nClosing all nodes...")
     pub.unsubAll()
+    if self.dispatcher is not None:
+      self.dispatcher.close()
+    for n in self.nodes:
+      if getattr(n, "writer", None) is not None:
+        n.writer.close()
+    if self.capture is not None:
+      self.capture.close()
+      print("Captured", self.capture.count, "records in", self.capture.path)
+      self.capture = None
     for n in self.nodes:
       n.iface.localNode.exitSimulator()
       n.iface.close()
+    if self.mockProcess is not None:
+      self.mockProcess.join(MOCK_EXIT_TIMEOUT)
+      if self.mockProcess.is_alive():
+        self.mockProcess.terminate()
+        self.mockProcess.join()
     if self.docker:
       self.container.stop()
     if self.forwardToClient:
-      self._wantExit = True
+      self.wantExit = True
       self.forwardSocket.close()
       self.clientSocket.close()
 
@@ -917,9 +1293,43 @@ class CommandProcessor(cmd.Cmd):
         if self.sim.getNodeIfaceById(nodeId) is None:
           print('Node ID', nodeId, 'is not in the list of nodes.')
         else:
-          self.sim.getNodeIfaceById(nodeId).localNode.exitSimulator()
-          self.sim.getNodeIfaceById(nodeId).close()
-          del self.sim.nodes[nodeId]
+          self.sim.removeNode(nodeId)
+
+
+    def do_load(self, line):
+        """load <rate> <duration> [broadcast|dm|ping ...] | load trace <file>
+        Send \x1B[3mrate\x1B[0m messages per second of the given kinds between random nodes for \x1B[3mduration\x1B[0m s,
+        or the messages of a trace \x1B[3mfile\x1B[0m, and report their delivery ratio, latency and throughput."""
+        arguments = line.split()
+        if len(arguments) == 2 and arguments[0] == "trace":
+            try:
+                schedule = list(readTrace(arguments[1]))
+            except (OSError, ValueError, IndexError) as ex:
+                print('Could not read trace', arguments[1]+':', ex)
+                return False
+            for _, kind, fromNode, toNode in schedule:
+                for n in (fromNode,) if kind == "broadcast" else (fromNode, toNode):
+                    if self.sim.getNodeIfaceById(n) is None:
+                        print('Node ID', n, 'is not in the list of nodes.')
+                        return False
+        elif len(arguments) >= 2 and all(k in LOAD_KINDS for k in arguments[2:]) and all(a.replace('.', '', 1).isdigit() for a in arguments[:2]):
+            nodeIds = [n.nodeid for n in self.sim.nodes]
+            if len(nodeIds) < 2:
+                print('At least two nodes are needed to generate load.')
+                return False
+            schedule = rateSchedule(nodeIds, float(arguments[0]), float(arguments[1]), arguments[2:] or LOAD_KINDS)
+        else:
+            print('Please use the syntax: "load <rate> <duration> [broadcast|dm|ping ...]" or "load trace <file>"')
+            return False
+        print('Generating load, press Control+c to stop.')
+        LoadGenerator(self.sim).run(schedule)
+
+
+    def do_forwarding(self, line):
+        """forwarding
+        Show the forwarding statistics of each node: packets queued, sent and dropped, and how long they waited,
+        and how long received packets waited to be handled."""
+        self.sim.forwardingStats()
 
 
     def do_plot(self, line):
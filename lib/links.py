@@ -0,0 +1,161 @@
+import hashlib
+import math
+import os
+import random
+
+import numpy as np
+
+from lib.common import calcDistArray
+from lib.config import contentHash
+from lib.terrain import getTerrain, terrainLossTable
+from . import phy
+
+# Parameters that determine the path loss between two positions, and whether a packet can be sensed or detected
+PHY_PARAMS = ["MODEL", "FREQ", "PTX", "GAMMA", "D0", "LPLD0", "MODEM", "SENSMODEM", "CADMODEM",
+              "TERRAIN_FILE", "TERRAIN_ORIGIN", "TERRAIN_RESOLUTION"]
+# Tables that depend on the asymmetric offset of each link, if the asymmetric link model is enabled
+LINK_TABLES = ["lpl", "rssi", "sensed", "detected"]
+# Parameters that determine the asymmetric offset of each link
+OFFSET_PARAMS = ["SEED", "MODEL_ASYMMETRIC_LINKS", "MODEL_ASYMMETRIC_LINKS_MEAN", "MODEL_ASYMMETRIC_LINKS_STDDEV"]
+
+
+def linkOffsets(conf, nrNodes=None):
+    """
+    Returns the asymmetric link offsets as an nrNodes x nrNodes matrix, drawn in a fixed
+    order from a generator seeded with conf.SEED. Without the asymmetric link model, all offsets are 0.
+    The offsets are identical to calling gauss() of random.Random(conf.SEED) for each link in row-major order,
+    but the uniform draws come from a NumPy generator in the same Mersenne Twister state, and the Box-Muller
+    transform of gauss() is applied to all of them at once.
+    """
+    nrNodes = conf.NR_NODES if nrNodes is None else nrNodes
+    offsets = np.zeros((nrNodes, nrNodes))
+    if conf.MODEL_ASYMMETRIC_LINKS:
+        count = nrNodes * (nrNodes - 1)
+        pairs = (count + 1) // 2
+        _, internalState, _ = random.Random(conf.SEED).getstate()
+        generator = np.random.RandomState()
+        generator.set_state(("MT19937", np.array(internalState[:-1], dtype=np.uint32), internalState[-1]))
+        uniform = generator.random_sample(2 * pairs).reshape(pairs, 2)
+        # math instead of NumPy for the transcendental functions, which are not guaranteed to round the same way
+        x2pi = (uniform[:, 0] * (2.0 * math.pi)).tolist()
+        g2rad = np.sqrt(-2.0 * np.fromiter(map(math.log, (1.0 - uniform[:, 1]).tolist()), np.float64, pairs))
+        normal = np.empty((pairs, 2))
+        normal[:, 0] = np.fromiter(map(math.cos, x2pi), np.float64, pairs)
+        normal[:, 1] = np.fromiter(map(math.sin, x2pi), np.float64, pairs)
+        normal *= g2rad[:, np.newaxis]
+        offsets[~np.eye(nrNodes, dtype=bool)] = conf.MODEL_ASYMMETRIC_LINKS_MEAN + normal.ravel()[:count] * conf.MODEL_ASYMMETRIC_LINKS_STDDEV
+    return offsets
+
+
+def topologyKey(nodes):
+    """ Hash of the positions and antenna gains of the nodes. """
+    layout = np.array([[n.x, n.y, n.z, n.antennaGain] for n in nodes], dtype=np.float64)
+    return hashlib.sha256(layout.tobytes()).hexdigest()
+
+
+def pathLossTables(conf, nodes):
+    """
+    The distance and path loss matrices of the nodes, which only depend on their layout and the PHY parameters.
+    With a terrain, the path loss includes its diffraction loss.
+    """
+    x = np.array([n.x for n in nodes], dtype=np.float64)
+    y = np.array([n.y for n in nodes], dtype=np.float64)
+    z = np.array([n.z for n in nodes], dtype=np.float64)
+    # Same order of operations as calcDist and estimatePathLoss in MeshPacket, so the values are identical
+    distance = calcDistArray(x[:, np.newaxis], x[np.newaxis, :], y[:, np.newaxis], y[np.newaxis, :], z[:, np.newaxis], z[np.newaxis, :])
+    pathLoss = phy.estimatePathLossArray(conf, distance, conf.FREQ, z[:, np.newaxis], z[np.newaxis, :])
+    np.fill_diagonal(distance, 0)
+    np.fill_diagonal(pathLoss, 0)
+    terrain = getTerrain(conf)
+    if terrain is not None:
+        pathLoss += terrainLossTable(conf, terrain, nodes)
+    return {"distance": distance, "pathLoss": pathLoss}
+
+
+def linkRssi(conf, nodes, pathLoss, offset):
+    """ Link loss and RSSI of a packet from transmitter i at receiver j, identical to MeshPacket. The diagonals are meaningless. """
+    gains = np.array([n.antennaGain for n in nodes], dtype=np.float64)
+    lpl = pathLoss + offset
+    # Same order of operations as MeshPacket: ((PTX + txGain) + rxGain) - Lpl
+    rssi = (conf.PTX + gains[:, np.newaxis]) + gains[np.newaxis, :] - lpl
+    return lpl, rssi
+
+
+def linkTables(conf, nodes, pathLoss):
+    """
+    The total loss, RSSI, sensed and detected tables of the nodes. With the asymmetric link model, these depend on
+    the offsets drawn for conf.SEED, which are included as "offset". Without it, they only depend on the layout
+    and the PHY parameters, like the path loss, so they can be shared by all runs on a topology.
+    """
+    tables = {}
+    offset = 0.0
+    if conf.MODEL_ASYMMETRIC_LINKS:
+        offset = tables["offset"] = linkOffsets(conf, len(nodes))
+    lpl, rssi = linkRssi(conf, nodes, pathLoss, offset)
+    np.fill_diagonal(lpl, 0)
+    np.fill_diagonal(rssi, 0)
+    sensed = rssi >= conf.SENSMODEM[conf.MODEM]
+    detected = rssi >= conf.CADMODEM[conf.MODEM]
+    np.fill_diagonal(sensed, False)
+    np.fill_diagonal(detected, False)
+    tables.update({"lpl": lpl, "rssi": rssi, "sensed": sensed, "detected": detected})
+    return tables
+
+
+def _cachedTables(directory, names, compute):
+    """ Loads the named tables read-only from memory-mapped .npy files in directory, computing and storing them if missing. """
+    paths = {name: os.path.join(directory, name+".npy") for name in names}
+    if not all(os.path.isfile(path) for path in paths.values()):
+        tables = compute()
+        os.makedirs(directory, exist_ok=True)
+        for name, path in paths.items():
+            # Write under a temporary name, so other processes never open a partial file
+            tmpPath = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmpPath, 'wb') as file:
+                np.save(file, tables[name])
+            os.replace(tmpPath, path)
+    return {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+
+
+class LinkTables():
+    """
+    Per-link values of a static topology, as nrNodes x nrNodes matrices indexed by [txNodeId, rxNodeId]:
+    the 3D distance, the path loss, the asymmetric offset, the total loss (path loss + offset), the
+    RSSI, and whether the receiver senses and detects (CAD) a packet of the transmitter.
+    The values are bitwise identical to those MeshPacket computes for each packet, so they can be
+    used for every packet between nodes that do not move.
+    Without the asymmetric link model, the offset is a read-only view of zeros, and all tables only depend on the
+    topology and the PHY parameters.
+    With a cache directory, the tables are stored as .npy files and opened read-only and memory-mapped,
+    so runs and worker processes with the same topology share them. They are stored per topology and PHY hash
+    and shared by all runs on a topology, except for the tables that depend on the asymmetric link offsets,
+    which are stored per seed below them.
+    Alternatively, the tables can be given as sharedTables, e.g. attached from shared memory. Tables missing from
+    them, i.e. those that depend on the asymmetric link offsets, are computed for this run.
+    """
+    def __init__(self, conf, nodes, directory=None, sharedTables=None):
+        if sharedTables is not None:
+            tables = dict(sharedTables)
+        elif directory is None:
+            tables = pathLossTables(conf, nodes)
+        else:
+            phyKey = contentHash(conf, PHY_PARAMS)
+            topologyDirectory = os.path.join(directory, "{}-{}".format(topologyKey(nodes)[:32], phyKey[:32]))
+            tables = _cachedTables(topologyDirectory, ["distance", "pathLoss"], lambda: pathLossTables(conf, nodes))
+            if conf.MODEL_ASYMMETRIC_LINKS:
+                offsetKey = contentHash(conf, OFFSET_PARAMS)
+                tables.update(_cachedTables(os.path.join(topologyDirectory, offsetKey[:32]), ["offset"] + LINK_TABLES,
+                                            lambda: linkTables(conf, nodes, tables["pathLoss"])))
+            else:
+                tables.update(_cachedTables(topologyDirectory, LINK_TABLES, lambda: linkTables(conf, nodes, tables["pathLoss"])))
+        if any(name not in tables for name in LINK_TABLES):
+            tables.update(linkTables(conf, nodes, tables["pathLoss"]))
+        self.distance = tables["distance"]
+        self.pathLoss = tables["pathLoss"]
+        self.offset = tables.get("offset", np.broadcast_to(np.float64(0), self.pathLoss.shape))
+        self.lpl = tables["lpl"]
+        self.rssi = tables["rssi"]
+        self.sensed = tables["sensed"]
+        self.detected = tables["detected"]
+        # Links from or to these nodes change during the simulation, so they are computed per packet
+        self.movingNodes = [n for n in nodes if n.isMoving]
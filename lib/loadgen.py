@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pubsub import pub
+
+LOAD_KINDS = ("broadcast", "dm", "ping")
+LOAD_WORKERS = 16  # messages handed to the nodes at the same time
+DRAIN_TIME = 30  # s to wait for deliveries after the last message was sent
+PENDING_HISTORY = 10000  # receptions kept that do not match a message sent (yet)
+
+
+def rateSchedule(nodeIds, rate, duration, kinds=LOAD_KINDS, seed=None):
+    """
+    Yields (time in s, kind, from node, to node) of messages sent with exponentially distributed intervals at rate
+    messages per second in total, for duration s. Each message has a random kind out of kinds and random nodes.
+    """
+    rng = random.Random(seed)
+    t = rng.expovariate(rate)
+    while t < duration:
+        fromNode, toNode = rng.sample(nodeIds, 2)
+        yield t, rng.choice(kinds), fromNode, toNode
+        t += rng.expovariate(rate)
+
+
+def readTrace(path):
+    """
+    Yields (time in s, kind, from node, to node) from a trace file with a line '<time> <kind> <fromNode> [<toNode>]'
+    per message, sorted by time, where kind is broadcast, dm or ping. Empty lines and lines starting with # are skipped.
+    toNode is required for dm and ping, and None for a broadcast without it.
+    """
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if fields[1] not in LOAD_KINDS:
+                raise ValueError("unknown kind '{}' in trace {}".format(fields[1], path))
+            if fields[1] != "broadcast" and len(fields) < 4:
+                raise ValueError("{} without destination node in trace {}".format(fields[1], path))
+            yield float(fields[0]), fields[1], int(fields[2]), int(fields[3]) if len(fields) > 3 else None
+
+
+class sentMessage():
+    def __init__(self, kind, fromNode, toNode, sendTime):
+        self.kind = kind
+        self.fromNode = fromNode
+        self.toNode = toNode
+        self.sendTime = sendTime
+        self.receivers = set()
+
+
+class LoadGenerator():
+    """
+    Sends broadcasts, DMs and pings of the interactive simulator according to a schedule, from many nodes concurrently,
+    and measures when their clients receive them: a broadcast at every other node, a DM at its destination, and the
+    reply to a ping back at its sender. Reports the delivery ratio, latency percentiles and throughput per kind and per
+    number of hops.
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.lock = threading.Lock()
+        self.messages = {}  # packet ID -> sentMessage
+        self.deliveries = []  # (kind, hops, latency in s)
+        # Receptions by packet ID (or request ID of a reply) that arrived before send() registered their message
+        self.pending = OrderedDict()
+        self.failed = 0
+
+    def run(self, schedule, drainTime=DRAIN_TIME):
+        """ Sends the messages of schedule, an iterable of (time in s, kind, from node, to node), and reports when they arrived. """
+        pub.subscribe(self.onReceive, "meshtastic.receive")
+        self.start = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+                for t, kind, fromNode, toNode in schedule:
+                    delay = self.start + t - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self.send, kind, fromNode, toNode)
+            self.lastSend = time.monotonic()
+            deadline = self.lastSend + drainTime
+            while time.monotonic() < deadline and not self.complete():
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            print("Load generation interrupted.")
+            self.lastSend = time.monotonic()
+        finally:
+            pub.unsubscribe(self.onReceive, "meshtastic.receive")
+        self.report()
+
+    def send(self, kind, fromNode, toNode):
+        sendTime = time.monotonic()
+        try:
+            if kind == "broadcast":
+                packet = self.sim.sendBroadcast("load "+str(len(self.messages)), fromNode)
+            elif kind == "dm":
+                packet = self.sim.sendDM("load "+str(len(self.messages)), fromNode, toNode)
+            else:
+                packet = self.sim.sendPing(fromNode, toNode)
+        except Exception as ex:
+            print("Could not send", kind, "from node", fromNode, ex)
+            with self.lock:
+                self.failed += 1
+            return
+        with self.lock:
+            message = sentMessage(kind, fromNode, toNode, sendTime)
+            self.messages[packet.id] = message
+            for reception in self.pending.pop(packet.id, []):
+                self.match(message, *reception)
+
+    def expected(self, message):
+        return len(self.sim.nodes) - 1 if message.kind == "broadcast" else 1
+
+    def complete(self):
+        with self.lock:
+            return all(len(m.receivers) >= self.expected(m) for m in self.messages.values())
+
+    def onReceive(self, interface, packet):
+        decoded = packet.get("decoded", {})
+        if decoded.get("portnum") == "SIMULATOR_APP":  # the packet over the air, not what the node delivers
+            return
+        node = self.sim.nodesByPort.get(interface.portNumber)
+        if node is None:
+            return
+        isReply = decoded.get("portnum") == "REPLY_APP" and "requestId" in decoded
+        hops = packet["hopStart"] - packet.get("hopLimit", 0) if "hopStart" in packet else None
+        reception = (node.nodeid, isReply, hops, time.monotonic())
+        packetId = decoded["requestId"] if isReply else packet.get("id")
+        with self.lock:
+            message = self.messages.get(packetId)
+            if message is not None:
+                self.match(message, *reception)
+            else:
+                self.pending.setdefault(packetId, []).append(reception)
+                if len(self.pending) > PENDING_HISTORY:
+                    self.pending.popitem(last=False)
+
+    def match(self, message, nodeId, isReply, hops, receiveTime):
+        """ Counts a reception of message if it is a delivery: the first at a node, by the right node. """
+        if isReply:
+            if message.kind != "ping" or nodeId != message.fromNode:
+                return
+        elif message.kind == "ping" or nodeId == message.fromNode or (message.kind == "dm" and nodeId != message.toNode):
+            return
+        if nodeId in message.receivers:
+            return
+        message.receivers.add(nodeId)
+        self.deliveries.append((message.kind, hops, receiveTime - message.sendTime))
+
+    def report(self):
+        duration = max(self.lastSend - self.start, 1e-9)
+        with self.lock:
+            messages = list(self.messages.values())
+            deliveries = list(self.deliveries)
+        print("Sent {} messages in {:.1f} s ({:.2f}/s), {} could not be sent.".format(len(messages), duration, len(messages) / duration, self.failed))
+        print("Kind       Sent  Expected  Delivered  Ratio (%)  p50 (ms)  p90 (ms)  p99 (ms)  Throughput (/s)")
+        for kind in LOAD_KINDS:
+            sent = [m for m in messages if m.kind == kind]
+            if not sent:
+                continue
+            expected = sum(self.expected(m) for m in sent)
+            latencies = [latency for k, _, latency in deliveries if k == kind]
+            print("{:<9}  {:>4}  {:>8}  {:>9}  {:>9.1f}  {}  {:>15.2f}".format(kind, len(sent), expected, len(latencies),
+                  len(latencies) / expected * 100, self.percentiles(latencies), len(latencies) / duration))
+        hopCounts = sorted({hops for _, hops, _ in deliveries if hops is not None})
+        if hopCounts:
+            print("Hops  Delivered  p50 (ms)  p90 (ms)  p99 (ms)  Throughput (/s)")
+            for hops in hopCounts:
+                latencies = [latency for _, h, latency in deliveries if h == hops]
+                print("{:>4}  {:>9}  {}  {:>15.2f}".format(hops, len(latencies), self.percentiles(latencies), len(latencies) / duration))
+
+    @staticmethod
+    def percentiles(latencies):
+        if not latencies:
+            return "{:>8}  {:>8}  {:>8}".format("-", "-", "-")
+        return "{:>8.0f}  {:>8.0f}  {:>8.0f}".format(*np.percentile(np.array(latencies) * 1000, [50, 90, 99]))
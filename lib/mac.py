@@ -1,5 +1,5 @@
 import random
-from .phy import airtime, slotTime
+from .phy import airtime, getSlotTime
 
 
 VERBOSE = False
@@ -33,7 +33,7 @@ def getTxDelayMsecWeighted(node, rssi):  # from RadioInterface::getTxDelayMsecWe
     else:
         CW = random.randint(0, 2**CWsize-1)
     verboseprint('Node', node.nodeid, 'has CW size', CWsize, 'and picked CW', CW)
-    return CW * slotTime
+    return CW * getSlotTime(node.conf)
 
 
 def getTxDelayMsec(node):  # from RadioInterface::getTxDelayMsec
@@ -41,14 +41,14 @@ def getTxDelayMsec(node):  # from RadioInterface::getTxDelayMsec
     CWsize = int(channelUtil*(CWmax - CWmin)/100 + CWmin)
     CW = random.randint(0, 2**CWsize-1)
     verboseprint('Current channel utilization is', channelUtil, 'So picked CW', CW)
-    return CW * slotTime
+    return CW * getSlotTime(node.conf)
 
 
 def getRetransmissionMsec(node, packet):  # from RadioInterface::getRetransmissionMsec
     packetAirtime = int(airtime(node.conf, node.conf.SFMODEM[node.conf.MODEM], node.conf.CRMODEM[node.conf.MODEM], packet.packetLen, node.conf.BWMODEM[node.conf.MODEM]))
     channelUtil = node.airUtilization/node.env.now*100 
     CWsize = int(channelUtil*(CWmax - CWmin)/100 + CWmin)
-    return 2*packetAirtime + (2**CWsize + 2**(int((CWmax+CWmin)/2))) * slotTime + PROCESSING_TIME_MSEC;
+    return 2*packetAirtime + (2**CWsize + 2**(int((CWmax+CWmin)/2))) * getSlotTime(node.conf) + PROCESSING_TIME_MSEC;
 
 
 if VERBOSE:
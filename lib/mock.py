@@ -0,0 +1,399 @@
+import heapq
+import itertools
+import random
+import selectors
+import signal
+import socket
+import string
+import time
+from collections import Counter, OrderedDict, deque
+
+import numpy as np
+from meshtastic import BROADCAST_NUM, admin_pb2, channel_pb2, config_pb2, mesh_pb2, portnums_pb2, telemetry_pb2
+
+from lib import phy
+
+START1 = 0x94
+START2 = 0xC3
+HEADER_LEN = 4
+MAX_TO_FROM_RADIO_SIZE = 512
+QUEUE_SIZE = 16  # free entries of the transmit queue reported to the client
+NR_CHANNELS = 8
+FIRMWARE_VERSION = "mock"
+SELECT_TIMEOUT = 0.1  # s
+REBROADCAST_WINDOW = 1.0  # s, a rebroadcast is delayed randomly up to this
+REBOOT_DELAY = 0.5  # s after a configuration change before a node reboots, so it still receives the rest of the configuration
+REBOOT_TIME = 1.0  # s that a node is unreachable while it reboots
+TELEMETRY_INTERVAL = 60  # s between the device metrics that each node sends to its client
+PACKET_HISTORY = 10000  # packets remembered per node to detect duplicates, and in total to measure the forwarding latency
+
+
+class MockNode():
+    """ An emulated node: its server and clients, the packets it has seen and counters of what it received and sent. """
+    def __init__(self, nodeid, hwId, port, hopLimit):
+        self.nodeid = nodeid
+        self.hwId = hwId
+        self.port = port
+        self.hopLimit = hopLimit
+        self.role = config_pb2.Config.DeviceConfig.Role.CLIENT
+        self.server = None
+        self.clients = {}  # socket -> bytes received that do not form a complete frame yet
+        self.seen = OrderedDict()  # (from, id) of the packets received over the air
+        self.received = Counter()  # kind of packet -> number received
+        self.bytesReceived = 0
+        self.generated = 0
+        self.transmitted = 0
+        self.rebroadcasts = 0
+        self.delivered = 0
+        self.airtimeTx = 0.0  # s since the last device metrics
+        self.airtimeRx = 0.0
+        self.rebooting = False
+        self.exited = False
+
+
+class MockMesh():
+    """
+    Stand-in for the meshtasticd simulator nodes, to test and benchmark the interactive simulator without firmware.
+    Each node listens on its TCP port and speaks the framed ToRadio/FromRadio protocol: it sends its configuration,
+    confirms every packet with a QueueStatus, and answers the admin messages that the interactive simulator sends.
+    Packets from a client are transmitted like SimRadio does, as a SIMULATOR_APP packet to the client. A SIMULATOR_APP
+    packet from the client is received over the air: it is delivered to the client if it is addressed to the node,
+    answered if requested, and rebroadcast otherwise. With a period, each node also generates broadcasts with an
+    exponentially distributed interval. All nodes are served from one thread, so hundreds of them fit on one machine.
+    """
+    def __init__(self, conf, nodes, period=0, seed=None):
+        self.conf = conf
+        self.nodes = [MockNode(*n) for n in nodes]
+        self.period = period
+        self.rng = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.timers = []  # heap of (time, sequence number, function, arguments)
+        self.sequence = itertools.count()
+        self.packetIds = itertools.count(self.rng.randrange(1, 1 << 30))
+        self.emitted = OrderedDict()  # (from, id, hop limit) -> time its transmission was sent to the client
+        self.latencies = deque(maxlen=PACKET_HISTORY)  # s between a transmission and its reception at a receiver
+        self.latencySum = 0.0
+        self.latencyCount = 0
+        self.nrActive = len(self.nodes)
+        self.wantExit = False
+
+    def run(self):
+        """ Serves the nodes until all of them were told to exit, or stop() is called. """
+        self.startTime = time.monotonic()
+        for n in self.nodes:
+            self.listen(n)
+            self.schedule(self.rng.uniform(0, TELEMETRY_INTERVAL), self.sendDeviceMetrics, n)
+            if self.period > 0:
+                self.schedule(self.rng.expovariate(1 / self.period), self.generateMessage, n)
+        while not self.wantExit and self.nrActive > 0:
+            timeout = SELECT_TIMEOUT
+            if self.timers:
+                timeout = min(timeout, max(self.timers[0][0] - time.monotonic(), 0))
+            for key, _ in self.selector.select(timeout):
+                callback, node = key.data
+                callback(node, key.fileobj)
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                _, _, func, args = heapq.heappop(self.timers)
+                func(*args)
+        for n in self.nodes:
+            self.closeNode(n)
+        self.selector.close()
+        self.report()
+
+    def stop(self):
+        self.wantExit = True
+
+    def schedule(self, delay, func, *args):
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.sequence), func, args))
+
+    def listen(self, node):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("localhost", node.port))
+        server.listen()
+        server.setblocking(False)
+        node.server = server
+        self.selector.register(server, selectors.EVENT_READ, (self.accept, node))
+
+    def accept(self, node, server):
+        try:
+            sock, _ = server.accept()
+        except OSError:
+            return
+        sock.setblocking(True)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        node.clients[sock] = bytearray()
+        self.selector.register(sock, selectors.EVENT_READ, (self.read, node))
+
+    def disconnect(self, node, sock):
+        if node.clients.pop(sock, None) is not None:
+            self.selector.unregister(sock)
+            sock.close()
+
+    def closeNode(self, node):
+        for sock in list(node.clients):
+            self.disconnect(node, sock)
+        if node.server is not None:
+            self.selector.unregister(node.server)
+            node.server.close()
+            node.server = None
+
+    def exitNode(self, node):
+        self.closeNode(node)
+        if not node.exited:
+            node.exited = True
+            self.nrActive -= 1
+
+    def reboot(self, node):
+        """ Drops the connections and closes the port for REBOOT_TIME, like a node that applies a new configuration. """
+        node.rebooting = False
+        if node.server is not None and not node.exited:
+            self.closeNode(node)
+            node.seen.clear()
+            self.schedule(REBOOT_TIME, self.restart, node)
+
+    def restart(self, node):
+        if not node.exited and node.server is None:
+            self.listen(node)
+
+    def read(self, node, sock):
+        try:
+            data = sock.recv(1 << 16)
+        except OSError:
+            data = b''
+        if not data:
+            self.disconnect(node, sock)
+            return
+        buffer = node.clients[sock]
+        buffer += data
+        while True:
+            start = buffer.find(bytes([START1, START2]))
+            if start < 0:  # only wake-up bytes or noise, but a frame may start with the last byte
+                del buffer[:len(buffer) - 1 if buffer[-1:] == bytes([START1]) else len(buffer)]
+                return
+            del buffer[:start]
+            if len(buffer) < HEADER_LEN:
+                return
+            length = (buffer[2] << 8) + buffer[3]
+            if length > MAX_TO_FROM_RADIO_SIZE:
+                del buffer[:1]
+                continue
+            if len(buffer) < HEADER_LEN + length:
+                return
+            frame = bytes(buffer[HEADER_LEN:HEADER_LEN+length])
+            del buffer[:HEADER_LEN+length]
+            node.bytesReceived += HEADER_LEN + length
+            self.handleToRadio(node, sock, mesh_pb2.ToRadio.FromString(frame))
+            if sock not in node.clients:  # disconnected while handling it
+                return
+
+    def send(self, node, fromRadio, sock=None):
+        data = fromRadio.SerializeToString()
+        frame = bytes([START1, START2, (len(data) >> 8) & 0xFF, len(data) & 0xFF]) + data
+        for client in [sock] if sock is not None else list(node.clients):
+            try:
+                client.sendall(frame)
+            except OSError:
+                self.disconnect(node, client)
+
+    def handleToRadio(self, node, sock, toRadio):
+        kind = toRadio.WhichOneof("payload_variant")
+        if kind == "want_config_id":
+            self.sendConfig(node, sock, toRadio.want_config_id)
+        elif kind == "packet":
+            self.handleClientPacket(node, toRadio.packet)
+        elif kind == "disconnect":
+            self.disconnect(node, sock)
+
+    def sendConfig(self, node, sock, configId):
+        user = mesh_pb2.User(id="!{:08x}".format(node.hwId), long_name="Node "+str(node.nodeid), short_name=str(node.nodeid))
+        messages = [mesh_pb2.FromRadio(my_info=mesh_pb2.MyNodeInfo(my_node_num=node.hwId)),
+                    mesh_pb2.FromRadio(node_info=mesh_pb2.NodeInfo(num=node.hwId, user=user)),
+                    mesh_pb2.FromRadio(metadata=mesh_pb2.DeviceMetadata(firmware_version=FIRMWARE_VERSION))]
+        for index in range(NR_CHANNELS):
+            channel = channel_pb2.Channel(index=index, role=channel_pb2.Channel.Role.PRIMARY if index == 0 else channel_pb2.Channel.Role.DISABLED)
+            if index == 0:
+                channel.settings.psk = b'\x01'
+            messages.append(mesh_pb2.FromRadio(channel=channel))
+        messages.append(mesh_pb2.FromRadio(config=config_pb2.Config(device=config_pb2.Config.DeviceConfig(role=node.role))))
+        messages.append(mesh_pb2.FromRadio(config=config_pb2.Config(lora=config_pb2.Config.LoRaConfig(use_preset=True, hop_limit=node.hopLimit,
+            region=config_pb2.Config.LoRaConfig.RegionCode.US, tx_enabled=True))))
+        messages.append(mesh_pb2.FromRadio(config_complete_id=configId))
+        for fromRadio in messages:
+            self.send(node, fromRadio, sock)
+
+    def handleClientPacket(self, node, packet):
+        self.send(node, mesh_pb2.FromRadio(queueStatus=mesh_pb2.QueueStatus(res=0, free=QUEUE_SIZE, maxlen=QUEUE_SIZE, mesh_packet_id=packet.id)))
+        if packet.decoded.portnum == portnums_pb2.PortNum.SIMULATOR_APP:
+            node.received["air"] += 1
+            self.receive(node, packet)
+        elif packet.to == node.hwId:
+            node.received["local"] += 1
+            self.handleLocal(node, packet)
+        else:
+            node.received["client"] += 1
+            setattr(packet, "from", node.hwId)
+            if packet.hop_limit == 0:
+                packet.hop_limit = node.hopLimit
+            packet.hop_start = packet.hop_limit
+            self.transmit(node, packet)
+
+    def handleLocal(self, node, packet):
+        """ Handles a packet from the client to the node itself: admin messages and requests for local stats. """
+        if packet.decoded.portnum == portnums_pb2.PortNum.ADMIN_APP:
+            admin = admin_pb2.AdminMessage.FromString(packet.decoded.payload)
+            variant = admin.WhichOneof("payload_variant")
+            if variant == "exit_simulator":
+                self.exitNode(node)
+                return
+            if packet.decoded.want_response:
+                self.sendLocal(node, packet, portnums_pb2.PortNum.ADMIN_APP, admin_pb2.AdminMessage(session_passkey=b'mock').SerializeToString())
+            if variant == "set_config" and admin.set_config.HasField("device"):
+                node.role = admin.set_config.device.role
+            if variant in ("set_config", "set_module_config") and not node.rebooting:
+                node.rebooting = True
+                self.schedule(REBOOT_DELAY, self.reboot, node)
+        elif packet.decoded.portnum == portnums_pb2.PortNum.TELEMETRY_APP and packet.decoded.want_response:
+            localStats = telemetry_pb2.LocalStats(num_packets_tx=node.transmitted, num_packets_rx=node.received["air"],
+                num_rx_dupe=node.received["duplicate"], num_tx_relay=node.rebroadcasts, uptime_seconds=int(time.monotonic() - self.startTime))
+            telemetry = telemetry_pb2.Telemetry(time=int(time.time()), local_stats=localStats)
+            self.sendLocal(node, packet, portnums_pb2.PortNum.TELEMETRY_APP, telemetry.SerializeToString())
+
+    def sendLocal(self, node, request, portnum, payload):
+        """ Sends a packet from the node to its client, in response to request if it is given. """
+        packet = mesh_pb2.MeshPacket(to=node.hwId, id=next(self.packetIds), rx_time=int(time.time()))
+        setattr(packet, "from", node.hwId)
+        packet.decoded.portnum = portnum
+        packet.decoded.payload = payload
+        if request is not None:
+            packet.decoded.request_id = request.id
+        self.send(node, mesh_pb2.FromRadio(packet=packet))
+
+    def airtime(self, packet):
+        return phy.airtime(self.conf, self.conf.SFMODEM[self.conf.MODEM], self.conf.CRMODEM[self.conf.MODEM],
+                           len(packet.decoded.payload), self.conf.BWMODEM[self.conf.MODEM]) / 1000
+
+    def transmit(self, node, packet):
+        """ Transmits a packet over the air: like SimRadio, it is sent to the client wrapped in a SIMULATOR_APP packet. """
+        air = mesh_pb2.MeshPacket()
+        air.CopyFrom(packet)
+        air.decoded.portnum = portnums_pb2.PortNum.SIMULATOR_APP
+        air.decoded.payload = mesh_pb2.Compressed(portnum=packet.decoded.portnum, data=packet.decoded.payload).SerializeToString()
+        self.emit(node, air)
+
+    def emit(self, node, air):
+        node.transmitted += 1
+        node.airtimeTx += self.airtime(air)
+        self.emitted[(getattr(air, "from"), air.id, air.hop_limit)] = time.monotonic()
+        if len(self.emitted) > PACKET_HISTORY:
+            self.emitted.popitem(last=False)
+        self.send(node, mesh_pb2.FromRadio(packet=air))
+
+    def receive(self, node, air):
+        """ Receives a SIMULATOR_APP packet over the air. """
+        node.airtimeRx += self.airtime(air)
+        sentAt = self.emitted.get((getattr(air, "from"), air.id, air.hop_limit))
+        if sentAt is not None:
+            latency = time.monotonic() - sentAt
+            self.latencies.append(latency)
+            self.latencySum += latency
+            self.latencyCount += 1
+        key = (getattr(air, "from"), air.id)
+        if key in node.seen:
+            node.received["duplicate"] += 1
+            return
+        node.seen[key] = True
+        if len(node.seen) > PACKET_HISTORY:
+            node.seen.popitem(last=False)
+        if getattr(air, "from") == node.hwId:  # a rebroadcast of its own packet
+            return
+        compressed = mesh_pb2.Compressed.FromString(air.decoded.payload)
+        packet = mesh_pb2.MeshPacket()
+        packet.CopyFrom(air)
+        packet.decoded.portnum = compressed.portnum
+        packet.decoded.payload = compressed.data
+        packet.rx_time = int(time.time())
+        if packet.to in (node.hwId, BROADCAST_NUM):
+            node.delivered += 1
+            self.send(node, mesh_pb2.FromRadio(packet=packet))
+        if packet.to == node.hwId:
+            self.respond(node, packet)
+        elif air.hop_limit > 0 and node.role != config_pb2.Config.DeviceConfig.Role.CLIENT_MUTE:
+            rebroadcast = mesh_pb2.MeshPacket()
+            rebroadcast.CopyFrom(air)
+            rebroadcast.hop_limit -= 1
+            rebroadcast.ClearField("rx_rssi")
+            rebroadcast.ClearField("rx_snr")
+            self.schedule(self.rng.uniform(0, REBROADCAST_WINDOW), self.rebroadcast, node, rebroadcast)
+
+    def rebroadcast(self, node, air):
+        if node.server is not None:
+            node.rebroadcasts += 1
+            self.emit(node, air)
+
+    def respond(self, node, packet):
+        """ Answers a packet addressed to the node: with a reply if it requests one, or else with an ACK if it wants one. """
+        reply = mesh_pb2.MeshPacket(to=getattr(packet, "from"), id=next(self.packetIds), channel=packet.channel,
+                                    hop_limit=node.hopLimit, hop_start=node.hopLimit)
+        setattr(reply, "from", node.hwId)
+        reply.decoded.request_id = packet.id
+        if packet.decoded.want_response and packet.decoded.portnum == portnums_pb2.PortNum.REPLY_APP:
+            reply.decoded.portnum = portnums_pb2.PortNum.REPLY_APP
+            reply.decoded.payload = packet.decoded.payload
+        elif packet.want_ack:
+            reply.priority = mesh_pb2.MeshPacket.Priority.ACK
+            reply.decoded.portnum = portnums_pb2.PortNum.ROUTING_APP
+            reply.decoded.payload = mesh_pb2.Routing(error_reason=mesh_pb2.Routing.Error.NONE).SerializeToString()
+        else:
+            return
+        self.transmit(node, reply)
+
+    def generateMessage(self, node):
+        if node.exited:
+            return
+        if node.server is not None:
+            packet = mesh_pb2.MeshPacket(to=BROADCAST_NUM, id=next(self.packetIds), hop_limit=node.hopLimit, hop_start=node.hopLimit)
+            setattr(packet, "from", node.hwId)
+            packet.decoded.portnum = portnums_pb2.PortNum.TEXT_MESSAGE_APP
+            packet.decoded.payload = "".join(self.rng.choices(string.ascii_letters, k=self.conf.PACKETLENGTH)).encode()
+            node.generated += 1
+            self.transmit(node, packet)
+        self.schedule(self.rng.expovariate(1 / self.period), self.generateMessage, node)
+
+    def sendDeviceMetrics(self, node):
+        if node.exited:
+            return
+        if node.clients:
+            deviceMetrics = telemetry_pb2.DeviceMetrics(channel_utilization=min(100 * (node.airtimeTx + node.airtimeRx) / TELEMETRY_INTERVAL, 100),
+                                                        air_util_tx=min(100 * node.airtimeTx / TELEMETRY_INTERVAL, 100))
+            telemetry = telemetry_pb2.Telemetry(time=int(time.time()), device_metrics=deviceMetrics)
+            self.sendLocal(node, None, portnums_pb2.PortNum.TELEMETRY_APP, telemetry.SerializeToString())
+        node.airtimeTx = 0.0
+        node.airtimeRx = 0.0
+        self.schedule(TELEMETRY_INTERVAL, self.sendDeviceMetrics, node)
+
+    def report(self):
+        duration = max(time.monotonic() - self.startTime, 1e-9)
+        received = sum((n.received for n in self.nodes), Counter())
+        print("Mock nodes ran for {:.1f} s.".format(duration))
+        print("Packets received from clients: {} to transmit, {} local.".format(received["client"], received["local"]))
+        print("Packets received over the air: {} ({:.1f}/s), of which {} duplicates, in {} bytes in total.".format(received["air"],
+              received["air"] / duration, received["duplicate"], sum(n.bytesReceived for n in self.nodes)))
+        print("Packets transmitted: {} ({:.1f}/s), of which {} generated and {} rebroadcasts. Packets delivered to clients: {}.".format(
+              sum(n.transmitted for n in self.nodes), sum(n.transmitted for n in self.nodes) / duration,
+              sum(n.generated for n in self.nodes), sum(n.rebroadcasts for n in self.nodes), sum(n.delivered for n in self.nodes)))
+        if self.latencyCount > 0:
+            latencies = np.array(self.latencies) * 1000
+            print("Forwarding latency (ms): mean {:.2f}, median {:.2f}, 99th percentile {:.2f}, maximum {:.2f} (percentiles of the last {}).".format(
+                  self.latencySum / self.latencyCount * 1000, np.median(latencies), np.percentile(latencies, 99), np.max(latencies), len(latencies)))
+
+
+def runMock(conf, nodes, period=0, seed=None):
+    """
+    Serves mock nodes, given as (node ID, hardware ID, TCP port, hop limit) tuples, until all of them are told to exit.
+    This is the target of the process that interactiveSim.py starts with --mock. When it is terminated, it still reports.
+    """
+    mesh = MockMesh(conf, nodes, period, seed)
+    signal.signal(signal.SIGTERM, lambda signum, frame: mesh.stop())
+    mesh.run()
@@ -5,13 +5,16 @@ from lib.common import *
 from lib.discrete_event import *
 from lib.mac import *
 from lib.packet import *
+from lib.trace import GEN, TX, RX, COLLISION, DROP
 
 
 class MeshNode():
-    def __init__(self, conf, nodes, env, bc_pipe, nodeid, period, messages, packetsAtN, packets, delays, nodeConfig, messageSeq, verboseprint):
+    def __init__(self, conf, state, env, bc_pipe, nodeid, period, nodeConfig, verboseprint):
         self.conf = conf
+        self.state = state
         self.nodeid = nodeid
         self.verboseprint = verboseprint
+        self.trace = state.trace
         self.moveRng = random.Random(nodeid)
         self.nodeRng = random.Random(nodeid)
         self.rebroadcastRng = random.Random()
@@ -25,24 +28,25 @@ class MeshNode():
             self.hopLimit = nodeConfig['hopLimit']
             self.antennaGain = nodeConfig['antennaGain']
         else: 
-            self.x, self.y = findRandomPosition(self.conf, nodes)
+            self.x, self.y = findRandomPosition(self.conf, state.nodes)
             self.z = self.conf.HM
             self.isRouter = self.conf.router
             self.isRepeater = False
             self.isClientMute = False
             self.hopLimit = self.conf.hopLimit
             self.antennaGain = self.conf.GL
-        self.messageSeq = messageSeq
+        self.messageSeq = state.messageSeq
+        self.packetsSent = state.packetsSent
         self.env = env
         self.period = period
         self.bc_pipe = bc_pipe
         self.rx_snr = 0
-        self.nodes = nodes
-        self.messages = messages
-        self.packetsAtN = packetsAtN
+        self.nodes = state.nodes
+        self.messages = state.messages
+        self.packetsAtN = state.packetsAtN
         self.nrPacketsSent = 0
-        self.packets = packets
-        self.delays = delays
+        self.packets = state.packets
+        self.delays = state.delays
         self.leastReceivedHopLimit = {}
         self.isReceiving = []
         self.isTransmitting = False
@@ -162,8 +166,10 @@ class MeshNode():
         self.messageSeq["val"] += 1
         messageSeq = self.messageSeq["val"]
         self.messages.append(MeshMessage(self.nodeid, destId, self.env.now, messageSeq))
-        p = MeshPacket(self.conf, self.nodes, self.nodeid, destId, self.nodeid, self.conf.PACKETLENGTH, messageSeq, self.env.now, True, False, None, self.env.now, self.verboseprint)
+        p = MeshPacket(self.conf, self.state, self.nodeid, destId, self.nodeid, self.conf.PACKETLENGTH, messageSeq, self.env.now, True, False, None, self.env.now, self.verboseprint)
         self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'generated', type, 'message', p.seq, 'to', destId)
+        if self.trace is not None:
+            self.trace.record(self.env.now, GEN, self.nodeid, p)
         self.packets.append(p)
         self.env.process(self.transmit(p))
         return p
@@ -207,7 +213,7 @@ class MeshNode():
                         break
                     else: 
                         if minRetransmissions > 0:  # generate new packet with same sequence number
-                            pNew = MeshPacket(self.conf, self.nodes, self.nodeid, p.destId, self.nodeid, p.packetLen, p.seq, p.genTime, p.wantAck, False, None, self.env.now, self.verboseprint)
+                            pNew = MeshPacket(self.conf, self.state, self.nodeid, p.destId, self.nodeid, p.packetLen, p.seq, p.genTime, p.wantAck, False, None, self.env.now, self.verboseprint)
                             pNew.retransmissions = minRetransmissions-1
                             self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'wants to retransmit its generated packet to', destId, 'with seq.nr.', p.seq, 'minRetransmissions', minRetransmissions)
                             self.packets.append(pNew)
@@ -241,6 +247,9 @@ class MeshNode():
             if self.leastReceivedHopLimit[packet.seq] > packet.hopLimit:  # no ACK received yet, so may start transmitting 
                 self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'started low level send', packet.seq, 'hopLimit', packet.hopLimit, 'original Tx', packet.origTxNodeId)
                 self.nrPacketsSent += 1
+                self.packetsSent["val"] += 1
+                if self.trace is not None:
+                    self.trace.record(self.env.now, TX, self.nodeid, packet)
                 for rx_node in self.nodes:
                     if packet.sensedByN[rx_node.nodeid] == True:
                         if (checkcollision(self.conf, self.env, packet, rx_node.nodeid, self.packetsAtN) == 0):
@@ -255,6 +264,8 @@ class MeshNode():
                 self.isTransmitting = False
             else:  # received ACK: abort transmit, remove from packets generated 
                 self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'in the meantime received ACK, abort packet with seq. nr', packet.seq)
+                if self.trace is not None:
+                    self.trace.record(self.env.now, DROP, self.nodeid, packet, "ACKED")
                 self.packets.remove(packet)
 
 
@@ -268,6 +279,8 @@ class MeshNode():
                     self.isReceiving.append(True)
                 else:  # if you were currently transmitting, you could not have sensed it
                     self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'was transmitting, so could not receive packet', p.seq)
+                    if self.trace is not None:
+                        self.trace.record(self.env.now, DROP, self.nodeid, p, "TX_BUSY")
                     p.sensedByN[self.nodeid] = False
                     p.onAirToN[self.nodeid] = False
             elif p.sensedByN[self.nodeid]:  # end of reception
@@ -278,10 +291,14 @@ class MeshNode():
                 self.airUtilization += p.timeOnAir
                 if p.collidedAtN[self.nodeid]:
                     self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'could not decode packet.')
+                    if self.trace is not None:
+                        self.trace.record(self.env.now, COLLISION, self.nodeid, p)
                     continue
                 p.receivedAtN[self.nodeid] = True
                 self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'received packet', p.seq, 'with delay', round(self.env.now-p.genTime, 2))
                 self.delays.append(self.env.now-p.genTime)
+                if self.trace is not None:
+                    self.trace.record(self.env.now, RX, self.nodeid, p)
 
                 # update hopLimit for this message
                 if p.seq not in self.leastReceivedHopLimit:  # did not yet receive packet with this seq nr.
@@ -320,7 +337,7 @@ class MeshNode():
                     self.messageSeq["val"] += 1
                     messageSeq = self.messageSeq["val"]
                     self.messages.append(MeshMessage(self.nodeid, p.origTxNodeId, self.env.now, messageSeq))
-                    pAck = MeshPacket(self.conf, self.nodes, self.nodeid, p.origTxNodeId, self.nodeid, self.conf.ACKLENGTH, messageSeq, self.env.now, False, True, p.seq, self.env.now, self.verboseprint) 
+                    pAck = MeshPacket(self.conf, self.state, self.nodeid, p.origTxNodeId, self.nodeid, self.conf.ACKLENGTH, messageSeq, self.env.now, False, True, p.seq, self.env.now, self.verboseprint) 
                     self.packets.append(pAck)
                     self.env.process(self.transmit(pAck))
                 # Rebroadcasting Logic for received message. This is a broadcast or a DM not meant for us.
@@ -329,9 +346,11 @@ class MeshNode():
                     if self.conf.SELECTED_ROUTER_TYPE == self.conf.ROUTER_TYPE.MANAGED_FLOOD:
                         if not self.isClientMute:
                             self.verboseprint('At time', round(self.env.now, 3), 'node', self.nodeid, 'rebroadcasts received packet', p.seq)
-                            pNew = MeshPacket(self.conf, self.nodes, p.origTxNodeId, p.destId, self.nodeid, p.packetLen, p.seq, p.genTime, p.wantAck, False, None, self.env.now, self.verboseprint) 
+                            pNew = MeshPacket(self.conf, self.state, p.origTxNodeId, p.destId, self.nodeid, p.packetLen, p.seq, p.genTime, p.wantAck, False, None, self.env.now, self.verboseprint) 
                             pNew.hopLimit = p.hopLimit-1
                             self.packets.append(pNew)
                             self.env.process(self.transmit(pNew))
                 else:
-                    self.droppedByDelay += 1
\ No newline at end of file
+                    self.droppedByDelay += 1
+                    if self.trace is not None:
+                        self.trace.record(self.env.now, DROP, self.nodeid, p, "NO_REBROADCAST")
\ No newline at end of file
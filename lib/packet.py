@@ -4,7 +4,7 @@ from .phy import *
 NODENUM_BROADCAST = 0xFFFFFFFF
 
 class MeshPacket(): 
-	def __init__(self, conf, nodes, origTxNodeId, destId, txNodeId, plen, seq, genTime, wantAck, isAck, requestId, now, verboseprint):
+	def __init__(self, conf, state, origTxNodeId, destId, txNodeId, plen, seq, genTime, wantAck, isAck, requestId, now, verboseprint):
 		self.conf = conf
 		self.verboseprint = verboseprint
 		self.origTxNodeId = origTxNodeId
@@ -30,18 +30,30 @@ class MeshPacket():
 		self.cr = self.conf.CRMODEM[self.conf.MODEM]
 		self.bw = self.conf.BWMODEM[self.conf.MODEM]
 		self.freq = self.conf.FREQ
-		self.tx_node = next(n for n in nodes if n.nodeid == self.txNodeId)
-		for rx_node in nodes:
+		self.tx_node = next(n for n in state.nodes if n.nodeid == self.txNodeId)
+		links = state.links
+		if self.tx_node.isMoving:
+			receivers = state.nodes
+		else:
+			# Links between static nodes do not change, so copy them from the link tables
+			self.LplAtN = links.lpl[self.txNodeId].tolist()
+			self.rssiAtN = links.rssi[self.txNodeId].tolist()
+			self.sensedByN = links.sensed[self.txNodeId].tolist()
+			self.detectedByN = links.detected[self.txNodeId].tolist()
+			receivers = links.movingNodes
+		terrainLoss = state.terrainLinks.lossFrom(self.tx_node, receivers) if state.terrainLinks is not None else None
+		for rx_node in receivers:
 			if rx_node.nodeid == self.txNodeId:
 				continue
 			dist_3d = calcDist(self.tx_node.x, rx_node.x, self.tx_node.y, rx_node.y, self.tx_node.z, rx_node.z) 
-			offset = self.conf.LINK_OFFSET[(self.txNodeId, rx_node.nodeid)]
-			self.LplAtN[rx_node.nodeid] = estimatePathLoss(self.conf, dist_3d, self.freq, self.tx_node.z, rx_node.z) + offset
+			offset = float(links.offset[self.txNodeId, rx_node.nodeid])
+			pathLoss = estimatePathLoss(self.conf, dist_3d, self.freq, self.tx_node.z, rx_node.z)
+			if terrainLoss is not None:
+				pathLoss += float(terrainLoss[rx_node.nodeid])
+			self.LplAtN[rx_node.nodeid] = pathLoss + offset
 			self.rssiAtN[rx_node.nodeid] = self.txpow + self.tx_node.antennaGain + rx_node.antennaGain - self.LplAtN[rx_node.nodeid]
-			if self.rssiAtN[rx_node.nodeid] >= self.conf.SENSMODEM[self.conf.MODEM]:
-				self.sensedByN[rx_node.nodeid] = True
-			if self.rssiAtN[rx_node.nodeid] >= self.conf.CADMODEM[self.conf.MODEM]:
-				self.detectedByN[rx_node.nodeid] = True
+			self.sensedByN[rx_node.nodeid] = bool(self.rssiAtN[rx_node.nodeid] >= self.conf.SENSMODEM[self.conf.MODEM])
+			self.detectedByN[rx_node.nodeid] = bool(self.rssiAtN[rx_node.nodeid] >= self.conf.CADMODEM[self.conf.MODEM])
 				
 		self.packetLen = plen
 		self.timeOnAir = airtime(self.conf, self.sf, self.cr, self.packetLen, self.bw)
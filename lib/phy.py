@@ -1,15 +1,21 @@
 import math
 import random
+from functools import lru_cache
 
+import numpy as np
 from scipy.optimize import fsolve
 
-from lib.config import Config
+VERBOSE = False
 
-conf = Config()
 
-VERBOSE = False
-#                           CAD duration   +     airPropagationTime+TxRxTurnaround+MACprocessing
-slotTime = 8.5 * (2.0**conf.SFMODEM[conf.MODEM])/conf.BWMODEM[conf.MODEM]*1000 + 0.2 + 0.4 + 7
+def getSlotTime(conf):
+	return _slotTime(conf.SFMODEM[conf.MODEM], conf.BWMODEM[conf.MODEM])
+
+
+@lru_cache(maxsize=None)
+def _slotTime(sf, bw):
+	#      CAD duration   +     airPropagationTime+TxRxTurnaround+MACprocessing
+	return 8.5 * (2.0**sf)/bw*1000 + 0.2 + 0.4 + 7
 
 
 def checkcollision(conf, env, packet, rx_nodeId, packetsAtN):
@@ -81,6 +87,7 @@ def timingCollision(conf, env, p1, p2):
 def isChannelActive(node, env):
     if random.randrange(10) <= node.conf.INTERFERENCE_LEVEL*10:
         return True
+    slotTime = getSlotTime(node.conf)
     for p in node.packets:
         if p.detectedByN[node.nodeid]: 
             # You will miss detecting a packet if it has just started before you could do CAD
@@ -107,10 +114,14 @@ def airtime(conf, sf, cr, pl, bw):
     return (Tpream + Tpayload)*1000
 
 
-def estimatePathLoss(conf, dist, freq, txZ=conf.HM, rxZ=conf.HM):
+def estimatePathLoss(conf, dist, freq, txZ=None, rxZ=None):
 	# With randomized movements we may end up on top of another node
 	# which is problematic for log(dist)
     dist = max(dist, .001)
+    if txZ is None:
+        txZ = conf.HM
+    if rxZ is None:
+        rxZ = conf.HM
 	
     # Log-Distance model
     if conf.MODEL == 0: 
@@ -167,11 +178,83 @@ def estimatePathLoss(conf, dist, freq, txZ=conf.HM, rxZ=conf.HM):
         
     return Lpl
 
-def zeroLinkBudget(dist):
+def mathEach(func, values):
+    """
+    Applies a function of the math module to each element of an array. NumPy's own (SIMD) log and
+    power can differ from the C library in the last bit, while array results must equal the scalar ones.
+    """
+    if np.ndim(values) == 0:
+        return func(values)
+    values = np.asarray(values, dtype=np.float64)
+    return np.fromiter(map(func, values.ravel().tolist()), np.float64, values.size).reshape(values.shape)
+
+
+def square(value):
+    return value**2
+
+
+def estimatePathLossArray(conf, dist, freq, txZ=None, rxZ=None):
+    """
+    estimatePathLoss for arrays of distances and heights, which are broadcast against each other.
+    The results are identical to estimatePathLoss: terms that only depend on the frequency are computed
+    once, and the height terms once per height, in the same order of operations.
+    """
+    dist = np.maximum(np.asarray(dist, dtype=np.float64), .001)
+    txZ = conf.HM if txZ is None else np.asarray(txZ, dtype=np.float64)
+    rxZ = conf.HM if rxZ is None else np.asarray(rxZ, dtype=np.float64)
+
+    # Log-Distance model
+    if conf.MODEL == 0:
+        Lpl = conf.LPLD0 + 10*conf.GAMMA*mathEach(math.log10, dist/conf.D0)
+
+    # Okumura-Hata model
+    elif conf.MODEL >= 1 and conf.MODEL <= 4:
+        logFreq = math.log10(freq)-math.log10(1000000)
+        if conf.MODEL == 1 or conf.MODEL == 3 or conf.MODEL == 4:
+            ahm = (1.1*logFreq-0.7)*txZ - (1.56*logFreq-0.8)
+        # metropolitan areas
+        elif conf.MODEL == 2:
+            if (freq <= 200000000):
+                ahm = 8.29*mathEach(square, mathEach(math.log10, 1.54*txZ)) - 1.1
+            elif (freq >= 400000000):
+                ahm = 3.2*mathEach(square, mathEach(math.log10, 11.75*txZ)) - 4.97
+        if conf.MODEL == 1 or conf.MODEL == 2:
+            C = 0
+        # suburban enviroments
+        elif conf.MODEL == 3:
+            C = -2*((math.log10(freq)-math.log10(28000000))**2) - 5.4
+        # rural area
+        elif conf.MODEL == 4:
+            C = -4.78*(logFreq**2) + 18.33*logFreq - 40.98
+
+        A = 69.55 + 26.16*logFreq - 13.82*mathEach(math.log, rxZ) - ahm
+        B = 44.9-6.55*mathEach(math.log10, rxZ)
+        Lpl = A + B*(mathEach(math.log10, dist)-math.log10(1000)) + C
+
+    # 3GPP model
+    elif conf.MODEL >= 5 and conf.MODEL < 7:
+        # Suburban Macro
+        if conf.MODEL == 5:
+            C = 0  # dB
+        # Urban Macro
+        elif conf.MODEL == 6:
+            C = 3 #dB
+
+        Lpl = (44.9-6.55*mathEach(math.log10, rxZ))*(mathEach(math.log10, dist) - math.log10(1000)) \
+        + 45.5 + (35.46-1.1*txZ)*(math.log10(freq)-math.log10(1000000)) \
+        - 13.82*mathEach(math.log10, txZ)+0.7*txZ+C
+
+    return Lpl
+
+
+def zeroLinkBudget(conf, dist):
     return conf.PTX + 2*conf.GL - estimatePathLoss(conf, dist, conf.FREQ) - conf.SENSMODEM[conf.MODEM]
 
 
-MAXRANGE = fsolve(zeroLinkBudget, 1500)
+@lru_cache(maxsize=16)  # a few specs, since every seed of a batch is a different RunSpec
+def maxRange(conf):
+    """ Distance at which the link budget between two default nodes becomes zero. """
+    return fsolve(lambda dist: zeroLinkBudget(conf, dist), 1500)
 
 if VERBOSE:
 	def verboseprint(*args, **kwargs): 
@@ -0,0 +1,171 @@
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lib.common import findRandomPositions
+from lib.config import Config
+from lib.simulation import Simulation
+from lib.topology import topologyFromPositions
+from lib.stats import confidenceInterval
+
+
+def probeConfig(param, value, seed, overrides):
+    conf = Config()
+    for name, val in overrides.items():
+        setattr(conf, name, val)
+    setattr(conf, param, value)
+    conf.SEED = seed
+    conf.updateRouterDependencies()
+    return conf.freeze()
+
+
+def probeKey(param, value, seed, overrides):
+    """ Stable key of a probe, based on all values of the resulting configuration. """
+    return probeConfig(param, value, seed, overrides).hash
+
+
+def runProbe(args):
+    """ Runs one probe in a worker process: places the nodes and simulates with the given seed. """
+    param, value, seed, overrides = args
+    conf = probeConfig(param, value, seed, overrides)
+    random.seed(seed)
+    coords = findRandomPositions(conf, conf.NR_NODES)
+    return Simulation(conf, topologyFromPositions(conf, coords)).run().metrics()
+
+
+class ProbeCache():
+    """ Metrics of earlier probes, persisted as JSON lines so later searches can reuse them. """
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    entry = json.loads(line)
+                    self.results[entry["key"]] = entry["metrics"]
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def __getitem__(self, key):
+        return self.results[key]
+
+    def add(self, key, metrics):
+        self.results[key] = metrics
+        if self.path is not None:
+            if os.path.dirname(self.path) and not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps({"key": key, "metrics": metrics}) + "\n")
+
+
+class CapacitySearch():
+    """
+    Finds the value of a Config parameter (e.g. NR_NODES or PERIOD) at which a metric
+    (e.g. Reachability) crosses a threshold, assuming the metric is monotonic in the parameter.
+    Every round evaluates a few interior points of the current bracket in parallel and keeps the
+    segment in which the metric crosses the threshold. Each point is simulated with the seeds
+    0, 1, 2, ... until its confidence interval lies on one side of the threshold, or maxReps is reached.
+    Note that parameters from which other Config values are derived (e.g. MODEM) cannot be searched.
+    """
+    def __init__(self, param, low, high, metric, threshold, overrides=None, integer=False, tolerance=None,
+                 pointsPerRound=3, minReps=3, maxReps=10, confidence=0.95, workers=None, cachePath=None):
+        self.param = param
+        self.low = low
+        self.high = high
+        self.metric = metric
+        self.threshold = threshold
+        self.overrides = overrides if overrides is not None else {}
+        self.integer = integer
+        self.tolerance = tolerance if tolerance is not None else (1 if integer else (high - low) / 100)
+        self.pointsPerRound = pointsPerRound
+        self.minReps = minReps
+        self.maxReps = max(minReps, maxReps)
+        self.confidence = confidence
+        self.workers = workers
+        self.cache = ProbeCache(cachePath)
+        self.samples = {}  # value -> list of metric values
+        self.nrSimulated = 0
+        self.nrCached = 0
+
+    def side(self, value):
+        """ Returns 1 if the metric at value is above the threshold, -1 if below and 0 if still undecided. """
+        mean, width = confidenceInterval(self.samples[value], self.confidence)
+        if np.isnan(mean):
+            return 0
+        if mean - width / 2 > self.threshold:
+            return 1
+        if mean + width / 2 < self.threshold:
+            return -1
+        if len(self.samples[value]) >= self.maxReps:
+            # Could not be decided with enough confidence, so go with the mean
+            return 1 if mean >= self.threshold else -1
+        return 0
+
+    def evaluate(self, values, executor):
+        """ Simulates the given values until each of them lies on a known side of the threshold. """
+        pending = [v for v in values if v not in self.samples]
+        for v in pending:
+            self.samples[v] = []
+        nrReps = self.minReps
+        while pending:
+            tasks = [(self.param, v, seed, self.overrides) for v in pending for seed in range(len(self.samples[v]), nrReps)]
+            keys = [probeKey(*task) for task in tasks]
+            todo = [(task, key) for task, key in zip(tasks, keys) if key not in self.cache]
+            for (task, key), metrics in zip(todo, executor.map(runProbe, [task for task, _ in todo])):
+                self.cache.add(key, metrics)
+            self.nrSimulated += len(todo)
+            self.nrCached += len(tasks) - len(todo)
+            for (_, v, _, _), key in zip(tasks, keys):
+                self.samples[v].append(self.cache[key][self.metric])
+            pending = [v for v in pending if self.side(v) == 0 and len(self.samples[v]) < self.maxReps]
+            nrReps = min(nrReps + self.minReps, self.maxReps)
+
+    def interiorPoints(self, low, high):
+        points = np.linspace(low, high, self.pointsPerRound + 2)[1:-1]
+        if self.integer:
+            points = np.round(points).astype(int)
+        return sorted(set(p.item() for p in points if low < p < high))
+
+    def run(self):
+        """
+        Returns a dict with the estimated crossing point 'knee', its bracket 'low' and 'high'
+        (the error bars), and the mean metric at every evaluated value. Returns None if the
+        metric does not cross the threshold between the initial bounds.
+        """
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            low, high = self.low, self.high
+            self.evaluate([low, high], executor)
+            if self.side(low) == self.side(high):
+                return None
+            while high - low > self.tolerance:
+                points = self.interiorPoints(low, high)
+                if not points:
+                    break
+                self.evaluate(points, executor)
+                bracket = [low] + points + [high]
+                for a, b in zip(bracket, bracket[1:]):
+                    if self.side(a) != self.side(b):
+                        low, high = a, b
+                        break
+
+        meanLow = np.nanmean(self.samples[low])
+        meanHigh = np.nanmean(self.samples[high])
+        if meanHigh != meanLow:
+            # Linear interpolation of the crossing within the final bracket
+            knee = low + (self.threshold - meanLow) * (high - low) / (meanHigh - meanLow)
+            knee = min(max(knee, low), high)
+        else:
+            knee = (low + high) / 2
+        return {
+            "knee": knee,
+            "low": low,
+            "high": high,
+            "means": {v: np.nanmean(s) for v, s in sorted(self.samples.items())},
+            "runs": {v: len(s) for v, s in sorted(self.samples.items())},
+            "nrSimulated": self.nrSimulated,
+            "nrCached": self.nrCached,
+        }
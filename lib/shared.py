@@ -0,0 +1,115 @@
+import atexit
+import os
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+
+from lib.config import contentHash
+from lib.links import PHY_PARAMS, linkTables, pathLossTables, topologyKey
+from lib.simulation import Simulation
+from lib.telemetry import TelemetryWriter, simulationProgress
+from lib.topology import topologyFromPositions
+
+
+SHARED_MEMORY_PREFIX = "meshsim_"
+_blockCount = 0  # shared memory blocks created by this process, to name them uniquely
+
+class SharedArrays():
+    """
+    Named NumPy arrays published in shared memory by the process that creates them.
+    handle is a small picklable description that other processes pass to attachArrays
+    to get read-only views of the same memory, without copying.
+    The creating process must call close() when the arrays are no longer needed.
+    The memory is named SHARED_MEMORY_PREFIX followed by the id of the creating process, so on Linux,
+    the blocks of a process that was killed before it could unlink them can be found and removed in /dev/shm.
+    """
+    def __init__(self, arrays):
+        global _blockCount
+        self.blocks = []
+        self.handle = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            _blockCount += 1
+            block = shared_memory.SharedMemory(name="{}{}_{}".format(SHARED_MEMORY_PREFIX, os.getpid(), _blockCount),
+                                               create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.handle[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+_attachedBlocks = {}  # shared memory name -> SharedMemory, kept open while this process runs
+
+def attachArrays(handle):
+    """ Returns read-only views of the arrays of a SharedArrays handle. """
+    arrays = {}
+    for name, (blockName, shape, dtype) in handle.items():
+        if blockName not in _attachedBlocks:
+            # Worker processes share the resource tracker of the publishing process,
+            # so attaching does not make this process responsible for unlinking the memory
+            _attachedBlocks[blockName] = shared_memory.SharedMemory(name=blockName)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=_attachedBlocks[blockName].buf)
+        array.setflags(write=False)
+        arrays[name] = array
+    return arrays
+
+
+class SharedTopologies():
+    """
+    Publishes the positions of each topology, with its distance and path loss tables, once in
+    shared memory, so parallel workers simulating it attach to a single copy. Runs with other
+    router types or seeds on the same topology and PHY parameters reuse the published tables.
+    Without the asymmetric link model, the link tables do not depend on the seed, so they are published
+    as well and workers allocate no tables of their own. With it, each worker computes them for its run.
+    The tables are also unlinked when this process exits without calling close(), e.g. when a batch
+    is interrupted.
+    """
+    def __init__(self):
+        self.published = {}  # (topology key, PHY key, asymmetric links) -> SharedArrays
+        atexit.register(self.close)
+
+    def handle(self, conf, positions):
+        """ Returns the handle of the shared positions and tables of the given positions for conf. """
+        topology = topologyFromPositions(conf, positions)
+        nodes = [SimpleNamespace(nodeid=nodeId, **nodeConfig) for nodeId, nodeConfig in enumerate(topology)]
+        key = (topologyKey(nodes), contentHash(conf, PHY_PARAMS), bool(conf.MODEL_ASYMMETRIC_LINKS))
+        if key not in self.published:
+            arrays = pathLossTables(conf, nodes)
+            if not conf.MODEL_ASYMMETRIC_LINKS:
+                arrays.update(linkTables(conf, nodes, arrays["pathLoss"]))
+            arrays["positions"] = np.asarray(positions, dtype=np.float64)
+            self.published[key] = SharedArrays(arrays)
+        return self.published[key].handle
+
+    def close(self):
+        for arrays in self.published.values():
+            arrays.close()
+        self.published = {}
+
+
+_telemetryWriters = {}  # telemetry target -> TelemetryWriter, kept open while this process runs
+
+def runShared(task):
+    """
+    Runs one simulation in a worker process on a topology published by SharedTopologies.
+    task is a (RunSpec, handle, telemetry target, cell, number of runs) tuple, where the target may be None.
+    With a target, the worker writes progress records for the cell to it. Returns the detached SimulationResults.
+    """
+    conf, handle, telemetryTarget, cell, nrRuns = task
+    arrays = attachArrays(handle)
+    simulation = Simulation(conf, topologyFromPositions(conf, arrays["positions"]), sharedTables=arrays)
+    if telemetryTarget is not None:
+        if telemetryTarget not in _telemetryWriters:
+            _telemetryWriters[telemetryTarget] = TelemetryWriter(telemetryTarget)
+        simulation.setup()
+        state = simulation.state
+        simulation.env.process(simulationProgress(simulation.env, cell["rep"], nrRuns, conf.SIMTIME, 10 * conf.ONE_SECOND_INTERVAL,
+                                                  _telemetryWriters[telemetryTarget], cell, state.packetsSent, state.delays, state.messageSeq,
+                                                  printProgress=False))
+    return simulation.run().detach()
@@ -0,0 +1,106 @@
+import random
+
+import numpy as np
+
+from lib.common import setupAsymmetricLinks
+from lib.config import RunState
+from lib.discrete_event import BroadcastPipe, CountingEnvironment
+from lib.node import MeshNode
+from lib.topology import topologyFromPositions
+
+
+def silentprint(*args, **kwargs):
+    pass
+
+
+class SimulationResults():
+    """ Counts and metrics of a finished simulation, using the same definitions as batchSim.py. """
+    def __init__(self, conf, state, linkStats, nrEvents):
+        self.conf = conf
+        self.state = state
+        self.nodes = state.nodes
+        self.packets = state.packets
+        self.messages = state.messages
+        self.delays = state.delays
+        self.nrEvents = nrEvents
+        self.totalPairs, self.symmetricLinks, self.asymmetricLinks, self.noLinks = linkStats
+
+        nodes = state.nodes
+        self.nrMessages = state.messageSeq["val"]
+        self.nrCollisions = sum([1 for pkt in state.packets for n in nodes if pkt.collidedAtN[n.nodeid]])
+        self.nrSensed = sum([1 for pkt in state.packets for n in nodes if pkt.sensedByN[n.nodeid]])
+        self.nrReceived = sum([1 for pkt in state.packets for n in nodes if pkt.receivedAtN[n.nodeid]])
+        self.nrUseful = sum([n.usefulPackets for n in nodes])
+        self.droppedByDelay = sum([n.droppedByDelay for n in nodes])
+
+        self.collisionRate = float(self.nrCollisions) / self.nrSensed * 100 if self.nrSensed != 0 else np.NaN
+        self.reachability = self.nrUseful / (self.nrMessages * (conf.NR_NODES - 1)) * 100 if self.nrMessages != 0 else np.NaN
+        self.usefulness = self.nrUseful / self.nrReceived * 100 if self.nrReceived != 0 else np.NaN
+        self.meanDelay = np.nanmean(state.delays) if len(state.delays) > 0 else np.NaN
+        self.meanTxAirUtil = sum([n.txAirUtilization for n in nodes]) / conf.NR_NODES
+
+    def detach(self):
+        """ Drops the references to the nodes, packets and messages, e.g. to send the results to another process. """
+        self.state = None
+        self.nodes = None
+        self.packets = None
+        self.messages = None
+        self.delays = None
+        return self
+
+    def metrics(self):
+        """ The metrics as a dict of plain values, e.g. to store as JSON. """
+        return {
+            "CollisionRate": self.collisionRate,
+            "Reachability": self.reachability,
+            "Usefulness": self.usefulness,
+            "meanDelay": self.meanDelay,
+            "meanTxAirUtil": self.meanTxAirUtil,
+            "nrMessages": self.nrMessages,
+        }
+
+
+class Simulation():
+    """
+    One run of the discrete-event simulator, without plotting or printing.
+    conf is a frozen RunSpec and topology a list with a node configuration (as read from
+    a scenario file) per node, where None places that node randomly. Without a topology,
+    all nodes are placed randomly.
+    All state of the run lives in the Simulation object, so it can be created and run
+    many times in one process. The global random generator is seeded with conf.SEED in setup().
+    To add processes (e.g. progress logging or graph updates) or to plot the nodes before
+    running, call setup() first and use env and nodes.
+    With linkCache, the link tables are stored in and loaded from that directory (see LinkTables).
+    sharedTables are precomputed distance and path loss tables of the topology, see lib/shared.py.
+    """
+    def __init__(self, conf, topology=None, verboseprint=silentprint, trace=None, linkCache=None, sharedTables=None):
+        self.conf = conf
+        self.topology = topology if topology is not None else [None for _ in range(conf.NR_NODES)]
+        self.verboseprint = verboseprint
+        self.trace = trace
+        self.linkCache = linkCache
+        self.sharedTables = sharedTables
+        self.env = None
+        self.state = None
+        self.linkStats = None
+
+    @property
+    def nodes(self):
+        return self.state.nodes
+
+    def setup(self):
+        random.seed(self.conf.SEED)
+        self.env = CountingEnvironment()
+        bc_pipe = BroadcastPipe(self.env)
+        self.state = RunState(self.conf, self.trace)
+        for nodeId in range(self.conf.NR_NODES):
+            node = MeshNode(self.conf, self.state, self.env, bc_pipe, nodeId, self.conf.PERIOD, self.topology[nodeId], self.verboseprint)
+            self.state.nodes.append(node)
+        self.linkStats = setupAsymmetricLinks(self.conf, self.state, self.linkCache, self.sharedTables)
+
+    def run(self):
+        """ Runs the simulation until SIMTIME and returns its SimulationResults. """
+        if self.env is None:
+            self.setup()
+        self.env.run(until=self.conf.SIMTIME)
+        return SimulationResults(self.conf, self.state, self.linkStats, self.env.eventCount)
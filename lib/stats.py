@@ -0,0 +1,48 @@
+import numpy as np
+from scipy import stats
+
+
+def confidenceInterval(values, confidence=0.95):
+    """
+    Returns the mean and the width of the two-sided Student-t confidence interval of the values,
+    ignoring NaNs. The width is infinite if there are fewer than two valid values.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan, np.inf
+    mean = np.mean(values)
+    if len(values) < 2:
+        return mean, np.inf
+    sem = np.std(values, ddof=1) / np.sqrt(len(values))
+    return mean, 2 * stats.t.ppf((1 + confidence) / 2, len(values) - 1) * sem
+
+
+class AdaptiveRepetitions():
+    """
+    Decides how many repetitions a cell of a batch needs. Runs are added until the confidence
+    interval width of every metric in ciTargets (metric name -> maximum width) is below its target,
+    with at least minRuns and at most maxRuns runs. With no targets, it always runs minRuns times.
+    """
+    def __init__(self, ciTargets, minRuns, maxRuns, confidence=0.95):
+        self.ciTargets = ciTargets
+        self.minRuns = minRuns
+        self.maxRuns = max(minRuns, maxRuns)
+        self.confidence = confidence
+
+    def needsMore(self, results):
+        """ results maps each metric name to the list of values of the runs done so far. """
+        nrRuns = max((len(v) for v in results.values()), default=0)
+        if nrRuns < self.minRuns:
+            return True
+        if nrRuns >= self.maxRuns:
+            return False
+        for metric, target in self.ciTargets.items():
+            _, width = confidenceInterval(results[metric], self.confidence)
+            if width > target:
+                return True
+        return False
+
+    def widths(self, results):
+        """ Returns the current confidence interval width of each metric with a target. """
+        return {metric: confidenceInterval(results[metric], self.confidence)[1] for metric in self.ciTargets}
@@ -0,0 +1,152 @@
+import collections
+import json
+import os
+import socket
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def memoryUsage():
+    """ Returns the resident set size of this process in bytes (peak RSS if the current one is not available). """
+    try:
+        with open("/proc/self/statm", 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kB on Linux, but in bytes on macOS
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    return None
+
+
+class TelemetryWriter():
+    """
+    Writes telemetry records as JSON lines, either appended to a file or sent as
+    datagrams to a local UDP socket when the target is given as 'udp://host:port'.
+    Every record is written as a single line, so parallel workers can share one file.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.file = None
+        self.socket = None
+        if target.startswith("udp://"):
+            host, port = target[len("udp://"):].rsplit(":", 1)
+            self.address = (host, int(port))
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            if os.path.dirname(target) and not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+            self.file = open(target, 'a', buffering=1)
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        if self.socket is not None:
+            try:
+                self.socket.sendto(line.encode(), self.address)
+            except OSError:
+                pass  # nobody listening, telemetry is best effort
+        else:
+            self.file.write(line + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+def progressRecord(env, cell, endTime, eta, wallPerSimSec, eventsPerSec, packetsSent, delays, messageSeq):
+    """ Builds one telemetry record describing the progress of the simulation of a cell. """
+    return {
+        "wallTime": round(time.time(), 3),
+        "pid": os.getpid(),
+        "cell": cell,
+        "simTime": env.now,
+        "progress": round(min(env.now / endTime, 1.0), 4),
+        "events": getattr(env, "eventCount", None),
+        "eventsPerSec": round(eventsPerSec, 1),
+        "wallPerSimSec": round(wallPerSimSec * 1000, 6),
+        "messages": messageSeq["val"],
+        "packetsSent": packetsSent["val"],
+        "packetsReceived": len(delays),
+        "rss": memoryUsage(),
+        "eta": round(eta, 1),
+    }
+
+
+def simulationProgress(env, currentRep, repetitions, endTime, interval, telemetry=None, cell=None, packetsSent=None, delays=None, messageSeq=None, printProgress=True):
+    """
+    Keep track of the ratio of real time per sim-second over
+    a fixed sliding window, so if the simulation slows down near the end,
+    the time-left estimate adapts quickly.
+    Progress is checked every interval of simulated time and printed unless printProgress
+    is False, e.g. in parallel workers that would garble each other's lines.
+    If a telemetry writer is given, also emit a record for the given cell
+    with the throughput, packet counts and memory usage of this process.
+    """
+    startWallTime = time.time()
+    lastWallTime = startWallTime
+    lastEnvTime = env.now
+    lastEventCount = env.eventCount
+    
+    # We'll store the last N ratio measurements
+    N = 10
+    ratios = collections.deque(maxlen=N)
+    
+    while True:
+        fraction = env.now / endTime
+        fraction = min(fraction, 1.0)
+        
+        # Current real time
+        currentWallTime = time.time()
+        realTimeDelta = currentWallTime - lastWallTime
+        simTimeDelta = env.now - lastEnvTime
+        
+        # Compute new ratio if sim actually advanced
+        if simTimeDelta > 0:
+            instant_ratio = realTimeDelta / simTimeDelta
+            ratios.append(instant_ratio)
+        eventsPerSec = (env.eventCount - lastEventCount) / realTimeDelta if realTimeDelta > 0 else 0.0
+        
+        # If we have at least one ratio, compute a 'recent average'
+        if len(ratios) > 0:
+            avgRatio = sum(ratios) / len(ratios)
+        else:
+            avgRatio = 0.0
+        
+        # time_left_est = avg_ratio * (endTime - env.now)
+        simTimeRemaining = endTime - env.now
+        timeLeftEst = simTimeRemaining * avgRatio
+        
+        # Format mm:ss
+        minutes = int(timeLeftEst // 60)
+        seconds = int(timeLeftEst % 60)
+        
+        if printProgress:
+            print(
+                f"\rSimulation {currentRep+1}/{repetitions} progress: "
+                f"{fraction*100:.1f}% | ~{minutes}m{seconds}s left...",
+                end="", flush=True
+            )
+
+        if telemetry is not None:
+            telemetry.write(progressRecord(env, cell, endTime, timeLeftEst, avgRatio, eventsPerSec, packetsSent, delays, messageSeq))
+        
+        # If done or overshoot
+        if fraction >= 1.0:
+            break
+        
+        # Update references
+        lastWallTime = currentWallTime
+        lastEnvTime = env.now
+        lastEventCount = env.eventCount
+        
+        yield env.timeout(interval)
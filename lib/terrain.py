@@ -0,0 +1,146 @@
+from functools import lru_cache
+
+import numpy as np
+
+SPEED_OF_LIGHT = 299792458.0  # m/s
+# Upper bound on the number of terrain samples along one link
+MAX_PROFILE_SAMPLES = 512
+
+
+def knifeEdgeLoss(v):
+    """ Diffraction loss in dB of a single knife edge with Fresnel-Kirchhoff parameter v (ITU-R P.526). """
+    v = np.asarray(v, dtype=np.float64)
+    loss = 6.9 + 20*np.log10(np.sqrt((v-0.1)**2 + 1) + v - 0.1)
+    return np.where(v > -0.78, loss, 0.0)
+
+
+def readElevation(path):
+    """
+    Reads an elevation raster memory-mapped: a 2D .npy array, or a GeoTIFF (needs tifffile).
+    Returns the raster and the pixel size stored in the GeoTIFF, or None if it has none.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode='r'), None
+    try:
+        import tifffile
+    except ImportError:
+        print("Please install tifffile with 'pip3 install tifffile' to read GeoTIFF elevation rasters, or convert it to .npy.")
+        exit(1)
+    try:
+        elevation = tifffile.memmap(path, mode='r')
+    except ValueError:  # compressed or tiled, so it cannot be memory-mapped
+        elevation = tifffile.imread(path)
+    with tifffile.TiffFile(path) as tif:
+        pixelScale = tif.pages[0].tags.get('ModelPixelScaleTag')
+        resolution = float(pixelScale.value[0]) if pixelScale is not None else None
+    return np.squeeze(elevation), resolution
+
+
+class Terrain():
+    """
+    Ground elevation in m from a north-up raster: elevation[row, col] is the height at
+    x = originX + col*resolution, y = originY - row*resolution, so (originX, originY) is the
+    north-west corner. Outside the raster, the elevation of its nearest edge is used.
+    """
+    def __init__(self, elevation, originX, originY, resolution):
+        self.elevation = elevation
+        self.originX = originX
+        self.originY = originY
+        self.resolution = resolution
+
+    def height(self, x, y):
+        """ Ground height at the given positions (arrays of any shape), interpolated bilinearly. """
+        rows, cols = self.elevation.shape
+        col = np.clip((np.asarray(x, dtype=np.float64) - self.originX) / self.resolution, 0, cols-1)
+        row = np.clip((self.originY - np.asarray(y, dtype=np.float64)) / self.resolution, 0, rows-1)
+        col0 = np.minimum(col.astype(np.intp), max(cols-2, 0))
+        row0 = np.minimum(row.astype(np.intp), max(rows-2, 0))
+        col1 = np.minimum(col0+1, cols-1)
+        row1 = np.minimum(row0+1, rows-1)
+        dc = col - col0
+        dr = row - row0
+        top = self.elevation[row0, col0]*(1-dc) + self.elevation[row0, col1]*dc
+        bottom = self.elevation[row1, col0]*(1-dc) + self.elevation[row1, col1]*dc
+        return top*(1-dr) + bottom*dr
+
+    def diffractionLoss(self, freq, txX, txY, txZ, rxX, rxY, rxZ):
+        """
+        Knife-edge diffraction loss in dB of the links from a transmitter at (txX, txY) with its antenna
+        txZ above ground to receivers at the positions in the arrays rxX, rxY and rxZ. The terrain profile
+        of each link is sampled about once per pixel, and its highest obstacle relative to the line of sight
+        is taken as a single knife edge, which is exact for one ridge and optimistic for more.
+        """
+        rxX = np.asarray(rxX, dtype=np.float64)
+        rxY = np.asarray(rxY, dtype=np.float64)
+        rxZ = np.asarray(rxZ, dtype=np.float64)
+        dist = np.hypot(rxX - txX, rxY - txY)
+        if dist.size == 0 or not np.any(dist > 0):
+            return np.zeros(dist.shape)
+        nrSamples = int(min(MAX_PROFILE_SAMPLES, max(8, np.ceil(np.max(dist) / self.resolution))))
+        t = np.arange(1, nrSamples+1) / (nrSamples+1)  # interior points of each profile
+        ground = self.height(txX + np.multiply.outer(rxX - txX, t), txY + np.multiply.outer(rxY - txY, t))
+        txHeight = self.height(txX, txY) + txZ
+        rxHeight = self.height(rxX, rxY) + rxZ
+        lineOfSight = txHeight + np.multiply.outer(rxHeight - txHeight, t)
+        d = np.maximum(dist, 1e-3)[..., np.newaxis]
+        wavelength = SPEED_OF_LIGHT / freq
+        v = (ground - lineOfSight) * np.sqrt(2 / wavelength * d / (d*t * d*(1-t)))
+        return np.where(dist > 0, knifeEdgeLoss(np.max(v, axis=-1)), 0.0)
+
+
+def getTerrain(conf):
+    """ The Terrain configured in conf (a Config or RunSpec), or None without TERRAIN_FILE. """
+    if conf.TERRAIN_FILE is None:
+        return None
+    return _loadTerrain(conf.TERRAIN_FILE, tuple(conf.TERRAIN_ORIGIN), conf.TERRAIN_RESOLUTION)
+
+
+@lru_cache(maxsize=None)
+def _loadTerrain(path, origin, defaultResolution):
+    # Keyed on the terrain parameters only, so all runs on the same raster share one memory map
+    elevation, resolution = readElevation(path)
+    originX, originY = origin
+    return Terrain(elevation, originX, originY, resolution if resolution is not None else defaultResolution)
+
+
+def terrainLossTable(conf, terrain, nodes):
+    """ nrNodes x nrNodes matrix of the diffraction losses of all links between the nodes. """
+    positions = np.array([[n.x, n.y, n.z] for n in nodes], dtype=np.float64).reshape(-1, 3)
+    loss = np.zeros((len(nodes), len(nodes)))
+    for tx in nodes:
+        loss[tx.nodeid] = terrain.diffractionLoss(conf.FREQ, tx.x, tx.y, tx.z, positions[:, 0], positions[:, 1], positions[:, 2])
+    np.fill_diagonal(loss, 0)
+    return loss
+
+
+class TerrainLinks():
+    """
+    Diffraction losses of the links from or to moving nodes, computed when first needed. When a node
+    has moved, the losses of its links are computed again, while those of the other links are kept.
+    """
+    def __init__(self, conf, terrain, nodes, movingNodes):
+        self.conf = conf
+        self.terrain = terrain
+        self.nodes = nodes
+        self.movingNodes = movingNodes
+        self.loss = np.full((len(nodes), len(nodes)), np.nan)
+        self.positions = np.array([[n.x, n.y, n.z] for n in nodes], dtype=np.float64).reshape(-1, 3)
+
+    def invalidateMoved(self):
+        for node in self.movingNodes:
+            position = (node.x, node.y, node.z)
+            if tuple(self.positions[node.nodeid]) != position:
+                self.positions[node.nodeid] = position
+                self.loss[node.nodeid, :] = np.nan
+                self.loss[:, node.nodeid] = np.nan
+
+    def lossFrom(self, tx, receivers):
+        """ Returns the diffraction losses of the links from tx to the receivers (by node id). """
+        self.invalidateMoved()
+        rxIds = np.array([rx.nodeid for rx in receivers], dtype=np.intp)
+        missing = rxIds[np.isnan(self.loss[tx.nodeid, rxIds])]
+        if len(missing) > 0:
+            positions = self.positions[missing]
+            self.loss[tx.nodeid, missing] = self.terrain.diffractionLoss(self.conf.FREQ, tx.x, tx.y, tx.z,
+                                                                         positions[:, 0], positions[:, 1], positions[:, 2])
+        return self.loss[tx.nodeid]
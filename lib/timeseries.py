@@ -0,0 +1,123 @@
+import numpy as np
+
+SAMPLE_CAPACITY = 4096  # samples kept at full resolution per node, after which the oldest are rolled up
+ROLLUP_INTERVAL = 3600  # s covered by one rollup of older samples
+ROLLUP_CAPACITY = 24 * 30  # rollups kept per node, after which the oldest are dropped
+
+
+class RingBuffer():
+    """
+    Rows of values with increasing timestamps in preallocated arrays of a fixed capacity.
+    When it is full, appending a row overwrites the oldest one.
+    """
+    def __init__(self, capacity, width):
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, width))
+        self.start = 0  # index of the oldest row
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, time, row):
+        """ Adds a row and returns the (time, row) that it overwrote, or None if the buffer was not full. """
+        capacity = len(self.times)
+        index = (self.start + self.size) % capacity
+        overwritten = None
+        if self.size == capacity:
+            overwritten = (self.times[index], self.values[index].copy())
+            self.start = (self.start + 1) % capacity
+        else:
+            self.size += 1
+        self.times[index] = time
+        self.values[index] = row
+        return overwritten
+
+    def oldest(self):
+        return self.times[self.start] if self.size > 0 else None
+
+    def window(self, start=None, end=None):
+        """
+        Times and rows with start <= time < end, oldest first. The rows are stored in at most two
+        contiguous segments, which are bisected, so this costs O(log capacity + rows returned).
+        """
+        capacity = len(self.times)
+        slices = []
+        for offset, length in ((self.start, min(self.size, capacity - self.start)), (0, max(self.start + self.size - capacity, 0))):
+            segment = self.times[offset:offset+length]
+            first = 0 if start is None else np.searchsorted(segment, start, 'left')
+            last = length if end is None else np.searchsorted(segment, end, 'left')
+            slices.append(slice(offset+first, offset+last))
+        return np.concatenate([self.times[s] for s in slices]), np.concatenate([self.values[s] for s in slices])
+
+
+class TimeSeries():
+    """
+    Samples of some fields (e.g. the channel utilization of a node) over a session of any length, in bounded memory.
+    The last SAMPLE_CAPACITY samples are kept at full resolution. Older samples are rolled up per ROLLUP_INTERVAL
+    into their minimum, maximum and mean, of which the last ROLLUP_CAPACITY are kept.
+    """
+    def __init__(self, fields, capacity=SAMPLE_CAPACITY, rollupInterval=ROLLUP_INTERVAL, rollupCapacity=ROLLUP_CAPACITY):
+        self.fields = tuple(fields)
+        self.rollupInterval = rollupInterval
+        self.samples = RingBuffer(capacity, len(self.fields))
+        self.rollups = RingBuffer(rollupCapacity, 3*len(self.fields))  # minimum, maximum and mean of each field
+        self.lastTime = None
+        # Rollup of the samples in the current interval, which is not finished yet
+        self.bucket = None
+        self.bucketCount = 0
+        self.bucketMin = None
+        self.bucketMax = None
+        self.bucketSum = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def append(self, time, values):
+        """ Adds a sample with a value for each field. Its time must be later than that of the previous sample. """
+        self.lastTime = time
+        overwritten = self.samples.append(time, values)
+        if overwritten is not None:
+            self.rollUp(*overwritten)
+
+    def rollUp(self, time, row):
+        bucket = time // self.rollupInterval * self.rollupInterval
+        if self.bucket is not None and bucket != self.bucket:
+            self.rollups.append(self.bucket, np.concatenate((self.bucketMin, self.bucketMax, self.bucketSum / self.bucketCount)))
+            self.bucket = None
+        if self.bucket is None:
+            self.bucket = bucket
+            self.bucketCount = 1
+            self.bucketMin = row.copy()
+            self.bucketMax = row.copy()
+            self.bucketSum = row.copy()
+        else:
+            self.bucketCount += 1
+            np.minimum(self.bucketMin, row, out=self.bucketMin)
+            np.maximum(self.bucketMax, row, out=self.bucketMax)
+            self.bucketSum += row
+
+    def firstTime(self):
+        """ Time of the oldest data that is kept, rolled up or not. """
+        for time in (self.rollups.oldest(), self.bucket, self.samples.oldest()):
+            if time is not None:
+                return time
+        return None
+
+    def window(self, field, start=None, end=None):
+        """ Times and values of a field of the samples at full resolution with start <= time < end. """
+        times, values = self.samples.window(start, end)
+        return times, values[:, self.fields.index(field)]
+
+    def rollupWindow(self, field, start=None, end=None):
+        """ Start times and the minimum, maximum and mean of a field of the rollups with start <= time < end. """
+        times, values = self.rollups.window(start, end)
+        column = self.fields.index(field)
+        nrFields = len(self.fields)
+        minimum, maximum, mean = values[:, column], values[:, nrFields+column], values[:, 2*nrFields+column]
+        if self.bucket is not None and (start is None or self.bucket >= start) and (end is None or self.bucket < end):
+            times = np.append(times, self.bucket)
+            minimum = np.append(minimum, self.bucketMin[column])
+            maximum = np.append(maximum, self.bucketMax[column])
+            mean = np.append(mean, self.bucketSum[column] / self.bucketCount)
+        return times, minimum, maximum, mean
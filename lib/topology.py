@@ -0,0 +1,90 @@
+import os
+import random
+
+import numpy as np
+import yaml
+
+from lib.common import findRandomPositions
+from lib.config import PLACEMENT_PARAMS, contentHash
+
+# Topology files larger than this are memory-mapped instead of read into memory
+MMAP_THRESHOLD = 1 << 20  # bytes
+
+
+def placementKey(conf, nrNodes, seed):
+    """ Key of the topology that findRandomPositions generates for nrNodes nodes after seeding with seed. """
+    return contentHash(conf, PLACEMENT_PARAMS, nrNodes=nrNodes, seed=seed)
+
+
+def saveTopology(path, positions):
+    """
+    Saves an nrNodes x 2 (x, y) or nrNodes x 3 (x, y, z) array of positions as a .npy file.
+    The file is written under a temporary name first, so concurrent readers never see a partial file.
+    """
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmpPath, 'wb') as file:
+        np.save(file, np.asarray(positions, dtype=np.float64))
+    os.replace(tmpPath, path)
+
+
+def loadTopology(path):
+    """ Loads positions saved with saveTopology, memory-mapping large files. """
+    if os.path.getsize(path) > MMAP_THRESHOLD:
+        return np.load(path, mmap_mode='r')
+    return np.load(path)
+
+
+def topologyFromPositions(conf, positions):
+    """
+    Node configurations, as read from a scenario file, for nodes at the given (x, y) or (x, y, z)
+    positions, with the default height, role, hop limit and antenna gain.
+    """
+    topology = []
+    for position in positions:
+        topology.append({
+            'x': float(position[0]),
+            'y': float(position[1]),
+            'z': float(position[2]) if len(position) > 2 else conf.HM,
+            'isRouter': False,
+            'isRepeater': False,
+            'isClientMute': False,
+            'hopLimit': conf.hopLimit,
+            'antennaGain': conf.GL,
+            'neighborInfo': False
+        })
+    return topology
+
+
+def loadNodeConfig(conf, path):
+    """ Reads the node configurations of a scenario from a YAML file, or from a .npy topology file. """
+    if path.endswith(".npy"):
+        return topologyFromPositions(conf, loadTopology(path))
+    with open(path, 'r') as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+class TopologyCache():
+    """
+    Random topologies stored as .npy files in a directory, keyed by placementKey. The first
+    request of a topology generates it with findRandomPositions, later ones (also in other
+    campaigns) load it from disk. With directory None, nothing is stored.
+    """
+    def __init__(self, directory=os.path.join("out", "topologies")):
+        self.directory = directory
+
+    def path(self, conf, nrNodes, seed):
+        return os.path.join(self.directory, placementKey(conf, nrNodes, seed)+".npy")
+
+    def get(self, conf, nrNodes, seed):
+        """ Returns the nrNodes x 2 array of positions for the given seed. """
+        if self.directory is not None:
+            path = self.path(conf, nrNodes, seed)
+            if os.path.isfile(path):
+                return loadTopology(path)
+        random.seed(seed)
+        positions = np.array(findRandomPositions(conf, nrNodes), dtype=np.float64)
+        if self.directory is not None:
+            saveTopology(path, positions)
+        return positions
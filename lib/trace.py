@@ -0,0 +1,78 @@
+import hashlib
+
+# Event kinds that make up the canonical trace of a discrete-event run
+GEN = "GEN"  # message generated by its original transmitter
+TX = "TX"  # start of a low level transmission
+RX = "RX"  # successful reception at a node
+COLLISION = "COL"  # reception ended, but the packet collided at this node
+DROP = "DROP"  # packet dropped, see the reason field
+
+TIME_DECIMALS = 6  # timestamps are rounded to ns, which keeps traces portable across platforms
+
+
+class EventTrace():
+    """
+    Records a canonical, ordered trace of the events of one seeded discrete-event run.
+    Every event is formatted as one line and fed into a rolling SHA-256 hash, so two runs
+    can be compared either line by line (when the trace is written to a file) or by digest only.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.file = open(path, 'w') if path is not None else None
+        self.hash = hashlib.sha256()
+        self.count = 0
+
+    def record(self, now, kind, nodeId, packet, reason=""):
+        line = "{} {:.{}f} {} {} {} {} {} {} {} {}".format(self.count, now, TIME_DECIMALS, kind, nodeId, packet.seq, packet.txNodeId,
+            packet.origTxNodeId, packet.hopLimit, int(packet.isAck), reason).rstrip()
+        self.hash.update(line.encode())
+        self.count += 1
+        if self.file is not None:
+            self.file.write(line + "\n")
+
+    def digest(self):
+        return self.hash.hexdigest()
+
+    def close(self):
+        if self.file is not None:
+            self.file.write("# digest {} events {}\n".format(self.digest(), self.count))
+            self.file.close()
+            self.file = None
+        return self.digest()
+
+
+def readTrace(path):
+    """ Returns the list of event lines and the digest stored in a trace file. """
+    events = []
+    digest = None
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if line.startswith("# digest"):
+                digest = line.split()[2]
+            elif line:
+                events.append(line)
+    return events, digest
+
+
+def compareTraces(pathA, pathB):
+    """
+    Compares two trace files. Returns None if they are identical, otherwise a tuple
+    (index, eventA, eventB) describing the first divergent event. A missing event
+    (one trace is shorter than the other) is reported as None. If one of the traces
+    only holds a digest, the index is None and the digests are returned instead.
+    """
+    eventsA, digestA = readTrace(pathA)
+    eventsB, digestB = readTrace(pathB)
+    if digestA is not None and digestA == digestB:
+        return None
+    if not eventsA or not eventsB:
+        # At least one of the traces only stores its digest, so we cannot point at the event
+        return None if digestA == digestB else (None, digestA, digestB)
+    for i, (a, b) in enumerate(zip(eventsA, eventsB)):
+        if a != b:
+            return i, a, b
+    if len(eventsA) != len(eventsB):
+        i = min(len(eventsA), len(eventsB))
+        return i, eventsA[i] if i < len(eventsA) else None, eventsB[i] if i < len(eventsB) else None
+    return None
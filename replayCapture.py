@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+""" Replays a capture of the interactive simulator (interactiveSim.py --capture) without running any firmware.
+    By default, the scenario is plotted and the route of each message can be shown like after a session.
+    With --stats, the capture is only read to print statistics like those of the discrete-event simulator.
+    The capture is streamed, so only the routes of the last messages (or with --first, of the messages from that ID onwards) are kept.
+
+    Usage: python3 replayCapture.py [capture] [--stats] [--first MESSAGE_ID]
+"""
+import argparse
+import os
+
+from lib.capture import CaptureStatistics, applyConfigJson, packetDict, readCapture
+from lib.config import Config
+
+
+class replayNode():
+    """ A node of a capture, with the attributes of an interactiveNode that plotting uses. """
+    def __init__(self, record):
+        self.nodeid = record.node_id
+        self.hwId = record.hw_id
+        self.x = record.x
+        self.y = record.y
+        self.z = record.z
+        self.isRouter = record.is_router
+        self.isRepeater = record.is_repeater
+        self.isClientMute = record.is_client_mute
+        self.hopLimit = record.hop_limit
+        self.antennaGain = record.antenna_gain
+        self.neighborInfo = record.neighbor_info
+
+
+def readNodes(path):
+    """ The configuration and nodes at the start of a capture. """
+    conf = Config()
+    nodes = []
+    for record in readCapture(path):
+        kind = record.WhichOneof("record")
+        if kind == "config":
+            applyConfigJson(conf, record.config)
+        elif kind == "node":
+            nodes.append(replayNode(record.node))
+        else:
+            break
+    conf.NR_NODES = len(nodes)
+    return conf.freeze(), nodes
+
+
+def readStatistics(path):
+    """ The CaptureStatistics of a capture. """
+    statistics = CaptureStatistics()
+    for record in readCapture(path):
+        kind = record.WhichOneof("record")
+        if kind == "node":
+            statistics.addNode(record.node)
+        elif kind == "transmission":
+            statistics.addTransmission(record.time, record.transmission)
+    return statistics
+
+
+def stats(path):
+    readStatistics(path).report()
+
+
+def replay(path, first):
+    from lib.interactive import interactiveGraph, interactivePacket
+
+    conf, nodes = readNodes(path)
+    nodesById = {n.nodeid: n for n in nodes}
+    graph = interactiveGraph(conf)
+    graph.addNodes(nodes)
+    lastMessageId = None
+    for record in readCapture(path):
+        if record.WhichOneof("record") != "transmission":
+            continue
+        transmission = record.transmission
+        lastMessageId = transmission.message_id
+        if transmission.message_id < first:
+            continue
+        if first > 0 and len(graph.packets) == graph.packets.maxlen:
+            break
+        packet = interactivePacket(packetDict(transmission.packet), transmission.message_id)
+        packet.setTxRxs(nodesById[transmission.transmitter], [nodesById[rx] for rx in transmission.receivers])
+        packet.setRSSISNR(list(transmission.rssi), list(transmission.snr))
+        graph.packets.append(packet)
+    print("Replayed", len(nodes), "nodes and messages up to ID", lastMessageId, "from", path)
+    graph.initRoutes()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='replayCapture')
+    parser.add_argument('capture', type=str, nargs='?', default=os.path.join("out", "capture.bin"))
+    parser.add_argument('--stats', action='store_true', help='print statistics instead of plotting routes')
+    parser.add_argument('--first', type=int, default=0, help='first message ID to keep the route of')
+    args = parser.parse_args()
+    if args.stats:
+        stats(args.capture)
+    else:
+        replay(args.capture, args.first)
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from meshtastic import mesh_pb2
+
+from lib.capture import CaptureWriter
+from replayCapture import readStatistics
+
+
+def captureNode(nodeId):
+    return SimpleNamespace(nodeid=nodeId, hwId=nodeId+16, x=0.0, y=0.0, z=1.0, isRouter=False, isRepeater=False,
+                           isClientMute=False, hopLimit=3, antennaGain=0.0, neighborInfo=False)
+
+
+def meshPacket(fromNode, packetId, requestId=0):
+    packet = mesh_pb2.MeshPacket(id=packetId, to=0xFFFFFFFF)
+    setattr(packet, "from", fromNode.hwId)
+    packet.decoded.request_id = requestId
+    return packet
+
+
+def test_ack_does_not_count_as_reached(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    nodes = [captureNode(i) for i in range(3)]
+    writer = CaptureWriter(path)
+    for n in nodes:
+        writer.addNode(n)
+    # Node 0 sends a DM to node 2 via node 1, which ACKs it back along the same route with the same message ID
+    writer.addTransmission(nodes[0], 0, meshPacket(nodes[0], 1), [nodes[1]], [-90.0], [10.0])
+    writer.addTransmission(nodes[1], 0, meshPacket(nodes[0], 1), [nodes[0], nodes[2]], [-90.0, -90.0], [10.0, 10.0])
+    writer.addTransmission(nodes[2], 0, meshPacket(nodes[2], 2, requestId=1), [nodes[1]], [-90.0], [10.0])
+    writer.addTransmission(nodes[1], 0, meshPacket(nodes[2], 2, requestId=1), [nodes[0], nodes[2]], [-90.0, -90.0], [10.0, 10.0])
+    writer.close()
+
+    statistics = readStatistics(path)
+    assert statistics.nrReceived == 6
+    assert statistics.nrUseful == 2
+    assert statistics.reachability() == 100